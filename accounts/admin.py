@@ -1,13 +1,125 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Department, Faculty, Category, Level, Semester, Material
-from .forms import SignUpForm
+from django.core.paginator import Paginator
+from django.template.response import TemplateResponse
+from django.db import connection, DatabaseError
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Lower
+from django.utils.functional import cached_property
+from .models import (CustomUser, Department, Faculty, Category, Level, Semester, Material, DownloadRollup,
+                     ArchivedMaterial, normalize_code)
+from .bulk_edit import delete_materials, update_materials
+from .downloads import download_trend, trend_bars
+from .exports import export_response
+from .forms import BulkEditForm, ClassListForm, SignUpForm
+from .provisioning import ClassListError, StudentProvisioner, read_class_list
 
-class CustomUserAdmin(UserAdmin):
+
+def estimated_row_count(model):
+    """Return the planner's row estimate for a model's table, or None"""
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            elif connection.vendor == 'mysql':
+                cursor.execute(
+                    "SELECT table_rows FROM information_schema.tables "
+                    "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+            elif connection.vendor == 'sqlite':
+                # Only populated once ANALYZE has run
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Use the table estimate instead of COUNT(*) for large unfiltered changelists"""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_row_count(self.object_list.model)
+            if estimate is not None and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class PrefixSearchMixin:
+    """
+    Search the changelist by prefix on indexed, case-normalized columns
+    only, so a search is an index range scan rather than a table scan.
+
+    ``prefix_search`` pairs each searched column (a field name or an
+    expression with a matching index) with the function that normalizes
+    the search term for it. A term starting with ``contains:`` opts in to
+    the slow substring search over ``scan_search_fields``.
+    """
+    scan_keyword = 'contains:'
+    prefix_search = ()
+    scan_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.startswith(self.scan_keyword):
+            term = term[len(self.scan_keyword):].strip()
+            rule = Q()
+            for field in self.scan_search_fields:
+                rule |= Q(**{f'{field}__icontains': term})
+            return queryset.filter(rule), False
+        rule = Q()
+        for i, (column, normalize) in enumerate(self.prefix_search):
+            prefix = normalize(term)
+            if not prefix:
+                continue
+            if not isinstance(column, str):
+                queryset = queryset.alias(**{f'search_{i}': column})
+                column = f'search_{i}'
+            rule |= Q(**{f'{column}__startswith': prefix})
+        return (queryset.filter(rule) if rule else queryset.none()), False
+
+
+class DepartmentSearchMixin:
+    """
+    Match search terms against the small Department table first and filter
+    the changelist by department id, instead of a LIKE scan over the join.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        filtered, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            department_ids = list(
+                Department.objects.filter(name__icontains=search_term).values_list('id', flat=True)
+            )
+            if department_ids:
+                filtered |= queryset.filter(department_id__in=department_ids)
+        return filtered, may_have_duplicates
+
+
+class CustomUserAdmin(DepartmentSearchMixin, PrefixSearchMixin, UserAdmin):
     list_display = ('email', 'username', 'first_name', 'department', 'is_staff', 'is_uploader')
     list_filter = ('is_uploader', 'is_staff', 'is_superuser', 'department')
-    search_fields = ('email', 'username', 'first_name', 'last_name', 'department__name')
+    list_select_related = ('department',)
+    search_fields = ('email', 'username')
+    prefix_search = ((Lower('email'), str.lower), (Lower('username'), str.lower))
+    scan_search_fields = ('email', 'first_name', 'last_name')
+    search_help_text = ("Matches the start of an email address, username or department name. "
+                        "Prefix with contains: to search anywhere in emails and names (slower).")
     ordering = ('email',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     add_form = SignUpForm
 
@@ -55,10 +167,52 @@ class DepartmentAdmin(admin.ModelAdmin):
     list_display = ('name', 'code', 'faculty', 'slug')
     list_filter = ('faculty',)
     search_fields = ('name', 'code', 'faculty__name')
+    actions = ['provision_students']
     
     def has_module_permission(self, request):
         return request.user.is_superuser
 
+    @admin.action(description="Create student accounts from a class list")
+    def provision_students(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, "Select exactly one department.", messages.WARNING)
+            return None
+        department = queryset.get()
+        form = ClassListForm(request.POST, request.FILES) if 'apply' in request.POST else ClassListForm()
+        if form.is_valid():
+            try:
+                rows = read_class_list(form.cleaned_data['class_list'], form.cleaned_data['class_list'].name)
+                passwords = sum(1 for row in rows if row['password'])
+                if passwords > settings.ADMIN_CLASS_LIST_MAX_PASSWORDS:
+                    raise ClassListError(
+                        f"This list sets {passwords} passwords, and hashing more than "
+                        f"{settings.ADMIN_CLASS_LIST_MAX_PASSWORDS} would time out the request. Leave the "
+                        f"password column empty so students choose their own, or run "
+                        f"'manage.py provision_students'."
+                    )
+            except ClassListError as e:
+                form.add_error('class_list', str(e))
+            else:
+                # Hashed inline: a web worker must not fork a process pool (use the command for large lists)
+                report, _ = StudentProvisioner(department, workers=0,
+                                               send_email=form.cleaned_data['send_email']).run(rows)
+                self.message_user(request, f"Created {len(report.created)} accounts in {department.name}; "
+                                           f"skipped {report.skipped} already registered.")
+                for number, error in report.errors[:20]:
+                    self.message_user(request, f"Row {number}: {error}", messages.WARNING)
+                if len(report.errors) > 20:
+                    self.message_user(request, f"...and {len(report.errors) - 20} more invalid rows.",
+                                      messages.WARNING)
+                return None
+        return TemplateResponse(request, 'admin/accounts/department/provision_students.html', {
+            **self.admin_site.each_context(request),
+            'title': f"Create student accounts in {department.name}",
+            'opts': self.model._meta,
+            'department': department,
+            'form': form,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name',)
@@ -84,12 +238,78 @@ class SemesterAdmin(admin.ModelAdmin):
         return request.user.is_superuser
 
 @admin.register(Material)
-class MaterialAdmin(admin.ModelAdmin):
+class MaterialAdmin(DepartmentSearchMixin, PrefixSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'code', 'department', 'category', 'level', 'semester', 'upload_date', 'uploaded_by')
     list_filter = ('department', 'category', 'level', 'semester', 'upload_date')
-    search_fields = ('title', 'code', 'department__name')
+    list_select_related = ('department', 'category', 'level', 'semester', 'uploaded_by')
+    search_fields = ('code_key',)
+    prefix_search = (('code_key', normalize_code),)
+    scan_search_fields = ('title', 'code')
+    search_help_text = ("Matches the start of a course code or a department name. "
+                        "Prefix with contains: to search titles too (slower).")
     readonly_fields = ('uploaded_by', 'upload_date')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['bulk_edit', 'bulk_delete', 'export_csv', 'export_jsonl', 'export_downloads_csv']
     
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # bulk_delete replaces it: the stock action deletes and signals row by row
+        actions.pop('delete_selected', None)
+        return actions
+
+    def bulk_action_page(self, request, action, title, intro, submit_label, form=None):
+        return TemplateResponse(request, 'admin/accounts/material/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'intro': intro,
+            'opts': self.model._meta,
+            'form': form,
+            'action': action,
+            'submit_label': submit_label,
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description="Change semester, category, level or session", permissions=['change'])
+    def bulk_edit(self, request, queryset):
+        form = BulkEditForm(request.POST) if 'apply' in request.POST else BulkEditForm()
+        if form.is_valid():
+            report = update_materials(queryset, form.changes())
+            self.message_user(request, f"Updated {report.count} materials.")
+            return None
+        count = queryset.count()
+        return self.bulk_action_page(
+            request, 'bulk_edit', f"Change {count} materials",
+            "Fields left empty keep their current values.", "Apply", form,
+        )
+
+    @admin.action(description="Delete selected materials", permissions=['delete'])
+    def bulk_delete(self, request, queryset):
+        if 'apply' in request.POST:
+            report = delete_materials(queryset)
+            self.message_user(request, f"Deleted {report.count} materials; their files are being removed.")
+            return None
+        count = queryset.count()
+        return self.bulk_action_page(
+            request, 'bulk_delete', f"Delete {count} materials",
+            f"{count} materials, their download history and their files will be deleted. This cannot be undone.",
+            "Delete",
+        )
+
+    @admin.action(description="Export selected materials as CSV")
+    def export_csv(self, request, queryset):
+        return export_response('materials', queryset, 'csv')
+
+    @admin.action(description="Export selected materials as JSON Lines")
+    def export_jsonl(self, request, queryset):
+        return export_response('materials', queryset, 'jsonl')
+
+    @admin.action(description="Export download stats of selected materials (CSV)")
+    def export_downloads_csv(self, request, queryset):
+        return export_response('downloads', queryset, 'csv')
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.uploaded_by = request.user
@@ -99,42 +319,67 @@ class MaterialAdmin(admin.ModelAdmin):
         return request.user.is_authenticated and (request.user.is_superuser or request.user.is_uploader)
     
     def has_view_permission(self, request, obj=None):
-        if not request.user.is_authenticated:
-            return False
-        if request.user.is_superuser:
-            return True
         if obj:
-            return obj.department == request.user.department
-        return request.user.is_uploader
+            return obj.is_editable_by(request.user)
+        return request.user.is_authenticated and (request.user.is_superuser or request.user.is_uploader)
     
     def has_add_permission(self, request):
         return request.user.is_authenticated and (request.user.is_uploader or request.user.is_superuser)
     
     def has_change_permission(self, request, obj=None):
-        if not request.user.is_authenticated:
-            return False
-        if request.user.is_superuser:
-            return True
         if obj:
-            return obj.uploaded_by == request.user or obj.department == request.user.department
-        return request.user.is_uploader
+            return obj.is_editable_by(request.user)
+        return request.user.is_authenticated and (request.user.is_superuser or request.user.is_uploader)
     
     def has_delete_permission(self, request, obj=None):
         return self.has_change_permission(request, obj)
     
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        if request.user.is_superuser:
-            return qs
-        if request.user.is_uploader:
-            return qs.filter(department=request.user.department)
-        return qs.none()
+        return super().get_queryset(request).editable_by(request.user)
     
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "department" and request.user.is_uploader:
             kwargs["queryset"] = Department.objects.filter(id=request.user.department.id)
-        if db_field.name == "category" and request.user.is_uploader:
-            kwargs["queryset"] = Category.objects.filter(department=request.user.department)
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+@admin.register(DownloadRollup)
+class DownloadRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'granularity', 'material_title', 'department', 'level', 'count')
+    list_filter = ('granularity', 'department', 'level', 'bucket')
+    # Not 'material': rollups of archived materials point at ArchivedMaterial ids, and the join would drop them
+    list_select_related = ('department', 'level')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        titles = [Subquery(model.objects.filter(pk=OuterRef('material_id')).values('title')[:1])
+                  for model in (Material, ArchivedMaterial)]
+        return super().get_queryset(request).annotate(material_title=Coalesce(*titles))
+
+    @admin.display(description="Material", ordering='material_title')
+    def material_title(self, obj):
+        return obj.material_title
+
+    def has_module_permission(self, request):
+        return request.user.is_superuser
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        cl = getattr(response, 'context_data', {}).get('cl')
+        if cl is not None:
+            response.context_data['trend'] = trend_bars(download_trend(queryset=cl.queryset, periods=30))
+        return response
+
 admin.site.register(CustomUser, CustomUserAdmin)
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+Admission control for downloads and media files.
+
+Every download must pass three checks before it reaches the view:
+
+* a per-user token bucket (``ADMISSION_RATE`` downloads per second,
+  bursts of up to ``ADMISSION_BURST``), answered with 429 when empty;
+* at most ``ADMISSION_USER_STREAMS`` concurrent streams per user (429);
+* at most ``ADMISSION_GLOBAL_STREAMS`` concurrent streams in total (503).
+
+Rejections carry ``Retry-After`` so clients back off instead of queueing.
+Buckets are ``TokenBucket`` rows and stream counts ``StreamCounter`` rows,
+shared by every worker. Both are changed with single conditional
+``UPDATE`` statements (a token is spent only ``WHERE`` the refilled
+bucket holds one), so concurrent workers can neither overspend a bucket,
+overshoot a limit nor drive a count below zero. A slot is
+released once the response body has been sent, or when the response is
+closed without it (the client has gone).
+"""
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest, Least
+from django.db.models.lookups import GreaterThanOrEqual
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+from .models import StreamCounter, TokenBucket
+
+
+class Rejected(Exception):
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+    def response(self):
+        response = HttpResponse(self.reason, status=self.status, content_type='text/plain')
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+class AdmissionController:
+    def __init__(self, clock=time.time, rate=None, burst=None, user_streams=None, global_streams=None):
+        self.clock = clock
+        self.rate = rate or settings.ADMISSION_RATE
+        self.burst = burst or settings.ADMISSION_BURST
+        self.user_streams = user_streams or settings.ADMISSION_USER_STREAMS
+        self.global_streams = global_streams or settings.ADMISSION_GLOBAL_STREAMS
+        self.slot_ttl = settings.ADMISSION_STREAM_TTL
+
+    def _refilled(self, now):
+        """The bucket's tokens as of ``now``, as an SQL expression"""
+        elapsed = Greatest(Value(now) - F('updated'), Value(0.0))
+        return Least(Value(float(self.burst)), F('tokens') + elapsed * Value(float(self.rate)))
+
+    def _spend(self, key, now):
+        """Take a token from ``key``'s bucket if it holds one; True if it did"""
+        refilled = self._refilled(now)
+        return TokenBucket.objects.filter(GreaterThanOrEqual(refilled, 1.0), key=key).update(
+            tokens=refilled - 1, updated=now,
+        ) == 1
+
+    def _take_token(self, client):
+        key = f'admission:bucket:{client}'
+        now = self.clock()
+        if self._spend(key, now):
+            return
+        _, created = TokenBucket.objects.get_or_create(key=key, defaults={'tokens': self.burst - 1, 'updated': now})
+        # Another worker may have created the row between the update and the insert
+        if created or self._spend(key, now):
+            return
+        tokens, updated = TokenBucket.objects.filter(key=key).values_list('tokens', 'updated').get()
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+        raise Rejected(429, (1 - tokens) / self.rate, "Too many downloads, slow down.")
+
+    def _increment(self, key, limit, now):
+        """Add one to ``key``'s count if it is under ``limit`` (or has expired); True if it was"""
+        expired = Q(expires__lte=now)
+        return StreamCounter.objects.filter(Q(key=key), Q(count__lt=limit) | expired).update(
+            count=Case(When(expired, then=Value(1)), default=F('count') + 1),
+            expires=now + timedelta(seconds=self.slot_ttl),
+        ) == 1
+
+    def _claim_slot(self, key, limit):
+        now = datetime.fromtimestamp(self.clock(), tz=dt_timezone.utc)
+        if self._increment(key, limit, now):
+            return True
+        _, created = StreamCounter.objects.get_or_create(
+            key=key, defaults={'count': 1, 'expires': now + timedelta(seconds=self.slot_ttl)})
+        # Another worker may have created the row between the update and the insert
+        return created or self._increment(key, limit, now)
+
+    def _release_slot(self, key):
+        StreamCounter.objects.filter(key=key, count__gt=0).update(count=F('count') - 1)
+
+    def admit(self, client):
+        """
+        Reserve a stream for ``client`` and return a callable that frees it,
+        or raise ``Rejected``.
+        """
+        self._take_token(client)
+        user_key = f'admission:streams:{client}'
+        if not self._claim_slot(user_key, self.user_streams):
+            raise Rejected(429, settings.ADMISSION_RETRY_AFTER, "Too many downloads in progress.")
+        if not self._claim_slot('admission:streams', self.global_streams):
+            self._release_slot(user_key)
+            raise Rejected(503, settings.ADMISSION_RETRY_AFTER, "Server busy, try again shortly.")
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._release_slot('admission:streams')
+                self._release_slot(user_key)
+        return release
+
+
+class _ReleasingContent:
+    """
+    Streaming content that frees a stream slot once it has been sent. The
+    response calls ``close`` as well, which covers a body never iterated.
+    """
+
+    def __init__(self, content, release):
+        self.content = content
+        self.release = release
+
+    def close(self):
+        self.release()
+
+
+class _ReleasingIterator(_ReleasingContent):
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.release()
+
+
+class _ReleasingAsyncIterator(_ReleasingContent):
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            await sync_to_async(self.release)()
+
+
+class _ReleasingFile(_ReleasingContent):
+    """A ``FileResponse`` file, kept file-like so servers can still send it with sendfile"""
+
+    def __getattr__(self, name):
+        return getattr(self.content, name)
+
+    def close(self):
+        try:
+            self.content.close()
+        finally:
+            self.release()
+
+
+def release_after(response, release):
+    """Hand ``release`` to ``response``, to be called once its body is done"""
+    if not response.streaming:
+        release()
+    elif getattr(response, 'file_to_stream', None) is not None:
+        response.streaming_content = _ReleasingFile(response.file_to_stream, release)
+    elif response.is_async:
+        response.streaming_content = _ReleasingAsyncIterator(response.streaming_content, release)
+    else:
+        response.streaming_content = _ReleasingIterator(response.streaming_content, release)
+    return response
+
+
+class AdmissionControlMiddleware:
+    """Applies ``AdmissionController`` to ``track_download`` and ``MEDIA_URL``"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.controller = AdmissionController()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @cached_property
+    def guarded_prefixes(self):
+        # The download route's parent path (e.g. /download/), so requests are matched without resolving them
+        download = reverse('track_download', args=[0])
+        return tuple(prefix for prefix in (settings.MEDIA_URL, download[:download.rindex('/0/') + 1]) if prefix)
+
+    def _guarded(self, request):
+        return request.path.startswith(self.guarded_prefixes)
+
+    @staticmethod
+    def _client(request, user):
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+    def _admit(self, request, user):
+        try:
+            return self.controller.admit(self._client(request, user)), None
+        except Rejected as rejection:
+            return None, rejection.response()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._guarded(request):
+            return self.get_response(request)
+        release, rejected = self._admit(request, getattr(request, 'user', None))
+        if rejected:
+            return rejected
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            release()
+            raise
+        return release_after(response, release)
+
+    async def __acall__(self, request):
+        if not self._guarded(request):
+            return await self.get_response(request)
+        user = await request.auser() if hasattr(request, 'auser') else None
+        release, rejected = await sync_to_async(self._admit)(request, user)
+        if rejected:
+            return rejected
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            await sync_to_async(release)()
+            raise
+        return await sync_to_async(release_after)(response, release)
@@ -0,0 +1,247 @@
+"""
+Read-only JSON catalog API for mobile and offline clients.
+
+Every resource is listed in ``(modified, id)`` order with keyset
+pagination. The cursor returned with the last page is also the sync
+point: passing it back later returns only rows changed since then, plus
+the ids of rows deleted since then, taken from ``Tombstone``. A material
+moved to another department leaves a tombstone in the old one. Renaming
+a level, category or semester bumps ``modified`` on the materials listed
+under that name, so they are sent again. Clients pick
+fields with ``?fields=`` and can revalidate with ``If-None-Match``. The
+ETag comes from one aggregate query, so an unchanged listing answers 304
+without reading the page.
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import condition, require_GET
+
+from .bulk_signals import in_bulk_change
+from .models import Category, Department, Faculty, Level, Material, Semester, Tombstone
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Resource:
+    """How one model is exposed: field name -> ORM lookup used to read it"""
+
+    def __init__(self, name, model, fields):
+        self.name = name
+        self.model = model
+        self.fields = fields
+
+    def queryset(self, department=None):
+        return self.model.objects.order_by()
+
+    def tombstones(self, department=None):
+        return Tombstone.objects.filter(model=self.name)
+
+    def serialize(self, row, fields):
+        return {field: row[self.fields[field]] for field in fields}
+
+
+class MaterialResource(Resource):
+    def queryset(self, department=None):
+        materials = super().queryset()
+        if department is not None:
+            materials = materials.filter(department=department)
+        return materials
+
+    def tombstones(self, department=None):
+        tombstones = super().tombstones()
+        if department is not None:
+            tombstones = tombstones.filter(department_id=department.id)
+        return tombstones
+
+    def serialize(self, row, fields):
+        data = super().serialize(row, [field for field in fields if field != 'download_url'])
+        if 'download_url' in fields:
+            data['download_url'] = reverse('track_download', args=[row['id']])
+        return data
+
+
+RESOURCES = {
+    'faculties': Resource('faculty', Faculty, {
+        'id': 'id', 'name': 'name', 'code': 'code', 'slug': 'slug', 'modified': 'modified',
+    }),
+    'departments': Resource('department', Department, {
+        'id': 'id', 'name': 'name', 'code': 'code', 'slug': 'slug',
+        'faculty': 'faculty__slug', 'modified': 'modified',
+    }),
+    'materials': MaterialResource('material', Material, {
+        'id': 'id', 'title': 'title', 'code': 'code', 'session': 'session',
+        'department': 'department__slug', 'level': 'level__name',
+        'category': 'category__name', 'semester': 'semester__name',
+        'upload_date': 'upload_date', 'modified': 'modified', 'download_url': 'id',
+    }),
+}
+
+
+def encode_cursor(modified, pk, tombstone_id):
+    payload = json.dumps([modified.isoformat() if modified else None, pk, tombstone_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """``(modified, pk, tombstone_id)`` from an opaque cursor string"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        modified, pk, tombstone_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (datetime.fromisoformat(modified) if modified else None, int(pk), int(tombstone_id))
+    except (ValueError, TypeError):
+        raise BadRequest("Invalid cursor.")
+
+
+def requested_fields(resource, value):
+    if not value:
+        return list(resource.fields)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in resource.fields]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}.")
+    return fields
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('limit', settings.CATALOG_API_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("Invalid limit.")
+    return max(1, min(size, settings.CATALOG_API_MAX_PAGE_SIZE))
+
+
+def catalog_page(resource, department, fields, cursor, limit, last_tombstone=None):
+    """
+    One page of rows after ``cursor`` and the tombstones after it.
+    Without a cursor the listing starts from the beginning and past
+    deletions (up to ``last_tombstone``, looked up if not given) are
+    skipped, since a fresh client has nothing to drop.
+    """
+    rows = resource.queryset(department)
+    tombstones = resource.tombstones(department)
+    if cursor:
+        modified, pk, tombstone_id = decode_cursor(cursor)
+        if modified is not None:
+            rows = rows.filter(Q(modified__gt=modified) | Q(modified=modified, id__gt=pk))
+        deleted = list(tombstones.filter(id__gt=tombstone_id)
+                       .order_by('id').values_list('id', 'object_id')[:limit + 1])
+    else:
+        modified, pk = None, 0
+        if last_tombstone is None:
+            last_tombstone = tombstones.aggregate(last=Max('id'))['last']
+        tombstone_id = last_tombstone or 0
+        deleted = []
+
+    columns = {resource.fields[field] for field in fields} | {'id', 'modified'}
+    results = list(rows.order_by('modified', 'id').values(*columns)[:limit + 1])
+    has_more = len(results) > limit or len(deleted) > limit
+    results, deleted = results[:limit], deleted[:limit]
+    if results:
+        modified, pk = results[-1]['modified'], results[-1]['id']
+    if deleted:
+        tombstone_id = deleted[-1][0]
+    return {
+        'results': [resource.serialize(row, fields) for row in results],
+        'deleted': [object_id for _, object_id in deleted],
+        'cursor': encode_cursor(modified, pk, tombstone_id),
+        'has_more': has_more,
+    }
+
+
+def _department(request, resource):
+    """The ``?department=`` scope; only materials can be scoped"""
+    slug = request.GET.get('department')
+    if not slug or not isinstance(resource, MaterialResource):
+        return None
+    return get_object_or_404(Department, slug=slug)
+
+
+def catalog_etag(request, resource):
+    """
+    Changes whenever a row or tombstone in scope changes, or the query does.
+    Saves and updates move the latest ``modified`` and deletions add a
+    tombstone, so two index lookups cover every change without counting rows.
+    """
+    resource = RESOURCES[resource]
+    department = _department(request, resource)
+    modified = resource.queryset(department).aggregate(last=Max('modified'))['last']
+    deleted = resource.tombstones(department).aggregate(last=Max('id'))['last']
+    # Reused by the view so a 200 costs no extra lookups
+    request.catalog_scope = (department, deleted)
+    query = sorted(request.GET.items())
+    return hashlib.md5(repr((modified, deleted, query)).encode()).hexdigest()
+
+
+@login_required
+@require_GET
+@condition(etag_func=catalog_etag)
+def catalog(request, resource):
+    resource = RESOURCES[resource]
+    department, last_tombstone = request.catalog_scope
+    try:
+        page = catalog_page(
+            resource,
+            department,
+            requested_fields(resource, request.GET.get('fields')),
+            request.GET.get('cursor'),
+            page_size(request),
+            last_tombstone,
+        )
+    except BadRequest as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    response = JsonResponse(page)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@receiver(post_delete, sender=Faculty, dispatch_uid='accounts.api.faculty_deleted')
+@receiver(post_delete, sender=Department, dispatch_uid='accounts.api.department_deleted')
+@receiver(post_delete, sender=Material, dispatch_uid='accounts.api.material_deleted')
+def record_tombstone(sender, instance, **kwargs):
+    if in_bulk_change():
+        return
+    Tombstone.objects.create(
+        model=sender._meta.model_name,
+        object_id=instance.pk,
+        department_id=getattr(instance, 'department_id', None),
+    )
+
+
+@receiver(post_save, sender=Material, dispatch_uid='accounts.api.material_moved')
+def record_move(sender, instance, created, **kwargs):
+    """A material moved to another department is gone from the old department's sync"""
+    if created or in_bulk_change() or instance.moved_from_department_id is None:
+        return
+    Tombstone.objects.create(model='material', object_id=instance.pk,
+                             department_id=instance.moved_from_department_id)
+
+
+# Materials are listed with these names, so renaming one changes every material that uses it
+@receiver(pre_save, sender=Level, dispatch_uid='accounts.api.level_renaming')
+@receiver(pre_save, sender=Category, dispatch_uid='accounts.api.category_renaming')
+@receiver(pre_save, sender=Semester, dispatch_uid='accounts.api.semester_renaming')
+def check_rename(sender, instance, **kwargs):
+    stored = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first() if instance.pk else None
+    instance._renamed = stored is not None and stored != instance.name
+
+
+@receiver(post_save, sender=Level, dispatch_uid='accounts.api.level_renamed')
+@receiver(post_save, sender=Category, dispatch_uid='accounts.api.category_renamed')
+@receiver(post_save, sender=Semester, dispatch_uid='accounts.api.semester_renamed')
+def touch_renamed(sender, instance, **kwargs):
+    if getattr(instance, '_renamed', False):
+        Material.objects.filter(**{sender._meta.model_name: instance.pk}).update(modified=timezone.now())
@@ -0,0 +1,253 @@
+"""
+Background import of a ZIP archive into one Material per entry.
+
+Entries are streamed out of the archive one at a time into a bounded
+temporary file, so neither the archive nor any entry is held in memory.
+Sizes are counted while decompressing rather than trusted from the
+archive's headers. An archive that inflates past ``ARCHIVE_MAX_TOTAL_SIZE``
+or ``ARCHIVE_MAX_RATIO`` is abandoned as a likely zip bomb. Entries that
+are only invalid (wrong type, unknown metadata) are reported and skipped.
+
+Entry metadata comes from a ``manifest.csv`` or ``manifest.json`` at the
+root of the archive (same columns as ``import_materials``), or failing
+that from file names such as ``CSC101 - Data Structures.pdf``. Level,
+category, semester and session default to the values chosen on the form.
+
+Jobs live in an in-process pool, so a worker restart strands the ones it
+had queued or was running. ``resume_archive_imports`` (run at deploy, or
+from cron) picks up jobs that have not moved for
+``ARCHIVE_IMPORT_STALE_MINUTES``. Entries a job already imported are
+recognised by checksum and skipped when it runs again. A queued job can
+be stale only because the pool is busy, so the pool may still reach it
+after it was resumed. ``run_import`` therefore claims the job with one
+conditional UPDATE from ``queued`` to ``running``, and the loser returns
+without touching it.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import tasks
+from .bulk_import import (Lookups, ManifestError, RowError, check_upload, material_fields,
+                          parse_manifest)
+from .facets import bump_department
+from .forms import MAX_UPLOAD_SIZE
+from .models import ArchiveImport, Material, normalize_code, sharded_name
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAMES = ('manifest.csv', 'manifest.json')
+MANIFEST_MAX_SIZE = 1024 * 1024
+FILENAME_PATTERN = re.compile(r'^(?P<code>[A-Za-z]{2,4}[ _-]?\d{3}[A-Za-z]?)[ _-]+(?P<title>.+)$')
+COPY_CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 50
+PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+
+
+class ArchiveError(Exception):
+    """The whole archive is rejected"""
+
+
+def submit(job):
+    """Run the import after the current transaction commits"""
+    tasks.defer('archive-import', settings.ARCHIVE_IMPORT_WORKERS, run_import, job.pk)
+
+
+def stale_jobs(now=None):
+    """Queued or running jobs that have not been updated for ``ARCHIVE_IMPORT_STALE_MINUTES``"""
+    cutoff = (now or timezone.now()) - timedelta(minutes=settings.ARCHIVE_IMPORT_STALE_MINUTES)
+    return ArchiveImport.objects.filter(status__in=('queued', 'running'), updated__lt=cutoff).order_by('pk')
+
+
+def resume_stale_jobs(now=None):
+    """Run stranded jobs again, or fail those whose archive is gone; returns (resumed, failed)"""
+    resumed = failed = 0
+    for job in stale_jobs(now):
+        if not job.archive or not job.archive.storage.exists(job.archive.name):
+            job.status, job.message = 'failed', "The archive was lost when its worker stopped; upload it again."
+            job.save(update_fields=['status', 'message', 'updated'])
+            failed += 1
+            continue
+        # Only if nothing touched the job since it was found stale; a worker may have just claimed it
+        reset = ArchiveImport.objects.filter(pk=job.pk, status=job.status, updated=job.updated).update(
+            status='queued', total=0, processed=0, imported=0, skipped=0, errors=[], message='',
+            updated=timezone.now(),
+        )
+        if not reset:
+            continue
+        try:
+            run_import(job.pk)
+        except Exception:
+            # run_import has marked the job failed; carry on with the others
+            logger.exception("Resumed archive import %s failed", job.pk)
+        resumed += 1
+    return resumed, failed
+
+
+def entry_row(info, manifest, job):
+    """Manifest-style row for one archive entry; raises RowError"""
+    name = os.path.basename(info.filename)
+    row = manifest.get(name)
+    if row is None:
+        match = FILENAME_PATTERN.match(os.path.splitext(name)[0])
+        if match is None:
+            raise RowError(f"Cannot tell the course code from '{name}'; add it to manifest.csv.")
+        row = {'code': normalize_code(match['code']), 'title': match['title'].replace('_', ' ').strip()[:50]}
+    defaults = {
+        'level': job.level.name,
+        'semester': job.semester.name if job.semester else '',
+        'category': job.category.name if job.category else '',
+        'session': job.session,
+    }
+    return {**defaults, **{key: value for key, value in row.items() if value}}
+
+
+def read_manifest(archive):
+    for info in archive.infolist():
+        if info.filename in MANIFEST_NAMES:
+            if info.file_size > MANIFEST_MAX_SIZE:
+                raise ArchiveError(f"{info.filename} is larger than {MANIFEST_MAX_SIZE // 1024} KB.")
+            with archive.open(info) as stream:
+                try:
+                    return {row['file']: row for row in parse_manifest(stream, info.filename)}
+                except ManifestError as e:
+                    raise ArchiveError(str(e))
+    return {}
+
+
+class Budget:
+    """Uncompressed bytes still allowed for the whole archive"""
+
+    def __init__(self, total):
+        self.remaining = total
+
+    def spend(self, size):
+        self.remaining -= size
+        if self.remaining < 0:
+            raise ArchiveError(
+                f"Archive expands to more than {settings.ARCHIVE_MAX_TOTAL_SIZE // (1024 * 1024)} MB."
+            )
+
+
+def extract_entry(archive, info, budget, target):
+    """
+    Decompress one entry into ``target``, enforcing the per-file size,
+    the archive's total budget and the compression ratio as bytes arrive.
+    Returns the SHA-256 of the content.
+    """
+    max_ratio = settings.ARCHIVE_MAX_RATIO
+    digest = hashlib.sha256()
+    written = 0
+    with archive.open(info) as stream:
+        while chunk := stream.read(COPY_CHUNK_SIZE):
+            written += len(chunk)
+            budget.spend(len(chunk))
+            if written > max(info.compress_size, 1) * max_ratio:
+                raise ArchiveError(f"'{info.filename}' expands more than {max_ratio}x; possible zip bomb.")
+            if written > MAX_UPLOAD_SIZE:
+                check_upload(info.filename, written)
+            digest.update(chunk)
+            target.write(chunk)
+    return digest.hexdigest()
+
+
+class Progress:
+    """Writes the job's counters at most every PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, job):
+        self.job = job
+        self.last = 0
+
+    def save(self, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.job.save(update_fields=['status', 'total', 'processed', 'imported', 'skipped',
+                                         'errors', 'message', 'updated'])
+
+
+def run_import(job_id):
+    # Claim the job; whoever loses (a pool worker or resume_stale_jobs running it too) leaves it alone
+    claimed = ArchiveImport.objects.filter(pk=job_id, status='queued').update(status='running',
+                                                                            updated=timezone.now())
+    if not claimed:
+        return
+    job = ArchiveImport.objects.select_related('level', 'category', 'semester', 'department').get(pk=job_id)
+    progress = Progress(job)
+    try:
+        with job.archive.open('rb') as raw, zipfile.ZipFile(raw) as archive:
+            import_entries(job, archive, progress)
+        job.status = 'done'
+    except (ArchiveError, zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+        job.status, job.message = 'failed', str(e)
+    except Exception as e:
+        job.status, job.message = 'failed', f"Unexpected error: {e}"
+        raise
+    finally:
+        progress.save(force=True)
+        if job.imported:
+            bump_department(job.department_id)
+        if job.status in ('done', 'failed'):
+            job.archive.delete(save=False)
+
+
+def import_entries(job, archive, progress):
+    entries = [info for info in archive.infolist()
+               if not info.is_dir() and info.filename not in MANIFEST_NAMES
+               and not os.path.basename(info.filename).startswith('.')]
+    if len(entries) > settings.ARCHIVE_MAX_ENTRIES:
+        raise ArchiveError(f"Archive has {len(entries)} files; the limit is {settings.ARCHIVE_MAX_ENTRIES}.")
+    manifest = read_manifest(archive)
+    lookups = Lookups()
+    budget = Budget(settings.ARCHIVE_MAX_TOTAL_SIZE)
+    seen = set(Material.objects.filter(department=job.department)
+               .exclude(checksum='').values_list('checksum', flat=True))
+    job.total = len(entries)
+    batch = []
+    try:
+        for info in entries:
+            try:
+                fields = material_fields(entry_row(info, manifest, job), lookups)
+                # The header size may lie; extract_entry counts the real bytes
+                check_upload(info.filename, info.file_size)
+                with tempfile.TemporaryFile() as target:
+                    checksum = extract_entry(archive, info, budget, target)
+                    if checksum in seen:
+                        job.skipped += 1
+                    else:
+                        seen.add(checksum)
+                        target.seek(0)
+                        name = default_storage.save(sharded_name(info.filename), File(target))
+                        batch.append(Material(file=name, checksum=checksum, department=job.department,
+                                              uploaded_by=job.uploaded_by, **fields))
+            except RowError as e:
+                job.errors.append({'file': info.filename, 'error': str(e)})
+            job.processed += 1
+            if len(batch) >= BATCH_SIZE:
+                create_batch(job, batch)
+                batch = []
+            progress.save()
+        create_batch(job, batch)
+    except BaseException:
+        # Files stored for a batch that never reached the database
+        for material in batch:
+            default_storage.delete(material.file.name)
+        raise
+
+
+def create_batch(job, batch):
+    if batch:
+        with transaction.atomic():
+            Material.objects.bulk_create(batch)
+        job.imported += len(batch)
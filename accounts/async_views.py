@@ -0,0 +1,157 @@
+"""
+Async versions of the download, listing and AJAX views.
+
+They are routed instead of their counterparts in ``views`` when the site
+runs under ASGI (see ``studyhub/asgi.py``). A download then holds an
+event-loop task rather than a worker thread while a slow client reads it,
+so one worker can stream to many clients at once.
+"""
+import asyncio
+import logging
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import F
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render
+from django.utils.http import content_disposition_header
+
+from .downloads import record_download
+from .hotfiles import hot_files
+from .live import broker
+from .pwa import offline_page
+from .tiering import archived_download, archived_matches
+from .models import Material, Category, Semester, Department
+from .trending import top_materials
+from .facets import department_facets, selected_filters
+from .views import material_listing
+
+logger = logging.getLogger(__name__)
+
+
+async def _file_chunks(path, chunk_size):
+    """Read a file chunk by chunk without blocking the event loop"""
+    handle = await asyncio.to_thread(open, path, 'rb')
+    try:
+        while True:
+            chunk = await asyncio.to_thread(handle.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(handle.close)
+
+
+async def _mapped_chunks(mapped, chunk_size):
+    """Stream a hot file straight from its shared mapping"""
+    try:
+        for chunk in mapped.chunks(chunk_size):
+            yield chunk
+    finally:
+        mapped.close()
+
+
+@login_required
+async def track_download(request, pk):
+    material = await Material.objects.only('file', 'department', 'level').filter(pk=pk).afirst()
+    if material is None:
+        # Past sessions live in the archive tier
+        return await sync_to_async(archived_download)(pk, await request.auser())
+
+    file_path = material.file.path
+    # Opening stats the file and may map it; neither belongs on the event loop
+    mapped = await sync_to_async(hot_files.open)(file_path)
+    if mapped is not None:
+        size = mapped.size
+        chunks = _mapped_chunks(mapped, settings.DOWNLOAD_CHUNK_SIZE)
+    else:
+        try:
+            size = (await asyncio.to_thread(os.stat, file_path)).st_size
+        except OSError:
+            logger.exception("Download of material %s failed", pk)
+            raise Http404("File unavailable.")
+        chunks = _file_chunks(file_path, settings.DOWNLOAD_CHUNK_SIZE)
+
+    # Only downloads that actually start are counted
+    await Material.objects.filter(pk=pk).aupdate(download_count=F('download_count') + 1)
+    record_download(material, await request.auser())
+    response = StreamingHttpResponse(chunks, content_type='application/octet-stream')
+    response['Content-Length'] = str(size)
+    response['Content-Disposition'] = content_disposition_header(
+        True, os.path.basename(file_path)
+    )
+    return response
+
+
+@login_required
+async def material_list_view(request, slug):
+    department = await aget_object_or_404(Department, slug=slug)
+
+    filters = selected_filters(request.GET)
+    search_query = request.GET.get('search', '')
+
+    facets, total = await sync_to_async(department_facets)(department.id, search_query, filters)
+    materials = material_listing(department, filters, search_query)
+    context = {
+        'live_updates': settings.ASYNC_VIEWS,
+        'department': department,
+        'materials': [material async for material in materials],
+        'archived': await sync_to_async(archived_matches)(department, filters, search_query),
+        'facets': facets,
+        'total': total,
+        'search_query': search_query,
+        'trending': await sync_to_async(top_materials)(department.id, filters.get('level'), limit=5),
+    }
+    # The base template reads request.user and messages, which are sync-only
+    return offline_page(await sync_to_async(render)(request, 'material-list.html', context))
+
+
+async def _event_stream(department_id, heartbeat):
+    # Subscribing on first iteration means a stream that is never started leaks nothing
+    subscription = broker.subscribe(department_id)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                frame = await subscription.get(heartbeat)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection
+                yield ': heartbeat\n\n'
+                continue
+            yield frame
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@login_required
+async def material_events(request, slug):
+    """Server-Sent Events stream of materials added to or removed from a department"""
+    department = await aget_object_or_404(Department.objects.only('id'), slug=slug)
+    response = StreamingHttpResponse(
+        _event_stream(department.id, settings.LIVE_UPDATES_HEARTBEAT),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def load_departments(request):
+    faculty_id = request.GET.get('faculty_id')
+    departments = Department.objects.filter(faculty_id=faculty_id).order_by('name')
+    departments_data = [{'id': dept.id, 'name': dept.name} async for dept in departments]
+    return JsonResponse(departments_data, safe=False)
+
+
+async def load_categories(request):
+    categories = Category.objects.all().order_by('name')
+    categories_data = [{'id': cat.id, 'name': cat.name} async for cat in categories]
+    return JsonResponse(categories_data, safe=False)
+
+
+async def load_semesters(request):
+    semesters = Semester.objects.all().order_by('name')
+    semesters_data = [{'id': sem.id, 'name': sem.name} async for sem in semesters]
+    return JsonResponse(semesters_data, safe=False)
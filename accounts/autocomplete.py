@@ -0,0 +1,160 @@
+"""
+Prefix indexes behind the search-box autocomplete.
+
+Each department gets a sorted array of normalized course codes and title
+words. Lookups are a binary search followed by a short forward scan, so
+they do not touch the database. Indexes live in process memory and are
+rebuilt the first time they are used after the department's facet
+generation changes (see ``facets``). Department suggestions use a single
+index over every department, rebuilt when a department or faculty
+changes.
+"""
+import bisect
+import threading
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from . import facets
+from .models import Department, Faculty, Material, normalize_code
+
+DEPARTMENTS_GENERATION = 'autocomplete:departments:generation'
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Case-folded words, e.g. "Intro  to Algorithms" -> ['intro', 'to', 'algorithms']"""
+    return text.casefold().split()
+
+
+def word_suffixes(text):
+    """Keys that let a prefix match from any word: "data structures", "structures" """
+    words = normalize_text(text)
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class SuggestionIndex:
+    """Sorted ``(key, suggestion)`` pairs searched by key prefix"""
+
+    def __init__(self, pairs):
+        pairs = sorted(set(pairs))
+        self.keys = [key for key, _ in pairs]
+        self.suggestions = [suggestion for _, suggestion in pairs]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, prefix, limit):
+        """Up to ``limit`` distinct suggestions whose key starts with ``prefix``, in key order"""
+        if not prefix:
+            return []
+        results = []
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(results) < limit:
+            if not self.keys[position].startswith(prefix):
+                break
+            suggestion = self.suggestions[position]
+            if suggestion not in results:
+                results.append(suggestion)
+            position += 1
+        return results
+
+
+class MaterialIndex:
+    """Codes and titles for one department's materials"""
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.codes = SuggestionIndex((code_key, code_key) for code_key, _ in rows if code_key)
+        self.titles = SuggestionIndex(
+            (key, title) for _, title in rows for key in word_suffixes(title)
+        )
+
+    @classmethod
+    def build(cls, department_id):
+        rows = (Material.objects.filter(department_id=department_id)
+                .order_by().values_list('code_key', 'title').distinct())
+        return cls(rows)
+
+    def search(self, query, limit):
+        suggestions = [{'kind': 'code', 'value': code}
+                       for code in self.codes.search(normalize_code(query), limit)]
+        title_prefix = ' '.join(normalize_text(query))
+        suggestions += [{'kind': 'title', 'value': title}
+                        for title in self.titles.search(title_prefix, limit - len(suggestions))]
+        return suggestions
+
+
+class DepartmentIndex:
+    """Names, codes and faculty names of every department"""
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.slugs = {slug: department_id for department_id, _, _, slug, _ in rows}
+        suggestions = {
+            department_id: (name, code, reverse('material_list', args=[slug]))
+            for department_id, name, code, slug, _ in rows
+        }
+        pairs = []
+        for department_id, name, code, _, faculty in rows:
+            suggestion = suggestions[department_id]
+            pairs.append((normalize_code(code).casefold(), suggestion))
+            pairs += [(key, suggestion) for key in word_suffixes(name)]
+            pairs += [(key, suggestion) for key in word_suffixes(faculty)]
+        self.names = SuggestionIndex(pairs)
+
+    @classmethod
+    def build(cls):
+        return cls(Department.objects.order_by()
+                   .values_list('id', 'name', 'code', 'slug', 'faculty__name'))
+
+    def search(self, query, limit):
+        prefix = ' '.join(normalize_text(query))
+        return [{'kind': 'department', 'value': name, 'code': code, 'url': url}
+                for name, code, url in self.names.search(prefix, limit)]
+
+
+def _generation(key):
+    cache.add(key, 1, timeout=None)
+    return cache.get(key, 1)
+
+
+def _cached(name, generation, build):
+    entry = _indexes.get(name)
+    if entry is None or entry[0] != generation:
+        with _lock:
+            entry = _indexes.get(name)
+            if entry is None or entry[0] != generation:
+                entry = (generation, build())
+                _indexes[name] = entry
+    return entry[1]
+
+
+def material_index(department_id):
+    return _cached(department_id, facets.generation(department_id),
+                   lambda: MaterialIndex.build(department_id))
+
+
+def department_index():
+    return _cached('departments', _generation(DEPARTMENTS_GENERATION), DepartmentIndex.build)
+
+
+def clear():
+    """Drop every in-process index (they rebuild on next use)"""
+    _indexes.clear()
+
+
+@receiver(post_save, sender=Department, dispatch_uid='accounts.autocomplete.department_saved')
+@receiver(post_delete, sender=Department, dispatch_uid='accounts.autocomplete.department_deleted')
+@receiver(post_save, sender=Faculty, dispatch_uid='accounts.autocomplete.faculty_saved')
+@receiver(post_delete, sender=Faculty, dispatch_uid='accounts.autocomplete.faculty_deleted')
+def bump_departments(sender, **kwargs):
+    cache.add(DEPARTMENTS_GENERATION, 1, timeout=None)
+    try:
+        cache.incr(DEPARTMENTS_GENERATION)
+    except ValueError:
+        pass
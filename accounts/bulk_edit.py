@@ -0,0 +1,121 @@
+"""
+Set-based changes to many materials at once, behind the material admin's
+bulk actions.
+
+The materials to change are walked in primary-key batches of
+``BULK_EDIT_BATCH_SIZE``, always through the queryset they were selected
+with. An uploader's selection is therefore still limited to what
+``MaterialAdmin.get_queryset`` lets them edit. Each batch is changed with
+one ``UPDATE``, or one ``DELETE`` per table the materials cascade to. The
+per-row signal receivers step aside (see ``bulk_signals``) and their work
+happens in bulk instead:
+
+- tombstones for deleted rows are inserted, and their download history
+  deleted, once per batch;
+- facet generations (and with them the autocomplete indexes), trending
+  lists and live listings are refreshed once per action, for each
+  department touched.
+
+Deleted materials' files are removed after commit on the
+``FILE_CLEANUP_WORKERS`` pool, skipping any file another row still uses.
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import downloads, tasks, trending
+from .bulk_signals import bulk_change
+from .facets import bump_department
+from .live import broker
+from .models import Material, MaterialPopularity, Tombstone
+
+# What a bulk edit may change; the department stays put so uploaders cannot move rows out of reach
+EDITABLE_FIELDS = ('semester', 'category', 'level', 'session')
+
+
+class BulkReport:
+    def __init__(self):
+        self.count = 0
+        self.batches = 0
+        self.touched = set()  # (department id, level id) of every row before and after
+
+
+def _batches(queryset, batch_size, fields):
+    """Lists of ``(pk, *fields)`` rows from ``queryset``, in primary-key order"""
+    batch_size = batch_size or settings.BULK_EDIT_BATCH_SIZE
+    rows = queryset.order_by('pk').values_list('pk', *fields)
+    last = 0
+    while batch := list(rows.filter(pk__gt=last)[:batch_size]):
+        last = batch[-1][0]
+        yield batch
+
+
+def update_materials(queryset, changes, batch_size=None):
+    """Apply ``changes`` ({field: value}, fields from EDITABLE_FIELDS) to every material in ``queryset``"""
+    unknown = set(changes) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot bulk edit {', '.join(sorted(unknown))}.")
+    report = BulkReport()
+    level = changes.get('level')
+    now = timezone.now()
+    with transaction.atomic():
+        for batch in _batches(queryset, batch_size, ('department_id', 'level_id')):
+            pks = [pk for pk, _, _ in batch]
+            # update() skips auto_now, and delta-syncing clients look for changes by ``modified``
+            Material.objects.filter(pk__in=pks).update(**changes, modified=now)
+            report.touched.update((department_id, level_id) for _, department_id, level_id in batch)
+            if level is not None:
+                # Trending keeps its own copy of each material's level
+                MaterialPopularity.objects.filter(material_id__in=pks).update(level=level)
+                report.touched.update((department_id, level.pk) for _, department_id, _ in batch)
+            report.count += len(batch)
+            report.batches += 1
+        transaction.on_commit(lambda: refresh_departments(report.touched))
+    return report
+
+
+def delete_materials(queryset, batch_size=None):
+    """Delete every material in ``queryset``; their files go once the deletion commits"""
+    report = BulkReport()
+    # Buffered download events still point at the rows about to go
+    downloads.flush()
+    with transaction.atomic(), bulk_change():
+        for batch in _batches(queryset, batch_size, ('department_id', 'level_id', 'file')):
+            pks = [pk for pk, _, _, _ in batch]
+            Material.objects.filter(pk__in=pks).delete()
+            downloads.forget_materials(pks)
+            Tombstone.objects.bulk_create([
+                Tombstone(model='material', object_id=pk, department_id=department_id)
+                for pk, department_id, _, _ in batch
+            ])
+            names = [name for _, _, _, name in batch if name]
+            tasks.defer('file-cleanup', settings.FILE_CLEANUP_WORKERS, delete_files, names)
+            report.touched.update((department_id, level_id) for _, department_id, level_id, _ in batch)
+            report.count += len(batch)
+            report.batches += 1
+        transaction.on_commit(lambda: refresh_departments(report.touched))
+    return report
+
+
+def delete_files(names):
+    """Remove stored files no material refers to any more; returns the number removed"""
+    still_used = set(Material.objects.filter(file__in=names).values_list('file', flat=True))
+    removed = 0
+    for name in names:
+        if name not in still_used:
+            default_storage.delete(name)
+            removed += 1
+    return removed
+
+
+def refresh_departments(touched):
+    """Invalidate what depends on the touched departments' materials, once each"""
+    departments = {department_id for department_id, _ in touched}
+    for department_id in departments:
+        bump_department(department_id)
+        trending.refresh(department_id)
+        # Open listings reload rather than apply one event per row
+        broker.publish(department_id, {'type': 'resync'})
+    for department_id, level_id in touched:
+        trending.refresh(department_id, level_id)
@@ -0,0 +1,259 @@
+"""
+Bulk material import from a directory and a CSV or JSON manifest.
+
+Files are validated and hashed in a process pool. New files are copied
+into storage in batches, and each batch is inserted with one
+``bulk_create`` inside a transaction. If a batch fails, the files it
+copied are deleted again. A row whose checksum is already recorded for
+the department is skipped, so an interrupted import is resumed by running
+the same command again.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .facets import bump_department
+from .forms import MAX_UPLOAD_SIZE, VALID_EXTENSIONS
+from .models import Category, Level, Material, Semester, normalize_code, sharded_name
+
+MANIFEST_FIELDS = ('file', 'code', 'title', 'level', 'semester', 'category', 'session')
+SESSION_PATTERN = re.compile(r'^\d{4}/\d{4}$')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ManifestError(Exception):
+    pass
+
+
+class RowError(Exception):
+    pass
+
+
+def read_manifest(path):
+    """Rows of a ``.csv`` or ``.json`` manifest as dicts keyed by MANIFEST_FIELDS"""
+    try:
+        with open(path, 'rb') as manifest:
+            return parse_manifest(manifest, path)
+    except OSError as e:
+        raise ManifestError(f"Cannot read manifest {path}: {e}")
+
+
+def parse_manifest(stream, name):
+    """Like ``read_manifest`` for an open binary stream; ``name`` picks the format"""
+    try:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        if name.lower().endswith('.json'):
+            rows = json.load(text)
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ManifestError("A JSON manifest must be a list of objects.")
+        else:
+            rows = list(csv.DictReader(text))
+    except (ValueError, csv.Error) as e:
+        raise ManifestError(f"Cannot read manifest {name}: {e}")
+    missing = {'file', 'code', 'title', 'level', 'session'} - set(rows[0] if rows else ())
+    if rows and missing:
+        raise ManifestError(f"Manifest is missing columns: {', '.join(sorted(missing))}.")
+    return [{field: str(row.get(field) or '').strip() for field in MANIFEST_FIELDS} for row in rows]
+
+
+class Lookups:
+    """Levels, semesters and categories by case-insensitive name, loaded once"""
+
+    def __init__(self):
+        self.level = {obj.name.casefold(): obj.pk for obj in Level.objects.all()}
+        self.semester = {obj.name.casefold(): obj.pk for obj in Semester.objects.all()}
+        self.category = {obj.name.casefold(): obj.pk for obj in Category.objects.all()}
+
+    def resolve(self, kind, name, required=False):
+        if not name:
+            if required:
+                raise RowError(f"{kind} is required.")
+            return None
+        try:
+            return getattr(self, kind)[name.casefold()]
+        except KeyError:
+            raise RowError(f"Unknown {kind} '{name}'.")
+
+
+def material_fields(row, lookups):
+    """Model field values for a manifest or archive row; raises RowError"""
+    code, title, session = row['code'], row['title'], row['session']
+    if not code or len(code) > Material._meta.get_field('code').max_length:
+        raise RowError(f"Invalid course code '{code}'.")
+    if not title or len(title) > Material._meta.get_field('title').max_length:
+        raise RowError(f"Title must be 1-{Material._meta.get_field('title').max_length} characters.")
+    if not SESSION_PATTERN.match(session):
+        raise RowError(f"Session '{session}' is not in YYYY/YYYY format.")
+    return {
+        'code': code,
+        'code_key': normalize_code(code),
+        'title': title,
+        'session': session,
+        'level_id': lookups.resolve('level', row['level'], required=True),
+        'semester_id': lookups.resolve('semester', row.get('semester', '')),
+        'category_id': lookups.resolve('category', row.get('category', '')),
+    }
+
+
+def check_upload(name, size):
+    """The upload form's extension and size rules; raises RowError"""
+    if not any(name.lower().endswith(ext) for ext in VALID_EXTENSIONS):
+        raise RowError(f"Unsupported file format: {os.path.basename(name)}.")
+    if size > MAX_UPLOAD_SIZE:
+        raise RowError(f"File exceeds {MAX_UPLOAD_SIZE // (1024 * 1024)}MB: {os.path.basename(name)}.")
+
+
+def _setup_worker():
+    # Spawned workers start without Django; forked ones inherit it
+    if not apps.ready:
+        django.setup()
+
+
+def inspect_file(path):
+    """``(size, sha256, error)`` for one file; runs in a worker process"""
+    try:
+        size = os.path.getsize(path)
+        check_upload(path, size)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return size, digest.hexdigest(), None
+    except RowError as e:
+        return None, None, str(e)
+    except OSError as e:
+        return None, None, f"Cannot read {os.path.basename(path)}: {e.strerror}."
+
+
+def store_file(path):
+    """Copy one file into media storage and return its stored name"""
+    with open(path, 'rb') as f:
+        return default_storage.save(sharded_name(path), File(f))
+
+
+class ImportReport:
+    def __init__(self):
+        self.hashed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.errors = []  # (row number, message)
+        self.timings = {}
+
+    def throughput(self, phase, count, size=None):
+        seconds = self.timings.get(phase, 0) or 1e-9
+        rate = f"{count / seconds:.0f} files/s"
+        if size is not None:
+            rate += f", {size / seconds / 1024 / 1024:.1f} MB/s"
+        return f"{phase:<8} {seconds:7.2f}s  {rate}"
+
+
+class MaterialImporter:
+    def __init__(self, directory, department, uploader, workers=None, batch_size=500, dry_run=False):
+        self.directory = directory
+        self.department = department
+        self.uploader = uploader
+        self.workers = workers
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def run(self, rows, progress=None):
+        report = ImportReport()
+        lookups = Lookups()
+        executor = (ProcessPoolExecutor(self.workers, initializer=_setup_worker)
+                    if self.workers != 0 else None)
+        try:
+            candidates = self.validate(rows, lookups, report)
+            started = time.perf_counter()
+            paths = [path for _, path, _ in candidates]
+            report.hashed = len(paths)
+            inspected = self._map(executor, inspect_file, paths)
+            report.timings['hash'] = time.perf_counter() - started
+
+            pending = self.new_files(candidates, inspected, report)
+            if self.dry_run:
+                return report, pending
+            started = time.perf_counter()
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                self.import_batch(executor, batch, report)
+                if progress:
+                    progress(report.imported, len(pending))
+            report.timings['import'] = time.perf_counter() - started
+        finally:
+            if executor:
+                executor.shutdown()
+            if report.imported:
+                # bulk_create sends no post_save; refresh facet counts and autocomplete once
+                bump_department(self.department.pk)
+        return report, pending
+
+    def _map(self, executor, func, items):
+        if executor is None:
+            return list(map(func, items))
+        # Chunks amortise the per-task pickling without starving workers at the end
+        return list(executor.map(func, items, chunksize=16))
+
+    def validate(self, rows, lookups, report):
+        """``[(row number, file path, field values)]`` for rows that pass validation"""
+        root = os.path.realpath(self.directory)
+        candidates = []
+        for number, row in enumerate(rows, start=1):
+            try:
+                fields = material_fields(row, lookups)
+                path = os.path.realpath(os.path.join(root, row['file']))
+                if not row['file'] or os.path.commonpath([root, path]) != root:
+                    raise RowError(f"File '{row['file']}' is outside the import directory.")
+            except RowError as e:
+                report.errors.append((number, str(e)))
+                continue
+            candidates.append((number, path, fields))
+        return candidates
+
+    def new_files(self, candidates, inspected, report):
+        """Drop rows with unreadable files and files this department already has"""
+        checksums = {digest for _, digest, _ in inspected if digest}
+        existing = set()
+        checksum_list = sorted(checksums)
+        for start in range(0, len(checksum_list), 900):
+            existing.update(Material.objects.filter(
+                department=self.department, checksum__in=checksum_list[start:start + 900]
+            ).values_list('checksum', flat=True))
+
+        pending = []
+        for (number, path, fields), (size, digest, error) in zip(candidates, inspected):
+            if error:
+                report.errors.append((number, error))
+            elif digest in existing:
+                report.skipped += 1
+            else:
+                existing.add(digest)  # the same file twice in one manifest is imported once
+                pending.append((number, path, dict(fields, checksum=digest), size))
+        return pending
+
+    def import_batch(self, executor, batch, report):
+        stored = self._map(executor, store_file, [path for _, path, _, _ in batch])
+        materials = [
+            Material(file=name, department=self.department, uploaded_by=self.uploader, **fields)
+            for name, (_, _, fields, _) in zip(stored, batch)
+        ]
+        try:
+            with transaction.atomic():
+                Material.objects.bulk_create(materials)
+        except Exception:
+            for name in stored:
+                default_storage.delete(name)
+            raise
+        report.imported += len(materials)
+        report.bytes += sum(size for _, _, _, size in batch)
@@ -0,0 +1,45 @@
+"""
+Lets per-row ``Material`` signal receivers step aside during bulk changes.
+
+The receivers that keep facet generations, tombstones and live updates in
+step with single saves and deletes return early while ``bulk_change`` is
+active in the current thread. The bulk code in ``accounts.bulk_edit``
+then does their work once per batch or once per action.
+
+``moving_tiers`` is narrower: only the receiver that clears a deleted
+material's download history steps aside, because ``accounts.tiering``
+deletes the row while its id, and the history with it, lives on in the
+other tier.
+"""
+import threading
+from contextlib import contextmanager
+
+_state = threading.local()
+
+
+def in_bulk_change():
+    return getattr(_state, 'active', False)
+
+
+@contextmanager
+def bulk_change():
+    previous = in_bulk_change()
+    _state.active = True
+    try:
+        yield
+    finally:
+        _state.active = previous
+
+
+def in_tier_move():
+    return getattr(_state, 'moving', False)
+
+
+@contextmanager
+def moving_tiers():
+    previous = in_tier_move()
+    _state.moving = True
+    try:
+        yield
+    finally:
+        _state.moving = previous
@@ -0,0 +1,227 @@
+"""
+Two-tier cache for expensive, widely shared values (listing facets,
+trending lists).
+
+A small in-process LRU sits in front of the shared cache (``CACHES``
+alias ``LAYERED_CACHE``; Redis in production, local memory in tests), so
+a hot key costs a dictionary lookup instead of a network round trip.
+Local copies are trusted for at most ``LAYERED_CACHE_LOCAL_TTL`` seconds,
+which bounds how long a value set by another worker can go unseen.
+
+``get_or_set`` protects the database from stampedes when a popular entry
+expires:
+
+- Concurrent misses for one key are coalesced. Within a process, other
+  threads wait for the first one's result. Across processes, a lock in
+  the shared tier lets one worker compute while the others poll for its
+  result.
+- Every entry is stored with a jittered lifetime, so entries written
+  together do not all expire together. Entries may also be refreshed
+  early, with a probability that rises as expiry nears and with how long
+  the value took to compute ("XFetch").
+- An expired entry is kept for ``LAYERED_CACHE_STALE_TTL`` more seconds
+  and served while one worker recomputes it in the background.
+
+Hit, miss and refresh counts are kept per process; see ``stats``.
+"""
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from . import tasks
+
+# Keeps early refreshes rare until the last few computation-times before expiry
+EARLY_REFRESH_BETA = 1.0
+TTL_JITTER = 0.1  # lifetimes are shortened by up to this fraction
+
+
+class _Pending:
+    """A computation other threads are waiting for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TwoTierCache:
+    def __init__(self, alias=None, local_size=None, local_ttl=None, stale_ttl=None,
+                 clock=time.time, rng=random.random):
+        self.alias = alias
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.rng = rng
+        self._local = OrderedDict()  # key -> (entry, trusted until)
+        self._pending = {}  # key -> _Pending
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def shared(self):
+        return caches[self.alias or settings.LAYERED_CACHE]
+
+    def _setting(self, value, name):
+        return getattr(settings, name) if value is None else value
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Counts since start: local/shared hits, misses, stale serves, refreshes, coalesced waits"""
+        with self._lock:
+            counts = dict(self._stats)
+            counts['local_entries'] = len(self._local)
+        lookups = counts.get('local_hits', 0) + counts.get('shared_hits', 0) + counts.get('misses', 0)
+        hits = lookups - counts.get('misses', 0)
+        counts['hit_rate'] = round(hits / lookups, 4) if lookups else None
+        return counts
+
+    # Entries are (value, expires at, seconds the value took to compute)
+
+    def _read(self, key):
+        now = self.clock()
+        with self._lock:
+            cached = self._local.get(key)
+            if cached is not None and cached[1] > now:
+                self._local.move_to_end(key)
+                self._stats['local_hits'] += 1
+                return cached[0]
+        entry = self.shared.get(key)
+        if entry is not None:
+            self._count('shared_hits')
+            self._keep(key, entry)
+        return entry
+
+    def _keep(self, key, entry):
+        trusted_until = min(entry[1], self.clock() + self._setting(self.local_ttl, 'LAYERED_CACHE_LOCAL_TTL'))
+        with self._lock:
+            self._local[key] = (entry, trusted_until)
+            self._local.move_to_end(key)
+            while len(self._local) > self._setting(self.local_size, 'LAYERED_CACHE_LOCAL_SIZE'):
+                self._local.popitem(last=False)
+
+    def set(self, key, value, timeout, compute_time=0.0):
+        lifetime = timeout * (1 - TTL_JITTER * self.rng())
+        entry = (value, self.clock() + lifetime, compute_time)
+        self.shared.set(key, entry, math.ceil(lifetime + self._setting(self.stale_ttl, 'LAYERED_CACHE_STALE_TTL')))
+        self._keep(key, entry)
+
+    def delete(self, key):
+        self.shared.delete(key)
+        with self._lock:
+            self._local.pop(key, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def get_or_set(self, key, compute, timeout):
+        """The cached value for ``key``, calling ``compute()`` at most once per expiry across workers"""
+        entry = self._read(key)
+        if entry is None:
+            self._count('misses')
+            return self._fill(key, compute, timeout)
+        value, expires, compute_time = entry
+        now = self.clock()
+        if now >= expires:
+            self._count('stale')
+            self._refresh(key, compute, timeout)
+        elif compute_time and now - compute_time * EARLY_REFRESH_BETA * math.log(1 - self.rng()) >= expires:
+            self._count('early_refreshes')
+            self._refresh(key, compute, timeout)
+        return value
+
+    def _compute(self, key, compute, timeout):
+        started = time.perf_counter()
+        value = compute()
+        self._count('computations')
+        self.set(key, value, timeout, time.perf_counter() - started)
+        return value
+
+    def _fill(self, key, compute, timeout):
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _Pending()
+        if not leader:
+            self._count('coalesced')
+            pending.done.wait(settings.LAYERED_CACHE_LOCK_TIMEOUT)
+            if pending.error is not None:
+                raise pending.error
+            if pending.done.is_set():
+                return pending.value
+            return self._compute(key, compute, timeout)
+        try:
+            pending.value = self._fill_shared(key, compute, timeout)
+            return pending.value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def _fill_shared(self, key, compute, timeout):
+        lock = f'{key}:computing'
+        lock_timeout = settings.LAYERED_CACHE_LOCK_TIMEOUT
+        if not self.shared.add(lock, os.getpid(), lock_timeout):
+            # Another worker is computing this key; wait for its result rather than repeat the work
+            self._count('coalesced')
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(settings.LAYERED_CACHE_POLL_INTERVAL)
+                entry = self.shared.get(key)
+                if entry is not None:
+                    self._keep(key, entry)
+                    return entry[0]
+            return self._compute(key, compute, timeout)
+        try:
+            return self._compute(key, compute, timeout)
+        finally:
+            self.shared.delete(lock)
+
+    def _refresh(self, key, compute, timeout):
+        """Recompute ``key`` in the background, once across workers"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        lock = f'{key}:computing'
+        if not self.shared.add(lock, os.getpid(), settings.LAYERED_CACHE_LOCK_TIMEOUT):
+            with self._lock:
+                self._refreshing.discard(key)
+            return
+        tasks.run('cache-refresh', settings.LAYERED_CACHE_REFRESH_WORKERS, self._refresh_now,
+                  key, compute, timeout, lock)
+
+    def _refresh_now(self, key, compute, timeout, lock):
+        try:
+            self._compute(key, compute, timeout)
+        finally:
+            self.shared.delete(lock)
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+layered = TwoTierCache()
+
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser, login_url='/')
+def cache_stats(request):
+    """This worker's two-tier cache statistics"""
+    return JsonResponse({'pid': os.getpid(), **layered.stats()})
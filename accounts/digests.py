@@ -0,0 +1,163 @@
+"""
+New-material digest emails, one per department per time window.
+
+``schedule_digests`` closes the current window: every department with
+materials uploaded since its previous digest gets a ``Digest`` row
+covering ``[previous window_end, now)``. Windows never overlap, so a
+material is announced at most once: a run locks the departments it is
+about to close windows for, and a department cannot have two windows
+starting at the same moment, so concurrent runs cannot both cover the
+same uploads.
+
+``send_digest`` renders a digest once and mails it to the department's
+students. Recipients are blind-copied in chunks of
+``DIGEST_RECIPIENTS_PER_MESSAGE``, and the messages go out in batches of
+``EMAIL_BATCH_SIZE`` over a single connection. Each batch is recorded
+as ``DigestDelivery`` rows once the server accepts it. A digest that
+fails part-way is retried by the next run and skips students it already
+reached.
+
+Before sending, a run claims the digest with one conditional UPDATE from
+``pending`` to ``sending``. When cron starts a run while the previous
+one is still mailing, only one of them wins the claim, so nobody gets
+the same digest twice. A failed send hands the digest back to
+``pending``. A run that dies without doing so leaves a claim that
+stops renewing, and after ``DIGEST_CLAIM_MINUTES`` the next run takes
+the digest over.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DateTimeField, Exists, F, Max, OuterRef, Q, Value, When
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Department, Digest, DigestDelivery, Material
+
+
+def schedule_digests(now=None):
+    """Create pending digests for departments with new materials; returns them"""
+    now = now or timezone.now()
+    first_start = now - timedelta(hours=settings.DIGEST_WINDOW_HOURS)
+    last_end = dict(Digest.objects.order_by().values_list('department').annotate(Max('window_end')))
+    uploads = Material.objects.filter(upload_date__gte=min([first_start, *last_end.values()]), upload_date__lt=now)
+    try:
+        with transaction.atomic():
+            # A concurrent run waits here until this one has recorded its windows, then starts after them
+            list(Department.objects.select_for_update().filter(pk__in=uploads.order_by().values('department_id'))
+                 .order_by('pk').values_list('pk', flat=True))
+            last_end = dict(Digest.objects.order_by().values_list('department').annotate(Max('window_end')))
+            since = Case(*[When(department_id=department_id, then=Value(end))
+                           for department_id, end in last_end.items()],
+                         default=Value(first_start), output_field=DateTimeField())
+            # One grouped query: each department's uploads since its own last window
+            counts = (uploads.alias(since=since).filter(upload_date__gte=F('since')).order_by()
+                      .values('department_id').annotate(count=Count('pk'), window_start=Max('since')))
+            digests = [
+                Digest(department_id=row['department_id'], window_start=row['window_start'], window_end=now,
+                       material_count=row['count'])
+                for row in counts
+            ]
+            return Digest.objects.bulk_create(digests)
+    except IntegrityError:
+        # Another run closed this window first
+        return []
+
+
+def digest_materials(digest):
+    return (Material.objects.filter(department=digest.department_id, upload_date__gte=digest.window_start,
+                                    upload_date__lt=digest.window_end)
+            .select_related('level', 'category').order_by('level__name', 'code'))
+
+
+def render_digest(digest):
+    """``(subject, text, html)``, rendered once and shared by every recipient"""
+    department = digest.department
+    context = {
+        'department': department,
+        'materials': digest_materials(digest),
+        'count': digest.material_count,
+        'list_url': settings.BASE_URL + reverse('material_list', args=[department.slug]),
+    }
+    subject = f"{digest.material_count} new material{'s' if digest.material_count != 1 else ''} in {department.name}"
+    return (subject, render_to_string('emails/material_digest.txt', context),
+            render_to_string('emails/material_digest.html', context))
+
+
+def recipients(digest):
+    """``(id, email)`` of students still waiting for this digest"""
+    delivered = DigestDelivery.objects.filter(digest=digest, user=OuterRef('pk'))
+    return (get_user_model().objects.filter(department=digest.department_id, is_active=True)
+            .exclude(email='').filter(~Exists(delivered)).order_by('pk').values_list('pk', 'email'))
+
+
+def unclaimed(now=None):
+    """Digests waiting to be sent, including those a dead run left claimed"""
+    lapsed = (now or timezone.now()) - timedelta(minutes=settings.DIGEST_CLAIM_MINUTES)
+    return Digest.objects.filter(Q(status='pending') | Q(status='sending', claimed_at__lt=lapsed))
+
+
+def claim(digest):
+    """Take a digest for this run; False if another run is sending it or already has"""
+    return unclaimed().filter(pk=digest.pk).update(status='sending', claimed_at=timezone.now()) == 1
+
+
+def send_digest(digest, connection):
+    """Mail one digest; returns the number of students reached this time, or None if another run has it"""
+    if not claim(digest):
+        return None
+    try:
+        reached = _send_claimed(digest, connection)
+    except BaseException:
+        Digest.objects.filter(pk=digest.pk, status='sending').update(status='pending')
+        raise
+    return reached
+
+
+def _send_claimed(digest, connection):
+    subject, text, html = render_digest(digest)
+    per_message = settings.DIGEST_RECIPIENTS_PER_MESSAGE
+    batch_size = settings.EMAIL_BATCH_SIZE
+    reached = 0
+    pending = list(recipients(digest))
+    for start in range(0, len(pending), per_message * batch_size):
+        batch = pending[start:start + per_message * batch_size]
+        messages = []
+        for offset in range(0, len(batch), per_message):
+            chunk = batch[offset:offset + per_message]
+            message = EmailMultiAlternatives(subject, text, settings.DEFAULT_FROM_EMAIL,
+                                             to=[settings.DEFAULT_FROM_EMAIL],
+                                             bcc=[email for _, email in chunk], connection=connection)
+            message.attach_alternative(html, 'text/html')
+            messages.append(message)
+        connection.send_messages(messages)
+        DigestDelivery.objects.bulk_create(
+            [DigestDelivery(digest=digest, user_id=user_id) for user_id, _ in batch], ignore_conflicts=True
+        )
+        reached += len(batch)
+        # Still alive: keep other runs from taking the digest over
+        Digest.objects.filter(pk=digest.pk).update(claimed_at=timezone.now())
+
+    digest.status = 'sent'
+    digest.sent_at = timezone.now()
+    digest.delivered = DigestDelivery.objects.filter(digest=digest).count()
+    digest.save(update_fields=['status', 'sent_at', 'delivered'])
+    return reached
+
+
+def send_pending_digests():
+    """Send every pending digest over one connection; returns ``(digests, students)``"""
+    digests = list(unclaimed().select_related('department').order_by('window_end'))
+    sent = reached = 0
+    if digests:
+        with get_connection() as connection:
+            for digest in digests:
+                students = send_digest(digest, connection)
+                if students is not None:
+                    sent += 1
+                    reached += students
+    return sent, reached
@@ -0,0 +1,337 @@
+"""
+Download event stream and time-bucketed rollups.
+
+``record_download`` only appends to an in-process buffer. The buffer is
+written out with one ``bulk_create`` once it holds
+``DOWNLOAD_EVENT_BATCH_SIZE`` events, checked when a request has
+finished, or once its oldest event is ``DOWNLOAD_EVENT_FLUSH_INTERVAL``
+seconds old, checked by a timer as well so an idle worker does not sit
+on events; a killed worker loses at most that many seconds of
+downloads. The same flush folds the batch into the hourly and daily
+``DownloadRollup`` rows, so trend queries never touch raw events, and
+adds the downloading users to the per-material and per-department
+HyperLogLog sketches used for unique-downloader counts. The trending
+scores in ``accounts.trending`` are updated from the same batch, in the
+same transaction, so a batch counts everywhere or nowhere.
+
+This history refers to materials by id, so it survives archiving (see
+``accounts.tiering``). ``forget_materials`` removes it when a material
+is deleted for good.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished
+from django.db.models.signals import post_delete
+from django.db import close_old_connections, transaction
+from django.db.models import Q, Sum
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import trending
+from .bulk_signals import in_bulk_change, in_tier_move
+from .hll import HyperLogLog
+from .models import (ArchivedMaterial, DownloadEvent, DownloadRollup, DownloaderSketch, Material,
+                     MaterialPopularity)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = []
+_oldest = None
+_timer = None
+
+
+def record_download(material, user=None, timestamp=None):
+    """Queue a download event; it is written on the next flush"""
+    global _oldest
+    event = (
+        material.pk,
+        material.department_id,
+        material.level_id,
+        user.pk if user is not None and user.is_authenticated else None,
+        timestamp or timezone.now(),
+    )
+    with _lock:
+        if not _pending:
+            _oldest = time.monotonic()
+            _start_timer()
+        _pending.append(event)
+
+
+def _start_timer():
+    """Flush the buffer once its first event is due (called with ``_lock`` held)"""
+    global _timer
+    if _timer is None and settings.DOWNLOAD_EVENT_FLUSH_TIMER:
+        _timer = threading.Timer(settings.DOWNLOAD_EVENT_FLUSH_INTERVAL, _flush_on_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _stop_timer():
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+
+
+def _flush_on_timer():
+    global _timer
+    with _lock:
+        _timer = None
+    close_old_connections()
+    try:
+        flush()
+    except Exception:
+        logger.exception("Could not flush download events")
+    finally:
+        close_old_connections()
+
+
+def pending_count():
+    return len(_pending)
+
+
+def discard_pending():
+    """Drop buffered events without writing them"""
+    global _oldest
+    with _lock:
+        _pending.clear()
+        _oldest = None
+        _stop_timer()
+
+
+def flush():
+    """Write buffered events and update the rollups; returns the number written"""
+    global _oldest
+    with _lock:
+        batch = _pending[:]
+        _pending.clear()
+        _oldest = None
+        _stop_timer()
+    if not batch:
+        return 0
+
+    # Materials or users deleted since the download was queued are skipped
+    # rather than failing the whole batch on a foreign key. Archived
+    # materials are still there, only in the other tier.
+    queued = {event[0] for event in batch}
+    material_ids = {*Material.objects.filter(pk__in=queued).values_list('pk', flat=True),
+                    *ArchivedMaterial.objects.filter(pk__in=queued).values_list('pk', flat=True)}
+    user_ids = set(get_user_model().objects.filter(
+        pk__in={event[3] for event in batch if event[3] is not None}).values_list('pk', flat=True))
+    batch = [
+        (material_id, department_id, level_id, user_id if user_id in user_ids else None, timestamp)
+        for material_id, department_id, level_id, user_id, timestamp in batch
+        if material_id in material_ids
+    ]
+
+    with transaction.atomic():
+        DownloadEvent.objects.bulk_create(
+            [DownloadEvent(material_id=material_id, department_id=department_id,
+                           user_id=user_id, timestamp=timestamp)
+             for material_id, department_id, _, user_id, timestamp in batch],
+            batch_size=500,
+        )
+        apply_rollups(batch)
+        apply_sketches(batch)
+        touched = trending.apply_downloads(batch)
+    # The cached top lists are rebuilt only from scores that committed with the batch
+    trending.refresh_lists(touched)
+    return len(batch)
+
+
+def flush_if_due():
+    with _lock:
+        due = bool(_pending) and (
+            len(_pending) >= settings.DOWNLOAD_EVENT_BATCH_SIZE
+            or time.monotonic() - _oldest >= settings.DOWNLOAD_EVENT_FLUSH_INTERVAL
+        )
+    if due:
+        flush()
+
+
+@receiver(request_finished, dispatch_uid='accounts.downloads.flush_if_due')
+def _flush_after_request(sender, **kwargs):
+    # Runs inside response.close(); a database error here must not reach the server
+    try:
+        flush_if_due()
+    except Exception:
+        logger.exception("Could not flush download events")
+
+
+atexit.register(flush)
+
+
+def bucket_start(timestamp, granularity):
+    timestamp = timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if granularity == DownloadRollup.DAY:
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def apply_rollups(events):
+    """Add (material, department, level, user, timestamp) events to the rollups"""
+    totals = Counter()
+    for material_id, department_id, level_id, _, timestamp in events:
+        for granularity in (DownloadRollup.HOUR, DownloadRollup.DAY):
+            key = (granularity, bucket_start(timestamp, granularity), material_id, department_id, level_id)
+            totals[key] += 1
+
+    if not totals:
+        return
+    rows = {
+        (granularity, bucket, material_id): DownloadRollup(
+            granularity=granularity, bucket=bucket, material_id=material_id,
+            department_id=department_id, level_id=level_id, count=count,
+        )
+        for (granularity, bucket, material_id, department_id, level_id), count in totals.items()
+    }
+    with transaction.atomic():
+        # Make sure every bucket exists, then lock them all so concurrent flushes add up
+        DownloadRollup.objects.bulk_create(
+            [DownloadRollup(granularity=row.granularity, bucket=row.bucket, material_id=row.material_id,
+                            department_id=row.department_id, level_id=row.level_id, count=0)
+             for row in rows.values()],
+            ignore_conflicts=True, batch_size=500,
+        )
+        buckets = Q()
+        for granularity, bucket in {(key[0], key[1]) for key in rows}:
+            buckets |= Q(granularity=granularity, bucket=bucket)
+        existing = (DownloadRollup.objects.select_for_update()
+                    .filter(buckets, material_id__in={key[2] for key in rows})
+                    .values_list('granularity', 'bucket', 'material_id', 'count'))
+        for granularity, bucket, material_id, count in existing:
+            row = rows.get((granularity, bucket, material_id))
+            if row is not None:
+                row.count += count
+        DownloadRollup.objects.bulk_create(
+            rows.values(), update_conflicts=True, unique_fields=['granularity', 'bucket', 'material'],
+            update_fields=['count'], batch_size=500,
+        )
+
+
+def apply_sketches(events):
+    """Add each event's user to its material and department HyperLogLog sketches"""
+    by_material = defaultdict(set)
+    by_department = defaultdict(set)
+    for material_id, department_id, _, user_id, _ in events:
+        if user_id is not None:
+            by_material[material_id].add(user_id)
+            by_department[department_id].add(user_id)
+
+    empty = HyperLogLog.from_bytes(None).to_bytes()
+    for owner, users_by_owner in (('material', by_material), ('department', by_department)):
+        if not users_by_owner:
+            continue
+        # Make sure every sketch exists, then lock them all, as apply_rollups does with its buckets:
+        # select_for_update cannot lock a row another flush is about to insert
+        DownloaderSketch.objects.bulk_create(
+            [DownloaderSketch(registers=empty, **{f'{owner}_id': owner_id}) for owner_id in users_by_owner],
+            ignore_conflicts=True,
+        )
+        sketches = (DownloaderSketch.objects.select_for_update()
+                    .filter(**{f'{owner}_id__in': users_by_owner}))
+        for sketch in sketches:
+            hll = HyperLogLog.from_bytes(bytes(sketch.registers))
+            if hll.update(users_by_owner[getattr(sketch, f'{owner}_id')]):
+                sketch.registers = hll.to_bytes()
+                sketch.save(update_fields=['registers', 'updated'])
+
+
+def _load_sketches(**filters):
+    return [HyperLogLog.from_bytes(bytes(registers))
+            for registers in DownloaderSketch.objects.filter(**filters).values_list('registers', flat=True)]
+
+
+def unique_downloaders(material):
+    """Approximate number of distinct users who downloaded the material"""
+    return HyperLogLog.union(_load_sketches(material=material)).count()
+
+
+def unique_downloaders_by_material(materials):
+    """Map material id to its approximate distinct downloaders in one query"""
+    counts = {material.pk: 0 for material in materials}
+    for material_id, registers in DownloaderSketch.objects.filter(
+            material__in=materials).values_list('material_id', 'registers'):
+        counts[material_id] = HyperLogLog.from_bytes(bytes(registers)).count()
+    return counts
+
+
+def department_unique_downloaders(department):
+    return HyperLogLog.union(_load_sketches(department=department)).count()
+
+
+def faculty_unique_downloaders(faculty):
+    """Merge the faculty's department sketches; users in several departments count once"""
+    return HyperLogLog.union(_load_sketches(department__faculty=faculty)).count()
+
+
+def download_trend(granularity=DownloadRollup.DAY, periods=14, queryset=None, now=None, **filters):
+    """
+    Return ``[(bucket, total), ...]`` for the last ``periods`` buckets,
+    oldest first and zero-filled. ``filters`` narrow the rollup rows, e.g.
+    ``department=dept`` or ``material__uploaded_by=user``.
+    """
+    step = timedelta(hours=1) if granularity == DownloadRollup.HOUR else timedelta(days=1)
+    end = bucket_start(now or timezone.now(), granularity)
+    start = end - step * (periods - 1)
+
+    rollups = DownloadRollup.objects.all() if queryset is None else queryset
+    totals = dict(
+        rollups.filter(granularity=granularity, bucket__gte=start, bucket__lte=end, **filters)
+        .order_by()
+        .values_list('bucket')
+        .annotate(total=Sum('count'))
+    )
+    return [(start + step * i, totals.get(start + step * i, 0)) for i in range(periods)]
+
+
+def trend_bars(trend):
+    """Attach a 0-100 bar height to each (bucket, total) pair for charting"""
+    peak = max((total for _, total in trend), default=0) or 1
+    return [
+        {'bucket': bucket, 'total': total, 'height': round(total * 100 / peak)}
+        for bucket, total in trend
+    ]
+
+
+def compact_events(older_than, chunk_size=5000):
+    """Delete raw events before ``older_than`` in chunks; their counts live on in the rollups"""
+    deleted = 0
+    while True:
+        ids = list(
+            DownloadEvent.objects.filter(timestamp__lt=older_than)
+            .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return deleted
+        deleted += DownloadEvent.objects.filter(pk__in=ids).delete()[0]
+
+
+def compact_hourly_rollups(older_than):
+    """Hourly buckets past their retention are dropped; the daily buckets remain"""
+    return DownloadRollup.objects.filter(
+        granularity=DownloadRollup.HOUR, bucket__lt=older_than
+    ).delete()[0]
+
+
+def forget_materials(material_ids):
+    """Delete the download history of materials that are gone for good"""
+    material_ids = list(material_ids)
+    for model in (DownloadEvent, DownloadRollup, DownloaderSketch, MaterialPopularity):
+        model.objects.filter(material_id__in=material_ids).delete()
+
+
+@receiver(post_delete, sender=Material, dispatch_uid='accounts.downloads.material_deleted')
+def material_deleted(sender, instance, **kwargs):
+    # Bulk deletes forget their batches at once; tier moves keep the history
+    if in_bulk_change() or in_tier_move():
+        return
+    forget_materials([instance.pk])
@@ -0,0 +1,132 @@
+"""
+Streaming CSV and JSON Lines exports of materials and download statistics.
+
+Exports are read with a chunked server-side iterator that selects only the
+exported columns, and foreign keys are exported by name through joins
+rather than per-row lookups. Rows are encoded as they arrive and handed to
+``StreamingHttpResponse`` about ``DOWNLOAD_CHUNK_SIZE`` bytes at a time,
+so memory stays flat whatever the size of the export.
+
+Under ASGI a synchronous iterator would be read into a list before the
+first byte is sent, so there each chunk is produced in the sync thread
+and the response iterates asynchronously instead.
+"""
+import csv
+import io
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Sum
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+from .models import Department, Material
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+}
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class Export:
+    """One export: column name -> ORM lookup, read from ``rows``"""
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+
+    def rows(self, materials):
+        return materials.order_by('pk').values_list(*self.columns.values())
+
+
+class DownloadStatsExport(Export):
+    """Materials and downloads per department and uploader"""
+
+    def rows(self, materials):
+        return (materials.order_by('department__name', 'uploaded_by__email')
+                .values_list('department__name', 'uploaded_by__email')
+                .annotate(materials=Count('pk'), downloads=Sum('download_count')))
+
+
+EXPORTS = {
+    'materials': Export('materials', {
+        'id': 'id', 'title': 'title', 'code': 'code', 'session': 'session',
+        'department': 'department__name', 'level': 'level__name',
+        'category': 'category__name', 'semester': 'semester__name',
+        'uploaded_by': 'uploaded_by__email', 'upload_date': 'upload_date',
+        'download_count': 'download_count',
+    }),
+    'downloads': DownloadStatsExport('downloads', {
+        'department': 'department__name', 'uploaded_by': 'uploaded_by__email',
+        'materials': 'materials', 'downloads': 'downloads',
+    }),
+}
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def encode_rows(export, rows, fmt, chunk_size=None):
+    """Encode ``rows`` as ``fmt``, yielding bytes about ``chunk_size`` at a time"""
+    chunk_size = chunk_size or settings.DOWNLOAD_CHUNK_SIZE
+    buffer = io.StringIO()
+    names = list(export.columns)
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        write = lambda row: writer.writerow([_csv_cell(value) for value in row])
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        write = lambda row: buffer.write(encoder.encode(dict(zip(names, row))) + '\n')
+    for row in rows:
+        write(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def _async_chunks(chunks):
+    # Each chunk, and the database fetch behind it, runs in the sync thread
+    chunks = iter(chunks)
+    while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+        yield chunk
+
+
+def export_response(name, materials, fmt):
+    """Streaming download of the export ``name`` over ``materials``"""
+    export = EXPORTS[name]
+    rows = export.rows(materials).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    chunks = encode_rows(export, rows, fmt)
+    if settings.ASYNC_VIEWS:
+        chunks = _async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[fmt])
+    filename = f"{name}-{timezone.localdate():%Y%m%d}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+@login_required
+@user_passes_test(lambda u: u.is_uploader or u.is_superuser, login_url='/')
+@require_GET
+def export(request, resource, fmt):
+    """Export the materials the user can edit, optionally of one ``?department=``"""
+    materials = Material.objects.editable_by(request.user)
+    slug = request.GET.get('department')
+    if slug:
+        materials = materials.filter(department=get_object_or_404(Department, slug=slug))
+    return export_response(resource, materials, fmt)
@@ -0,0 +1,178 @@
+"""
+Facet counts for a department's material listing.
+
+One grouped query counts materials per (level, category, semester,
+session) combination for the department and search term. Every facet's
+counts, under any combination of selected filters, are then worked out
+from those rows in Python. Changing a filter therefore needs no extra
+query. The rows are cached per department *generation*, a counter that
+``Material`` saves and deletes bump, so a new upload is visible on the
+next request without clearing anything by hand. A save that moves a
+material to another department bumps both departments. The rows go
+through the two-tier cache, so a popular department's expiry costs one
+grouped query rather than one per waiting student.
+
+Generations live in the default cache, which every worker must share:
+with a per-process cache, a worker never sees other workers' bumps and
+keeps serving stale counts. ``manage.py check --deploy`` fails on one.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Error, Tags, register
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .bulk_signals import in_bulk_change
+from .caching import layered
+from .models import Material, normalize_code
+
+# (request parameter, grouped value, grouped label, heading)
+FACETS = (
+    ('level', 'level_id', 'level__name', 'Level'),
+    ('category', 'category_id', 'category__name', 'Category'),
+    ('semester', 'semester_id', 'semester__name', 'Semester'),
+    ('session', 'session', 'session', 'Session'),
+)
+ID_FACETS = {'level', 'category', 'semester'}
+
+
+def search_filter(search_query):
+    rule = Q(title__icontains=search_query)
+    code_key = normalize_code(search_query)
+    if code_key.isdigit():
+        # A bare course number ("403") is the end of a code, so no prefix can match it.
+        # The title match already scans the department's rows, so this costs no index.
+        rule |= Q(code_key__contains=code_key)
+    elif code_key:
+        rule |= Q(code_key__startswith=code_key)
+    return rule
+
+
+def selected_filters(params):
+    """Valid facet selections from a QueryDict, e.g. ``{'level': 3}``"""
+    filters = {}
+    for name, *_ in FACETS:
+        value = params.get(name, '').strip()
+        if not value:
+            continue
+        if name in ID_FACETS:
+            try:
+                value = int(value)
+            except ValueError:
+                continue
+        filters[name] = value
+    return filters
+
+
+def filter_materials(materials, filters):
+    for name, value in filters.items():
+        field = f'{name}_id' if name in ID_FACETS else name
+        materials = materials.filter(**{field: value})
+    return materials
+
+
+def _generation_key(department_id):
+    return f'facets:generation:{department_id}'
+
+
+def generation(department_id):
+    key = _generation_key(department_id)
+    cache.add(key, 1, timeout=None)
+    return cache.get(key, 1)
+
+
+@receiver(post_save, sender=Material, dispatch_uid='accounts.facets.material_saved')
+@receiver(post_delete, sender=Material, dispatch_uid='accounts.facets.material_deleted')
+def bump_generation(sender, instance, **kwargs):
+    if in_bulk_change():
+        return
+    bump_department(instance.department_id)
+    # A row moved by this save also leaves its old department's counts
+    moved_from = getattr(instance, 'moved_from_department_id', None)
+    if moved_from is not None:
+        bump_department(moved_from)
+
+
+def bump_department(department_id):
+    """Start a new generation for the department, after changes that bypass the signals"""
+    key = _generation_key(department_id)
+    cache.add(key, 1, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+# Backends whose entries are private to one process
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_generations(app_configs, **kwargs):
+    if settings.CACHES['default']['BACKEND'] not in PER_PROCESS_CACHES:
+        return []
+    return [Error(
+        "The default cache is private to each process, so facet generations bumped by one worker "
+        "are never seen by the others and they serve stale facet counts.",
+        hint="Set STUDYHUB_REDIS_URL (or point CACHES['default'] at another shared cache).",
+        id='accounts.E001',
+    )]
+
+
+def facet_rows(department_id, search_query=''):
+    """``[(level_id, level, category_id, category, semester_id, semester, session, count), ...]``"""
+    digest = hashlib.md5(search_query.lower().encode()).hexdigest()
+    key = f'facets:{department_id}:{generation(department_id)}:{digest}'
+
+    def count():
+        materials = Material.objects.filter(department_id=department_id)
+        if search_query:
+            materials = materials.filter(search_filter(search_query))
+        columns = [column for _, value, label, _ in FACETS for column in dict.fromkeys((value, label))]
+        return list(materials.order_by().values_list(*columns).annotate(count=Count('id')))
+
+    return layered.get_or_set(key, count, settings.FACET_CACHE_TIMEOUT)
+
+
+def facet_counts(rows, filters):
+    """
+    Build ``(facets, total)`` for the selected filters. Each facet counts
+    what would match if its own selection were changed and the others kept.
+    """
+    # Row layout: level_id, level, category_id, category, semester_id, semester, session, count
+    positions = {'level': (0, 1), 'category': (2, 3), 'semester': (4, 5), 'session': (6, 6)}
+
+    def matches(row, skip=None):
+        return all(row[positions[name][0]] == value
+                   for name, value in filters.items() if name != skip)
+
+    facets = []
+    for name, _, _, heading in FACETS:
+        value_at, label_at = positions[name]
+        options = {}
+        for row in rows:
+            if row[value_at] is None or not matches(row, skip=name):
+                continue
+            value = row[value_at]
+            label, count = options.get(value, (row[label_at], 0))
+            options[value] = (label, count + row[-1])
+        facets.append({
+            'name': name,
+            'heading': heading,
+            'options': [
+                {'value': value, 'label': label, 'count': count, 'selected': filters.get(name) == value}
+                for value, (label, count) in sorted(options.items(), key=lambda item: str(item[1][0]))
+            ],
+        })
+    total = sum(row[-1] for row in rows if matches(row))
+    return facets, total
+
+
+def department_facets(department_id, search_query='', filters=None):
+    return facet_counts(facet_rows(department_id, search_query), filters or {})
@@ -1,7 +1,14 @@
+import re
+import zipfile
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.core.validators import RegexValidator
-from .models import CustomUser, Department, Faculty, Category, Level, Semester, Material
+from .models import CustomUser, Department, Faculty, Category, Level, Semester, Material, ArchiveImport
+
+# Shared by the upload form and the bulk importers
+VALID_EXTENSIONS = ['.pdf', '.doc', '.docx', '.ppt', '.pptx', '.zip']
+MAX_UPLOAD_SIZE = 25 * 1024 * 1024
 
 class EmailAuthenticationForm(AuthenticationForm):
     username = forms.EmailField(
@@ -184,20 +191,101 @@ class MaterialUploadForm(forms.ModelForm):
         file = self.cleaned_data.get('file')
         if file:
             # File extension validation
-            valid_extensions = ['.pdf', '.doc', '.docx', '.ppt', '.pptx', '.zip']
-            if not any(file.name.lower().endswith(ext) for ext in valid_extensions):
+            if not any(file.name.lower().endswith(ext) for ext in VALID_EXTENSIONS):
                 raise forms.ValidationError(
                     'Unsupported file format. Please upload: PDF, Word, PowerPoint, or ZIP files.'
                 )
             
             # File size validation (25MB max)
-            max_size = 25 * 1024 * 1024
+            max_size = MAX_UPLOAD_SIZE
             if file.size > max_size:
                 raise forms.ValidationError(
                     f'File size exceeds {max_size//(1024*1024)}MB limit. Your file: {file.size//(1024*1024)}MB'
                 )
         return file
 
+class ArchiveUploadForm(forms.ModelForm):
+    """A ZIP of materials; the chosen level, category, semester and session are defaults"""
+
+    class Meta:
+        model = ArchiveImport
+        fields = ['archive', 'level', 'category', 'semester', 'session']
+        widgets = {
+            'archive': forms.FileInput(attrs={'class': 'form-control', 'accept': '.zip'}),
+            'level': forms.Select(attrs={'class': 'form-control'}),
+            'category': forms.Select(attrs={'class': 'form-control'}),
+            'semester': forms.Select(attrs={'class': 'form-control'}),
+            'session': forms.TextInput(attrs={
+                'placeholder': '2022/2023',
+                'class': 'form-control'
+            }),
+        }
+
+    def clean_archive(self):
+        archive = self.cleaned_data.get('archive')
+        if archive:
+            if not archive.name.lower().endswith('.zip'):
+                raise forms.ValidationError('Please upload a ZIP archive.')
+            max_size = settings.ARCHIVE_MAX_UPLOAD_SIZE
+            if archive.size > max_size:
+                raise forms.ValidationError(
+                    f'Archive exceeds {max_size//(1024*1024)}MB limit. Your file: {archive.size//(1024*1024)}MB'
+                )
+            if not zipfile.is_zipfile(archive):
+                raise forms.ValidationError('This file is not a valid ZIP archive.')
+            archive.seek(0)
+        return archive
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+
+    def clean_session(self):
+        session = self.cleaned_data.get('session', '')
+        if not re.match(r'^\d{4}/\d{4}$', session):
+            raise forms.ValidationError('Use the YYYY/YYYY format, e.g. 2022/2023.')
+        return session
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Imported materials go to the uploader's department
+        if self.user is not None and self.user.department_id is None:
+            raise forms.ValidationError('Your account has no department; ask an administrator to set one.')
+        return cleaned_data
+
+class ClassListForm(forms.Form):
+    class_list = forms.FileField(help_text="CSV with an email column, and optionally username, "
+                                           "first_name, last_name and password.")
+    send_email = forms.BooleanField(required=False, initial=True, label="Send welcome emails")
+
+    def clean_class_list(self):
+        class_list = self.cleaned_data.get('class_list')
+        if class_list and not class_list.name.lower().endswith('.csv'):
+            raise forms.ValidationError('Please upload a CSV file.')
+        return class_list
+
+class BulkEditForm(forms.Form):
+    """New values for the selected materials; fields left empty are not changed"""
+    semester = forms.ModelChoiceField(Semester.objects.all(), required=False)
+    category = forms.ModelChoiceField(Category.objects.all(), required=False)
+    level = forms.ModelChoiceField(Level.objects.all(), required=False)
+    session = forms.CharField(required=False, max_length=10, help_text="YYYY/YYYY, e.g. 2022/2023")
+
+    def clean_session(self):
+        session = self.cleaned_data.get('session', '')
+        if session and not re.match(r'^\d{4}/\d{4}$', session):
+            raise forms.ValidationError('Use the YYYY/YYYY format, e.g. 2022/2023.')
+        return session
+
+    def changes(self):
+        return {field: value for field, value in self.cleaned_data.items() if value}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not self.errors and not self.changes():
+            raise forms.ValidationError('Choose at least one value to change.')
+        return cleaned_data
+
 class FacultyForm(forms.ModelForm):
     class Meta:
         model = Faculty
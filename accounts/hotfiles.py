@@ -0,0 +1,163 @@
+"""
+Memory-mapped cache of frequently downloaded media files.
+
+A file is mapped once it has been requested ``HOT_FILE_ADMIT_AFTER`` times
+while its path is still remembered, so one-off downloads do not push
+this week's lectures out. Mapped files are kept in LRU order up to
+``HOT_FILE_CACHE_BYTES`` in total. Serving a cached file costs one
+``stat`` per response to check it has not changed, instead of an open, a
+read per chunk and a close. The bytes come straight from the shared
+mapping, which the kernel backs with the page cache: ``read`` copies them
+into ``bytes``, as WSGI servers require, while ``chunks`` hands out
+``memoryview`` slices without copying.
+
+Touching a mapped page past the end of a file truncated since it was
+mapped kills the process with SIGBUS. Uploads are written once under a
+new name and never truncated in place, and files modified in the last
+``HOT_FILE_MIN_AGE`` seconds (possibly still being written) are never
+mapped. A file whose inode, size or mtime differ from the mapping's at
+the start of a response is mapped afresh, and one that shrank while it
+was being mapped is served uncached.
+
+Collected static files have their own, smaller cache
+(``HOT_STATIC_FILE_CACHE_BYTES``) so page assets and downloads do not
+evict each other.
+"""
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+from stat import S_ISREG
+
+from django.conf import settings
+
+
+def signature(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class MappedFile:
+    """Read-only file-like view of a mapping with its own position"""
+
+    def __init__(self, mapping, name):
+        self._mapping = mapping
+        self._view = memoryview(mapping)
+        self._pos = 0
+        self.name = name
+        self.size = len(mapping)
+
+    def read(self, size=-1):
+        """The next ``size`` bytes, as ``bytes`` (WSGI servers write only those)"""
+        end = self.size if size is None or size < 0 else min(self.size, self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def chunks(self, chunk_size):
+        """Yield memoryview slices without copying"""
+        for start in range(self._pos, self.size, chunk_size):
+            yield self._view[start:start + chunk_size]
+        self._pos = self.size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: self.size}[whence]
+        self._pos = max(0, min(self.size, base + offset))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        # The mapping stays open for other readers; it is unmapped once
+        # evicted and no view refers to it any more.
+        self._view.release()
+
+
+class HotFileCache:
+    def __init__(self, max_bytes=None, max_file_bytes=None, admit_after=None, min_age=None):
+        self.max_bytes = settings.HOT_FILE_CACHE_BYTES if max_bytes is None else max_bytes
+        self.max_file_bytes = settings.HOT_FILE_MAX_BYTES if max_file_bytes is None else max_file_bytes
+        self.admit_after = settings.HOT_FILE_ADMIT_AFTER if admit_after is None else admit_after
+        self.min_age = min_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # path -> (signature, mapping)
+        self._seen = OrderedDict()      # path -> requests while not cached
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, path):
+        """Return a ``MappedFile`` for ``path`` if it is (or becomes) cached, else None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+        file_signature = signature(stat)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if entry[0] == file_signature:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return MappedFile(entry[1], path)
+                # Changed on disk: remap it straight away, it is still hot
+                self._drop(path)
+            self.misses += 1
+            if not S_ISREG(stat.st_mode) or not 0 < stat.st_size <= self.max_file_bytes:
+                return None
+            min_age = settings.HOT_FILE_MIN_AGE if self.min_age is None else self.min_age
+            if time.time() - stat.st_mtime < min_age:
+                # May still be being written
+                return None
+            seen = self.admit_after if entry is not None else self._seen.pop(path, 0) + 1
+            if seen < self.admit_after:
+                self._seen[path] = seen
+                while len(self._seen) > 4096:
+                    self._seen.popitem(last=False)
+                return None
+
+        with open(path, 'rb') as handle:
+            mapping = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapping) != stat.st_size or signature(os.stat(path)) != file_signature:
+            # Changed while we were mapping it; serve it uncached this time
+            mapping.close()
+            return None
+
+        with self._lock:
+            if path in self._entries:
+                self._drop(path)
+            self._entries[path] = (file_signature, mapping)
+            self.size += stat.st_size
+            while self.size > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+        return MappedFile(mapping, path)
+
+    def _drop(self, path):
+        file_signature, _ = self._entries.pop(path)
+        self.size -= file_signature[1]
+
+    def invalidate(self, path):
+        with self._lock:
+            if path in self._entries:
+                self._drop(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+hot_files = HotFileCache()
+hot_static_files = HotFileCache(max_bytes=settings.HOT_STATIC_FILE_CACHE_BYTES)
@@ -0,0 +1,137 @@
+"""
+In-process pub/sub for live material-list updates.
+
+``post_save``/``post_delete`` on ``Material`` publish an event to every
+subscriber of the material's department once the transaction commits.
+Subscribers are SSE streams in ``async_views.material_events``; each owns a
+bounded ``asyncio.Queue`` on its event loop, so thousands of idle clients
+cost a task and a queue each rather than a thread. A client that falls
+``LIVE_UPDATES_QUEUE_SIZE`` events behind gets a single ``resync`` event
+instead of an ever-growing backlog.
+
+Events only reach clients connected to the worker that saved the
+material; other workers' clients pick the change up on their next reload.
+A save with nobody subscribed to its department builds no event, so it
+costs no lookups of the level, category and semester.
+
+The stream route only exists when ``ASYNC_VIEWS`` is on: a WSGI worker
+would drain the endless stream into memory.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from .bulk_signals import in_bulk_change
+from .models import Material
+
+def format_event(event):
+    """Encode an event as a Server-Sent Events frame"""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+RESYNC = format_event({'type': 'resync'})
+
+
+class Subscription:
+    def __init__(self, department_id, maxsize):
+        self.department_id = department_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def _put(self, frame):
+        if self.queue.full():
+            # Too far behind: drop the backlog and ask the client to reload
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            frame = RESYNC
+        self.queue.put_nowait(frame)
+
+    def deliver(self, frame):
+        """Thread-safe: schedule the frame on the subscriber's loop"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, frame)
+        except RuntimeError:
+            # The loop has closed; the stream is gone
+            pass
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, department_id, maxsize=None):
+        subscription = Subscription(department_id, maxsize or settings.LIVE_UPDATES_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[department_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.department_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.department_id]
+
+    def subscriber_count(self, department_id=None):
+        with self._lock:
+            if department_id is not None:
+                return len(self._subscribers.get(department_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, department_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(department_id, ()))
+        # Encoded once, however many clients are listening
+        frame = format_event(event)
+        for subscription in subscribers:
+            subscription.deliver(frame)
+        return len(subscribers)
+
+
+broker = Broker()
+
+
+def material_event(material, event_type):
+    if event_type == 'deleted':
+        return {'type': event_type, 'id': material.pk}
+    return {
+        'type': event_type,
+        'id': material.pk,
+        'title': material.title,
+        'code': material.code,
+        'level': str(material.level),
+        'category': material.category.name if material.category_id else None,
+        'semester': str(material.semester) if material.semester_id else None,
+        'session': material.session,
+        'download_url': reverse('track_download', args=[material.pk]),
+    }
+
+
+@receiver(post_save, sender=Material, dispatch_uid='accounts.live.material_saved')
+def _material_saved(sender, instance, created, **kwargs):
+    if in_bulk_change() or not broker.subscriber_count(instance.department_id):
+        return
+    event = material_event(instance, 'created' if created else 'updated')
+    department_id = instance.department_id
+    transaction.on_commit(lambda: broker.publish(department_id, event))
+
+
+@receiver(post_delete, sender=Material, dispatch_uid='accounts.live.material_deleted')
+def _material_deleted(sender, instance, **kwargs):
+    if in_bulk_change() or not broker.subscriber_count(instance.department_id):
+        return
+    event = material_event(instance, 'deleted')
+    department_id = instance.department_id
+    transaction.on_commit(lambda: broker.publish(department_id, event))
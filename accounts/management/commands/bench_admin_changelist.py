@@ -0,0 +1,68 @@
+import time
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Material
+from accounts.seeding import seed_catalog
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seed materials and users, then time the admin changelists (data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--materials', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        User = get_user_model()
+        started = time.perf_counter()
+        seed_catalog(materials=options['materials'], users=options['users'])
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+        superuser = User.objects.create(email='bench-admin@example.com', username='bench-admin',
+                                        is_staff=True, is_superuser=True)
+        factory = RequestFactory()
+        pages = [
+            ('materials', Material, ''),
+            ('materials search', Material, '?q=CSC1'),
+            ('materials filtered', Material, '?upload_date__gte=2000-01-01T00:00:00%2B00:00'),
+            ('users', User, ''),
+            ('users search', User, '?q=bench1'),
+        ]
+        for label, model, query in pages:
+            model_admin = admin.site._registry[model]
+            timings = []
+            for _ in range(options['repeat']):
+                request = factory.get(f'/admin/{query}')
+                request.user = superuser
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = model_admin.changelist_view(request)
+                    response.render()
+                    timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f"{label:<20} median {timings[len(timings) // 2] * 1000:8.1f} ms  "
+                f"queries {len(queries)}"
+            )
@@ -0,0 +1,79 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from accounts import autocomplete, views
+from accounts.models import Department
+from accounts.seeding import seed_catalog
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seed a catalog, then time autocomplete index builds and lookups (data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--materials', type=int, default=100000)
+        parser.add_argument('--departments', type=int, default=1)
+        parser.add_argument('--lookups', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+        autocomplete.clear()
+
+    def run(self, options):
+        started = time.perf_counter()
+        catalog = seed_catalog(materials=options['materials'], users=200,
+                               departments=options['departments'])
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+        department = catalog['departments'][0]
+
+        autocomplete.clear()
+        started = time.perf_counter()
+        index = autocomplete.material_index(department.id)
+        self.stdout.write(
+            f"index build          {(time.perf_counter() - started) * 1000:8.1f} ms  "
+            f"{len(index.codes)} code keys, {len(index.titles)} title keys"
+        )
+
+        rng = random.Random(0)
+        prefixes = ['c', 'CS', 'csc 1', 'cse-4', 'MTH2', 'phy 30', 'lecture', 'lecture 1', '40', 'x']
+        queries = [rng.choice(prefixes) for _ in range(options['lookups'])]
+        self.report('index lookup', [self.timed(index.search, query, 10) for query in queries])
+
+        def lookup(query):
+            return autocomplete.material_index(department.id).search(query, 10)
+        self.report('material_index()', [self.timed(lookup, query) for query in queries])
+
+        factory = RequestFactory()
+        user = get_user_model().objects.create(email='bench-ac@example.com', username='bench-ac')
+        slug = Department.objects.get(pk=department.id).slug
+
+        def call(query):
+            request = factory.get('/', {'q': query})
+            request.user = user
+            return views.material_autocomplete(request, slug)
+        self.report('view', [self.timed(call, query) for query in queries[:2000]])
+
+    @staticmethod
+    def timed(func, *args):
+        started = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - started
+
+    def report(self, label, timings):
+        timings.sort()
+        median = timings[len(timings) // 2] * 1e6
+        p99 = timings[int(len(timings) * 0.99)] * 1e6
+        self.stdout.write(f"{label:<20} median {median:8.1f} us  p99 {p99:8.1f} us")
@@ -0,0 +1,50 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.exports import export_response
+from accounts.models import Material
+from accounts.seeding import seed_catalog
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Seed materials in steps and stream every export after each step, reporting peak Python memory "
+            "(data is rolled back)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                            help="Total materials to measure at")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        seeded = 0
+        for size in sorted(options['sizes']):
+            if size > seeded:
+                seed_catalog(materials=size - seeded, users=100 if not seeded else 0, seed=seeded)
+                seeded = size
+            for name, fmt in (('materials', 'csv'), ('materials', 'jsonl'), ('downloads', 'csv')):
+                tracemalloc.start()
+                started = time.perf_counter()
+                written = 0
+                for chunk in export_response(name, Material.objects.all(), fmt).streaming_content:
+                    written += len(chunk)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(
+                    f"{size:>8} materials  {name:<9} {fmt:<5} {written / 1024 / 1024:7.1f} MB "
+                    f"in {elapsed:6.2f}s  peak {peak / 1024 / 1024:6.2f} MB"
+                )
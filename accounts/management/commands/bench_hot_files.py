@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import FileResponse
+
+from accounts.hotfiles import HotFileCache
+
+
+def read_syscalls():
+    """Read syscalls made by this process so far (Linux only)"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('syscr:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Command(BaseCommand):
+    help = "Compare repeated downloads of one file from disk and from the mmap hot-file cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=4 * 1024 * 1024, help="File size in bytes")
+        parser.add_argument('--downloads', type=int, default=500)
+        parser.add_argument('--chunk', type=int, default=64 * 1024)
+
+    def handle(self, *args, **options):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(os.urandom(options['size']))
+            f.flush()
+            cache = HotFileCache(max_bytes=options['size'] * 2, max_file_bytes=options['size'], admit_after=1)
+            modes = (
+                ('disk', lambda: open(f.name, 'rb')),
+                ('mmap', lambda: cache.open(f.name)),
+            )
+            for label, opener in modes:
+                self.run(label, opener, options)
+
+    def run(self, label, opener, options):
+        # One warm-up so both modes start from a hot page cache
+        self.download(opener, options['chunk'])
+        syscalls = read_syscalls()
+        started = time.perf_counter()
+        for _ in range(options['downloads']):
+            self.download(opener, options['chunk'])
+        elapsed = time.perf_counter() - started
+        total_mb = options['size'] * options['downloads'] / (1024 * 1024)
+        line = f"{label}: {total_mb / elapsed:8.0f} MB/s, {elapsed / options['downloads'] * 1000:.2f} ms/download"
+        if syscalls is not None:
+            per_download = (read_syscalls() - syscalls) / options['downloads']
+            line += f", {per_download:.1f} read syscalls/download"
+        self.stdout.write(line)
+
+    @staticmethod
+    def download(opener, chunk):
+        response = FileResponse(opener(), as_attachment=True, filename='bench.pdf')
+        response.block_size = chunk
+        for _ in response:
+            pass
+        response.close()
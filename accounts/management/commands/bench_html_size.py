@@ -0,0 +1,54 @@
+import gzip
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from accounts.seeding import seed_catalog
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Render the main pages and report HTML payload sizes (data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--materials', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        catalog = seed_catalog(materials=options['materials'], users=20, departments=1)
+        department = catalog['departments'][0]
+        uploader = get_user_model().objects.filter(is_uploader=True).first()
+
+        anonymous, student = Client(), Client()
+        student.force_login(uploader)
+        pages = [
+            ('home', anonymous, reverse('home')),
+            ('login', anonymous, reverse('login')),
+            ('signup', anonymous, reverse('signup')),
+            ('departments', student, reverse('department_list')),
+            ('materials', student, reverse('material_list', args=[department.slug])),
+            ('upload', student, reverse('materials_upload')),
+            ('dashboard', student, reverse('admin_dashboard')),
+        ]
+        total = total_gzip = 0
+        for label, client, url in pages:
+            content = client.get(url).content
+            compressed = len(gzip.compress(content))
+            total += len(content)
+            total_gzip += compressed
+            self.stdout.write(f"{label:<12} {len(content):8d} bytes  {compressed:7d} gzipped")
+        self.stdout.write(f"{'total':<12} {total:8d} bytes  {total_gzip:7d} gzipped")
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from accounts import async_views, downloads, views
+from accounts.models import Faculty, Department, Level, Material
+
+
+class StreamCounter:
+    """Tracks how many downloads are streaming at the same time"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.first_byte = []
+
+    def opened(self, started):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.first_byte.append(time.perf_counter() - started)
+
+    def closed(self):
+        with self.lock:
+            self.active -= 1
+
+
+class Command(BaseCommand):
+    help = ("Compare how many slow-client downloads a pool of WSGI worker threads and "
+            "one ASGI event loop can stream at once (runs against a throwaway test database)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8,
+                            help="WSGI worker threads (gunicorn --workers x --threads)")
+        parser.add_argument('--size', type=int, default=512 * 1024, help="File size in bytes")
+        parser.add_argument('--chunk', type=int, default=64 * 1024)
+        parser.add_argument('--delay', type=float, default=0.05,
+                            help="Seconds the slow client takes to read each chunk")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as tmp:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with override_settings(MEDIA_ROOT=tmp, DOWNLOAD_CHUNK_SIZE=options['chunk']):
+                    user, material = self.fixture(options['size'])
+                    for label, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+                        counter = StreamCounter()
+                        started = time.perf_counter()
+                        run(user, material, counter, options)
+                        elapsed = time.perf_counter() - started
+                        first_byte = sorted(counter.first_byte)
+                        self.stdout.write(
+                            f"{label}: {options['clients']} clients in {elapsed:.2f}s, "
+                            f"peak concurrent streams {counter.peak}, "
+                            f"p50 time-to-first-byte {first_byte[len(first_byte) // 2] * 1000:.0f} ms, "
+                            f"p95 {first_byte[int(len(first_byte) * 0.95)] * 1000:.0f} ms"
+                        )
+                    downloads.discard_pending()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+    def fixture(self, size):
+        faculty = Faculty.objects.create(name='Bench', code='BEN')
+        department = Department.objects.create(name='Bench', code='BEN', faculty=faculty)
+        level = Level.objects.create(name='100L')
+        user = get_user_model().objects.create(email='bench@example.com', username='bench')
+        material = Material(title='Bench', code='BEN101', session='2024/2025',
+                            department=department, level=level, uploaded_by=user)
+        material.file.save('bench.pdf', ContentFile(os.urandom(size)))
+        return user, material
+
+    def run_wsgi(self, user, material, counter, options):
+        factory = RequestFactory()
+
+        # Every client arrives at once; time-to-first-byte includes queueing for a worker
+        started = time.perf_counter()
+
+        def client():
+            # A sync worker is tied up until the slow client has read everything
+            request = factory.get(f'/download/{material.pk}/')
+            request.user = user
+            response = views.track_download(request, material.pk)
+            response.block_size = options['chunk']
+            counter.opened(started)
+            try:
+                for _ in response:
+                    time.sleep(options['delay'])
+            finally:
+                response.close()
+                counter.closed()
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for future in [pool.submit(client) for _ in range(options['clients'])]:
+                future.result()
+
+    def run_asgi(self, user, material, counter, options):
+        factory = AsyncRequestFactory()
+
+        async def auser():
+            return user
+
+        started = time.perf_counter()
+
+        async def client():
+            request = factory.get(f'/download/{material.pk}/')
+            request.user = user
+            request.auser = auser
+            response = await async_views.track_download(request, material.pk)
+            counter.opened(started)
+            try:
+                async for _ in response.streaming_content:
+                    await asyncio.sleep(options['delay'])
+            finally:
+                counter.closed()
+
+        async def main():
+            await asyncio.gather(*(client() for _ in range(options['clients'])))
+
+        asyncio.run(main())
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.downloads import compact_events, compact_hourly_rollups, flush
+
+
+class Command(BaseCommand):
+    help = "Delete raw download events and hourly rollups that are past their retention window"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-days', type=int, default=settings.DOWNLOAD_EVENT_RETENTION_DAYS)
+        parser.add_argument('--hourly-days', type=int,
+                            default=settings.DOWNLOAD_HOURLY_ROLLUP_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        flush()
+        now = timezone.now()
+        events = compact_events(now - timedelta(days=options['event_days']))
+        hourly = compact_hourly_rollups(now - timedelta(days=options['hourly_days']))
+        self.stdout.write(f"Removed {events} raw events and {hourly} hourly rollups")
@@ -0,0 +1,63 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from accounts.bulk_import import ManifestError, MaterialImporter, read_manifest
+from accounts.models import Department
+
+
+class Command(BaseCommand):
+    help = ("Import materials from a directory and a CSV or JSON manifest "
+            "(file, code, title, level, semester, category, session). "
+            "Re-running the same import resumes it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('manifest')
+        parser.add_argument('--department', required=True, help="Department code or slug")
+        parser.add_argument('--uploader', required=True, help="Email of the user credited with the uploads")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes for hashing and copying (0 runs inline)")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Validate and hash only")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError(f"{options['directory']} is not a directory.")
+        department = Department.objects.filter(
+            Q(code__iexact=options['department']) | Q(slug=options['department'])
+        ).first()
+        if department is None:
+            raise CommandError(f"Unknown department {options['department']}.")
+        try:
+            uploader = get_user_model().objects.get(email=options['uploader'])
+            rows = read_manifest(options['manifest'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"Unknown uploader {options['uploader']}.")
+        except ManifestError as e:
+            raise CommandError(str(e))
+
+        importer = MaterialImporter(options['directory'], department, uploader,
+                                    workers=options['workers'], batch_size=options['batch_size'],
+                                    dry_run=options['dry_run'])
+
+        def progress(done, total):
+            self.stdout.write(f"  {done}/{total} imported")
+
+        report, pending = importer.run(rows, progress=progress if options['verbosity'] > 1 else None)
+
+        for number, message in report.errors:
+            self.stderr.write(f"row {number}: {message}")
+        self.stdout.write(report.throughput('hash', report.hashed))
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {len(pending)} new, {report.skipped} already imported, "
+                              f"{len(report.errors)} invalid")
+            return
+        self.stdout.write(report.throughput('import', report.imported, report.bytes))
+        total = sum(report.timings.values())
+        self.stdout.write(
+            f"Imported {report.imported} materials ({report.bytes / 1024 / 1024:.1f} MB) in {total:.1f}s, "
+            f"skipped {report.skipped} already imported, {len(report.errors)} invalid"
+        )
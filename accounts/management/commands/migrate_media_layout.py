@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.media_layout import LayoutMigration, tiers
+
+
+class Command(BaseCommand):
+    help = ("Move material files from the flat materials/ directory into hashed subdirectories "
+            "while the site stays live. Safe to interrupt and run again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--rate', type=float, default=settings.MEDIA_MIGRATION_RATE,
+                            help="Maximum files moved per second (0 for no limit)")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the files still to move")
+
+    def handle(self, *args, **options):
+        migration = LayoutMigration(options['batch_size'], options['rate'] or None)
+        if options['dry_run']:
+            for model, _ in tiers():
+                self.stdout.write(f"{model._meta.verbose_name_plural}: "
+                                  f"{migration.pending(model).count()} files to move")
+            return
+
+        def progress(model, report):
+            self.stdout.write(f"  {model._meta.verbose_name_plural}: {report.moved} moved")
+
+        report = migration.run(progress if options['verbosity'] > 1 else None)
+        for name in report.missing:
+            self.stderr.write(f"missing file: {name}")
+        for name in report.taken:
+            self.stderr.write(f"sharded name already taken, left flat: {name}")
+        self.stdout.write(f"Moved {report.moved} files, {len(report.missing)} missing, "
+                          f"{report.conflicts} changed during the move and left alone, "
+                          f"{len(report.taken)} left flat")
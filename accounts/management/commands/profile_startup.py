@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: import the entry point, then serve two requests to it
+PROBE = r'''
+import asyncio, io, json, sys, time
+started = time.perf_counter()
+import importlib
+application = importlib.import_module(sys.argv[1]).application
+loaded = time.perf_counter()
+path, host = sys.argv[2], sys.argv[3]
+
+def wsgi_request():
+    from wsgiref.util import setup_testing_defaults
+    environ = {'PATH_INFO': path, 'HTTP_HOST': host, 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    body = b''.join(response)
+    getattr(response, 'close', lambda: None)()
+    return int(statuses[0].split()[0]), len(body)
+
+async def asgi_request():
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+             'headers': [(b'host', host.encode())], 'server': (host, 80), 'client': ('127.0.0.1', 50000)}
+    sent, done = [], asyncio.Event()
+    async def receive():
+        if not sent:
+            sent.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+    messages = []
+    async def send(message):
+        messages.append(message)
+    await application(scope, receive, send)
+    done.set()
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return messages[0]['status'], len(body)
+
+def request():
+    begun = time.perf_counter()
+    status, size = asyncio.run(asgi_request()) if sys.argv[1].endswith('asgi') else wsgi_request()
+    return status, size, time.perf_counter() - begun
+
+status, size, first = request()
+_, _, second = request()
+print(json.dumps({'ready': loaded - started, 'first': first, 'second': second,
+                  'total': time.perf_counter() - started - second, 'status': status, 'bytes': size}))
+'''
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = ("Profile a cold worker: import time by module for the WSGI/ASGI entry point, and time to first "
+            "response with and without the warm-up")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='studyhub.wsgi', choices=['studyhub.wsgi', 'studyhub.asgi'])
+        parser.add_argument('--path', default='/', help="Path of the request to time")
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--top', type=int, default=20, help="Modules to list by their own import time")
+        parser.add_argument('--repeat', type=int, default=5, help="Cold starts per configuration")
+
+    def run_child(self, args, warm_up, importtime=False):
+        env = dict(os.environ, STUDYHUB_WARM_UP='1' if warm_up else '0', PYTHONDONTWRITEBYTECODE='1')
+        command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + args
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"Cold start failed:\n{result.stderr[-2000:]}")
+        return result
+
+    def handle(self, *args, **options):
+        self.import_breakdown(options)
+        self.first_response(options)
+
+    def import_breakdown(self, options):
+        # Without the warm-up, so the entry point's own time is just building the application
+        result = self.run_child(['-c', f"import {options['module']}"], warm_up=False, importtime=True)
+        modules = []  # (own us, cumulative us, name)
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                own, cumulative, _, name = match.groups()
+                modules.append((int(own), int(cumulative), name))
+        if not modules:
+            raise CommandError("No -X importtime output to read.")
+
+        total = sum(own for own, _, _ in modules)
+        by_package = defaultdict(int)
+        for own, _, name in modules:
+            by_package[name.split('.')[0]] += own
+        self.stdout.write(f"Importing {options['module']}: {total / 1000:.0f} ms across {len(modules)} modules")
+        self.stdout.write("\nBy top-level package (own time):")
+        for package, own in sorted(by_package.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"  {own / 1000:8.1f} ms  {own / total:5.1%}  {package}")
+        self.stdout.write("\nSlowest modules (own time, cumulative):")
+        for own, cumulative, name in sorted(modules, reverse=True)[:options['top']]:
+            self.stdout.write(f"  {own / 1000:8.1f} ms  {cumulative / 1000:8.1f} ms  {name}")
+
+    def first_response(self, options):
+        self.stdout.write(f"\nCold start to first response, GET {options['path']} "
+                          f"(median of {options['repeat']}):")
+        for warm_up in (False, True):
+            runs = [json.loads(self.run_child(['-c', PROBE, options['module'], options['path'], options['host']],
+                                              warm_up).stdout.splitlines()[-1])
+                    for _ in range(options['repeat'])]
+            median = {key: sorted(run[key] for run in runs)[len(runs) // 2]
+                      for key in ('ready', 'first', 'second', 'total')}
+            self.stdout.write(
+                f"  warm-up {'on ' if warm_up else 'off'}  ready {median['ready'] * 1000:7.1f} ms  "
+                f"first request {median['first'] * 1000:7.1f} ms  second {median['second'] * 1000:6.1f} ms  "
+                f"start to first response {median['total'] * 1000:7.1f} ms  (HTTP {runs[0]['status']})"
+            )
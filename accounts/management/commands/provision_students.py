@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from accounts.models import Department
+from accounts.provisioning import ClassListError, StudentProvisioner, read_class_list
+
+
+class Command(BaseCommand):
+    help = ("Create student accounts from a department's CSV class list "
+            "(email, and optionally username, first_name, last_name, password). "
+            "Students already registered are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('class_list')
+        parser.add_argument('--department', required=True, help="Department code or slug")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes for password hashing (0 runs inline)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-email', action='store_true', help="Do not send welcome emails")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and check uniqueness only")
+
+    def handle(self, *args, **options):
+        department = Department.objects.filter(
+            Q(code__iexact=options['department']) | Q(slug=options['department'])
+        ).first()
+        if department is None:
+            raise CommandError(f"Unknown department {options['department']}.")
+        try:
+            with open(options['class_list'], 'rb') as f:
+                rows = read_class_list(f, options['class_list'])
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['class_list']}: {e.strerror}")
+        except ClassListError as e:
+            raise CommandError(str(e))
+
+        provisioner = StudentProvisioner(department, workers=options['workers'],
+                                         batch_size=options['batch_size'],
+                                         send_email=not options['no_email'], dry_run=options['dry_run'])
+        report, candidates = provisioner.run(rows)
+
+        for number, message in report.errors:
+            self.stderr.write(f"row {number}: {message}")
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {len(candidates)} new, {report.skipped} already registered, "
+                              f"{len(report.errors)} invalid")
+            return
+        timings = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in report.timings.items())
+        self.stdout.write(
+            f"Created {len(report.created)} accounts in {department.name} ({timings}), "
+            f"skipped {report.skipped} already registered, {len(report.errors)} invalid"
+        )
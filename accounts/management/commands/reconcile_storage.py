@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.reconcile import Reconciler
+
+
+class Command(BaseCommand):
+    help = ("Compare stored media files with the database and report orphaned files and missing ones. "
+            "Without --delete this is a dry run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="Delete orphaned files")
+        parser.add_argument('--rate', type=float, default=settings.RECONCILE_DELETE_RATE,
+                            help="Maximum deletions per second (0 for no limit)")
+        parser.add_argument('--grace-hours', type=float, default=settings.RECONCILE_GRACE_HOURS,
+                            help="Leave unreferenced files younger than this alone")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per database round trip")
+
+    def handle(self, *args, **options):
+        reconciler = Reconciler(delete=options['delete'], rate=options['rate'] or None,
+                                grace=timedelta(hours=options['grace_hours']), chunk_size=options['chunk_size'])
+
+        def on_result(kind, storage, name):
+            if kind == 'missing':
+                self.stderr.write(f"missing: {name}")
+            elif options['verbosity'] > 1 or not options['delete']:
+                self.stdout.write(f"{'deleted' if options['delete'] else 'orphan'}: {name}")
+
+        report = reconciler.run(on_result)
+        action = f"deleted {report.deleted}" if options['delete'] else "dry run, nothing deleted"
+        self.stdout.write(
+            f"Checked {report.checked} files: {report.orphans} orphaned "
+            f"({report.orphan_bytes / 1024 / 1024:.1f} MB, {action}), "
+            f"{report.recent} too recent to judge, {report.missing} referenced but missing"
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from accounts.archives import resume_stale_jobs
+
+
+class Command(BaseCommand):
+    help = ("Run archive imports stranded by a worker restart again (queued or running with no progress for "
+            "ARCHIVE_IMPORT_STALE_MINUTES), failing those whose archive is gone")
+
+    def handle(self, *args, **options):
+        resumed, failed = resume_stale_jobs()
+        self.stdout.write(f"Resumed {resumed} archive imports; failed {failed} whose archive was lost")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from accounts.digests import schedule_digests, send_pending_digests
+
+
+class Command(BaseCommand):
+    help = ("Close the current digest window and email each department's students the materials "
+            "uploaded in it. Run it from cron every DIGEST_WINDOW_HOURS; digests that failed to send "
+            "are retried.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-send', action='store_true', help="Only schedule the new digests")
+
+    def handle(self, *args, **options):
+        scheduled = schedule_digests()
+        self.stdout.write(f"Scheduled {len(scheduled)} digests")
+        if options['no_send']:
+            return
+        digests, reached = send_pending_digests()
+        self.stdout.write(f"Sent {digests} digests to {reached} students")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.bulk_import import SESSION_PATTERN
+from accounts.tiering import archive_cutoff, archive_materials, restore_materials
+
+
+class Command(BaseCommand):
+    help = ("Move materials of past sessions to the archive table and cold storage, or back. "
+            "'archive' keeps the MATERIAL_HOT_SESSIONS most recent sessions hot unless --before is "
+            "given; 'restore' brings back the given --session values, or everything.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('direction', choices=['archive', 'restore'])
+        parser.add_argument('--before', help="Archive sessions sorting before this one, e.g. 2022/2023")
+        parser.add_argument('--hot-sessions', type=int, default=None,
+                            help="Number of recent sessions to keep hot (default MATERIAL_HOT_SESSIONS)")
+        parser.add_argument('--session', action='append', default=[], help="Session to restore (repeatable)")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many would move")
+
+    def handle(self, *args, **options):
+        for session in filter(None, [options['before'], *options['session']]):
+            if not SESSION_PATTERN.match(session):
+                raise CommandError(f"Session '{session}' is not in YYYY/YYYY format.")
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+
+        if options['direction'] == 'restore':
+            report = restore_materials(options['session'], options['batch_size'], options['dry_run'])
+            self.stdout.write(f"{verb} {self.moved(report)} materials back to the hot tier")
+            return
+
+        before = options['before'] or archive_cutoff(options['hot_sessions'])
+        if before is None:
+            self.stdout.write("No materials to archive")
+            return
+        report = archive_materials(before, options['batch_size'], options['dry_run'])
+        self.stdout.write(f"{verb} {self.moved(report)} materials from sessions before {before} to the archive")
+
+    def moved(self, report):
+        """The number moved, listing missing files on stderr"""
+        for name in report.missing:
+            self.stderr.write(f"missing file, not moved: {name}")
+        return report.moved
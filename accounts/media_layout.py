@@ -0,0 +1,175 @@
+"""
+Online migration from the flat ``materials/`` directory to the sharded
+layout of ``sharded_name``.
+
+The site stays live while files move. Each batch goes through these
+steps:
+
+1. Every file gets a second name in its shard, exactly
+   ``sharded_name(old)``. This is a hard link where the storage is local,
+   so nothing is copied. If a newer upload already holds that name, the
+   row stays in the flat directory and is reported.
+2. The rows are repointed in one guarded ``UPDATE``. A row whose file
+   changed in the meantime keeps its new file, and the spare link is
+   removed.
+3. The old names are only unlinked after the *next* batch commits.
+
+A request that read a row just before the update can still open the
+old path. Because every moved file sits at ``sharded_name`` of its old
+name, ``legacy_name`` can redirect any old URL still in circulation
+(cached pages, saved offline copies) without a lookup table.
+
+Only rows still pointing into the flat directory are selected, so an
+interrupted run resumes where it stopped. A crash between linking and
+updating leaves at most one batch of second names; the rerun finds each
+one and, when it is the same file (the same inode, or the same bytes on
+storage without local paths), uses it instead of placing another.
+"""
+import os
+import re
+import shutil
+import time
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, CharField, F, Value, When
+
+from .models import ArchivedMaterial, Material, sharded_name
+from .storage import cold_storage
+
+FLAT_PATTERN = r'^materials/[^/]+$'
+_flat = re.compile(FLAT_PATTERN)
+
+
+def tiers():
+    """(model, storage) pairs whose files use the materials layout"""
+    return [(Material, default_storage), (ArchivedMaterial, cold_storage)]
+
+
+def legacy_name(name, storage=default_storage):
+    """Where a flat ``materials/`` name lives now, or None"""
+    if not _flat.match(name) or storage.exists(name):
+        return None
+    sharded = sharded_name(name)
+    return sharded if storage.exists(sharded) else None
+
+
+class NameTaken(Exception):
+    """The sharded name already holds a different file"""
+
+
+def _same_file(storage, a, b):
+    try:
+        return os.path.samefile(storage.path(a), storage.path(b))
+    except NotImplementedError:
+        if storage.size(a) != storage.size(b):
+            return False
+        with storage.open(a, 'rb') as first, storage.open(b, 'rb') as second:
+            while chunk := first.read(1024 * 1024):
+                if chunk != second.read(len(chunk)):
+                    return False
+        return True
+
+
+def _place(storage, old, new):
+    """Give the file ``old`` the second name ``new``, or find it already there; returns ``new``"""
+    if storage.exists(new):
+        if not storage.exists(old):
+            raise FileNotFoundError(old)
+        # A rerun after a crash between linking and updating
+        if _same_file(storage, old, new):
+            return new
+        raise NameTaken(new)
+    try:
+        source, target = storage.path(old), storage.path(new)
+    except NotImplementedError:
+        with storage.open(old, 'rb') as f:
+            return storage.save(new, f)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        if not os.path.exists(source):
+            raise FileNotFoundError(source)
+        # Hard links are not available on every filesystem
+        shutil.copy2(source, target)
+    return new
+
+
+class LayoutReport:
+    def __init__(self):
+        self.moved = 0
+        self.missing = []  # flat names with no file behind them
+        self.conflicts = 0  # rows changed by someone else mid-batch
+        self.taken = []  # flat names whose sharded name a newer upload holds; left flat
+
+
+class LayoutMigration:
+    def __init__(self, batch_size=200, rate=None, sleep=time.sleep):
+        self.batch_size = batch_size
+        self.rate = rate  # files per second, None for no limit
+        self.sleep = sleep
+        self.retired = []  # (storage, name) to unlink after the next commit
+
+    def pending(self, model):
+        return model.objects.filter(file__regex=FLAT_PATTERN)
+
+    def run(self, progress=None):
+        report = LayoutReport()
+        for model, storage in tiers():
+            last = 0
+            while True:
+                started = time.monotonic()
+                rows = list(self.pending(model).filter(pk__gt=last).order_by('pk')
+                            .values_list('pk', 'file')[:self.batch_size])
+                if not rows:
+                    break
+                last = rows[-1][0]
+                self.migrate_batch(model, storage, rows, report)
+                if progress:
+                    progress(model, report)
+                self.throttle(len(rows), time.monotonic() - started)
+        self.unlink_retired()
+        return report
+
+    def migrate_batch(self, model, storage, rows, report):
+        placed = {}
+        for pk, old in rows:
+            try:
+                placed[pk] = (old, _place(storage, old, sharded_name(old)))
+            except FileNotFoundError:
+                report.missing.append(old)
+            except NameTaken:
+                report.taken.append(old)
+        if not placed:
+            return
+        with transaction.atomic():
+            # Only rows still pointing at the file we linked are repointed
+            model.objects.filter(pk__in=placed).update(file=Case(
+                *[When(pk=pk, file=old, then=Value(new)) for pk, (old, new) in placed.items()],
+                default=F('file'), output_field=CharField(),
+            ))
+            current = dict(model.objects.filter(pk__in=placed).values_list('pk', 'file'))
+        previous, self.retired = self.retired, []
+        for pk, (old, new) in placed.items():
+            if current.get(pk) == new:
+                self.retired.append((storage, old))
+                report.moved += 1
+            else:
+                storage.delete(new)
+                report.conflicts += 1
+        self.unlink(previous)
+
+    def throttle(self, count, elapsed):
+        if self.rate:
+            delay = count / self.rate - elapsed
+            if delay > 0:
+                self.sleep(delay)
+
+    def unlink(self, names):
+        for storage, name in names:
+            storage.delete(name)
+
+    def unlink_retired(self):
+        self.unlink(self.retired)
+        self.retired = []
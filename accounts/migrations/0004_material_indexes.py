@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_remove_category_department_alter_material_category'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='material',
+            name='code',
+            field=models.CharField(db_index=True, help_text='Course code (e.g. CSC101)', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='material',
+            name='upload_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_material_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_events', to='accounts.department')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_events', to='accounts.material')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='download_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DownloadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_rollups', to='accounts.department')),
+                ('level', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_rollups', to='accounts.level')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_rollups', to='accounts.material')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+                'indexes': [models.Index(fields=['granularity', 'department', 'bucket'], name='accounts_do_granula_0aadc8_idx'), models.Index(fields=['granularity', 'level', 'bucket'], name='accounts_do_granula_417bf7_idx')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'material'), name='unique_download_rollup')],
+            },
+        ),
+    ]
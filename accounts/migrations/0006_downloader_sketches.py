@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_download_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloaderSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('registers', models.BinaryField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('department', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='downloader_sketch', to='accounts.department')),
+                ('material', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='downloader_sketch', to='accounts.material')),
+            ],
+            options={
+                'constraints': [models.CheckConstraint(condition=models.Q(('material__isnull', True), ('department__isnull', True), _connector='XOR'), name='downloader_sketch_single_owner')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_downloader_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialPopularity',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='accounts.material')),
+                ('log_score', models.FloatField()),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.department')),
+                ('level', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.level')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['department', '-log_score'], name='accounts_ma_departm_19189f_idx'), models.Index(fields=['department', 'level', '-log_score'], name='accounts_ma_departm_a54a92_idx')],
+            },
+        ),
+    ]
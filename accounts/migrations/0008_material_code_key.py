@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+def fill_code_keys(apps, schema_editor):
+    Material = apps.get_model('accounts', 'Material')
+    materials = Material.objects.only('code').order_by('pk')
+    batch = []
+    for material in materials.iterator(chunk_size=2000):
+        material.code_key = ''.join(ch for ch in material.code if ch.isalnum()).upper()
+        batch.append(material)
+        if len(batch) == 2000:
+            Material.objects.bulk_update(batch, ['code_key'])
+            batch = []
+    Material.objects.bulk_update(batch, ['code_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_material_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='code_key',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.RunPython(fill_code_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['department', 'code_key'], name='material_dept_code_key'),
+        ),
+    ]
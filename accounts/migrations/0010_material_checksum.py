@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='checksum',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the file, recorded by bulk imports', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['department', 'checksum'], name='material_dept_checksum'),
+        ),
+    ]
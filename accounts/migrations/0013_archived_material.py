@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:32
+
+import accounts.storage
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_material_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMaterial',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=50)),
+                ('code', models.CharField(max_length=10)),
+                ('code_key', models.CharField(blank=True, max_length=10)),
+                ('file', models.FileField(storage=accounts.storage.ColdStorage(), upload_to='materials/')),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('session', models.CharField(max_length=10)),
+                ('upload_date', models.DateTimeField()),
+                ('modified', models.DateTimeField()),
+                ('download_count', models.PositiveIntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.category')),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_materials', to='accounts.department')),
+                ('level', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.level')),
+                ('semester', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.semester')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_materials', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-upload_date'],
+                'indexes': [models.Index(fields=['department', 'session'], name='archived_dept_session'), models.Index(fields=['department', 'code_key'], name='archived_dept_code_key')],
+            },
+        ),
+    ]
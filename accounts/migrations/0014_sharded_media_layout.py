@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:35
+
+import accounts.models
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_archived_material'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedmaterial',
+            name='file',
+            field=models.FileField(storage=accounts.storage.ColdStorage(), upload_to=accounts.models.material_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='material',
+            name='file',
+            field=models.FileField(upload_to=accounts.models.material_upload_to),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:14
+
+import accounts.models
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_sharded_media_layout'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='material',
+            name='code_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=accounts.models.PrefixIndex(django.db.models.functions.text.Lower('email'), name='user_email_lower_prefix'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=accounts.models.PrefixIndex(django.db.models.functions.text.Lower('username'), name='user_username_lower_prefix'),
+        ),
+    ]
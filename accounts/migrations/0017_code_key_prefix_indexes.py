@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_stream_counters'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedmaterial',
+            name='archived_dept_code_key',
+        ),
+        migrations.RemoveIndex(
+            model_name='material',
+            name='material_dept_code_key',
+        ),
+        migrations.AddIndex(
+            model_name='archivedmaterial',
+            index=models.Index(fields=['department', 'code_key'], name='archived_dept_code_key', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['department', 'code_key'], name='material_dept_code_key', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+    ]
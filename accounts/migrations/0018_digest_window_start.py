@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_code_key_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='digest',
+            name='digest_department_window',
+        ),
+        migrations.AddConstraint(
+            model_name='digest',
+            constraint=models.UniqueConstraint(fields=('department', 'window_start'), name='digest_department_window'),
+        ),
+    ]
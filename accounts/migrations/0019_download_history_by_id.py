@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_digest_window_start'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downloadersketch',
+            name='material',
+            field=models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='downloader_sketch', to='accounts.material'),
+        ),
+        migrations.AlterField(
+            model_name='downloadevent',
+            name='material',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='download_events', to='accounts.material'),
+        ),
+        migrations.AlterField(
+            model_name='downloadrollup',
+            name='material',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='download_rollups', to='accounts.material'),
+        ),
+        migrations.AlterField(
+            model_name='materialpopularity',
+            name='material',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='popularity', serialize=False, to='accounts.material'),
+        ),
+    ]
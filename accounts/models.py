@@ -1,8 +1,47 @@
+import hashlib
 import os
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.utils.text import slugify
+from .storage import cold_storage
+
+
+def normalize_code(code):
+    """Comparable form of a course code, e.g. "cse-403" and "CSE 403" become CSE403"""
+    return ''.join(ch for ch in code if ch.isalnum()).upper()
+
+
+def sharded_name(filename, prefix='materials'):
+    """
+    ``materials/3f/a2/notes.pdf``: two levels of 256 directories keyed on a
+    hash of the file name, so no directory grows past a few hundred entries
+    """
+    name = os.path.basename(filename)
+    digest = hashlib.md5(name.encode()).hexdigest()
+    return f'{prefix}/{digest[:2]}/{digest[2:4]}/{name}'
+
+
+def material_upload_to(instance, filename):
+    return sharded_name(filename)
+
+class PrefixIndex(models.Index):
+    """
+    Expression index that serves ``LIKE 'prefix%'`` lookups. PostgreSQL
+    only uses a btree index for LIKE with the ``text_pattern_ops`` operator
+    class (unless the database collation is C); other backends take the
+    index as is.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        index = self
+        if schema_editor.connection.vendor == 'postgresql':
+            from django.contrib.postgres.indexes import OpClass
+            index = self.clone()
+            index.expressions = [OpClass(expression, name='text_pattern_ops') for expression in self.expressions]
+        return super(PrefixIndex, index).create_sql(model, schema_editor, using=using, **kwargs)
 
 class CustomUser(AbstractUser):
     email = models.EmailField(unique=True)
@@ -37,10 +76,18 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.email
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Admin user search matches case-insensitive prefixes of these
+            PrefixIndex(Lower('email'), name='user_email_lower_prefix'),
+            PrefixIndex(Lower('username'), name='user_username_lower_prefix'),
+        ]
+
 class Faculty(models.Model):
     name = models.CharField(max_length=50, unique=True)
     code = models.CharField(max_length=10, unique=True)
     slug = models.SlugField(max_length=50, unique=True, blank=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
     
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -59,6 +106,7 @@ class Department(models.Model):
         related_name='departments'
     )
     slug = models.SlugField(max_length=50, unique=True, blank=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
     
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -86,14 +134,45 @@ class Semester(models.Model):
     def __str__(self):
         return self.name
 
+class MaterialQuerySet(models.QuerySet):
+    def accessible_to(self, user):
+        """Materials the user can access (mirrors Material.is_accessible_to)"""
+        if not user.is_authenticated:
+            return self.none()
+        if user.is_superuser:
+            return self.all()
+        rule = Q(uploaded_by_id=user.pk)
+        if user.is_uploader and user.department_id is not None:
+            rule |= Q(department_id=user.department_id)
+        return self.filter(rule)
+
+    def editable_by(self, user):
+        """Materials the user can change (mirrors Material.is_editable_by)"""
+        if not user.is_authenticated:
+            return self.none()
+        if user.is_superuser:
+            return self.all()
+        if not user.is_uploader:
+            return self.none()
+        rule = Q(uploaded_by_id=user.pk)
+        if user.department_id is not None:
+            rule |= Q(department_id=user.department_id)
+        return self.filter(rule)
+
 class Material(models.Model):
     title = models.CharField(max_length=50)
     code = models.CharField(
         max_length=10,
         blank=False,
+        db_index=True,
         help_text="Course code (e.g. CSC101)"
     )
-    file = models.FileField(upload_to='materials/')
+    code_key = models.CharField(max_length=10, blank=True, editable=False, db_index=True)
+    file = models.FileField(upload_to=material_upload_to)
+    checksum = models.CharField(
+        max_length=64, blank=True, editable=False,
+        help_text='SHA-256 of the file, recorded by bulk imports'
+    )
     session = models.CharField(max_length=10)
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
     semester = models.ForeignKey(Semester, on_delete=models.SET_NULL, 
@@ -106,18 +185,56 @@ class Material(models.Model):
         on_delete=models.CASCADE,
         related_name='uploaded_materials'
     )
-    upload_date = models.DateTimeField(auto_now_add=True)
+    upload_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
     
     download_count = models.PositiveIntegerField(
         default=0, verbose_name='Download_count',
         help_text='Number of times this material has benn download'
     )
 
+    objects = MaterialQuerySet.as_manager()
+
     def is_accessible_to(self, user):
         """Check if user can access this material"""
+        if not user.is_authenticated:
+            return False
         return (user.is_superuser or 
-                self.uploaded_by == user or 
-                (user.is_uploader and user.department == self.department))
+                self.uploaded_by_id == user.pk or 
+                (user.is_uploader and user.department_id is not None
+                 and user.department_id == self.department_id))
+
+    def is_editable_by(self, user):
+        """Check if user can change or delete this material"""
+        if not user.is_authenticated:
+            return False
+        if user.is_superuser:
+            return True
+        return user.is_uploader and (
+            self.uploaded_by_id == user.pk or
+            (user.department_id is not None and user.department_id == self.department_id))
+
+    def save(self, *args, **kwargs):
+        self.code_key = normalize_code(self.code)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Keep the derived key and the sync timestamp in step with partial saves
+            extra = {'modified', 'code_key'} if 'code' in update_fields else {'modified'}
+            kwargs['update_fields'] = {*update_fields, *extra}
+        # Receivers of this save learn which department a moved row left
+        stored = getattr(self, '_stored_department_id', None)
+        writes_department = update_fields is None or not {'department', 'department_id'}.isdisjoint(update_fields)
+        self.moved_from_department_id = (stored if writes_department and stored not in (None, self.department_id)
+                                         else None)
+        super().save(*args, **kwargs)
+        if writes_department:
+            self._stored_department_id = self.department_id
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        material = super().from_db(db, field_names, values)
+        material._stored_department_id = material.__dict__.get('department_id')
+        return material
 
     def get_download_filename(self):
         """Generate download filename"""
@@ -130,6 +247,295 @@ class Material(models.Model):
         ordering = ['-upload_date']
         verbose_name = "Material"
         verbose_name_plural = "Materials"
+        indexes = [
+            # Serves code prefix searches (LIKE 'CSE4%') within a department; opclasses only apply on PostgreSQL
+            models.Index(fields=['department', 'code_key'], name='material_dept_code_key',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['department', 'modified', 'id'], name='material_dept_modified'),
+            models.Index(fields=['department', 'checksum'], name='material_dept_checksum'),
+        ]
         permissions = [
             ('download_material', 'Can download material'),
-        ]
\ No newline at end of file
+        ]
+
+class ArchivedMaterial(models.Model):
+    """
+    A material from a past session, moved out of the hot ``Material`` table
+    and its file into cold storage. It keeps the Material's id, so download
+    links keep working, and moving it back restores the same row.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=50)
+    code = models.CharField(max_length=10)
+    code_key = models.CharField(max_length=10, blank=True)
+    file = models.FileField(upload_to=material_upload_to, storage=cold_storage)
+    checksum = models.CharField(max_length=64, blank=True)
+    session = models.CharField(max_length=10)
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='archived_materials')
+    semester = models.ForeignKey(Semester, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    level = models.ForeignKey(Level, on_delete=models.CASCADE, related_name='+')
+    uploaded_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_materials'
+    )
+    # Copied from the Material, not set automatically
+    upload_date = models.DateTimeField()
+    modified = models.DateTimeField()
+    download_count = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def get_download_filename(self):
+        return f"{self.code}_{self.title}{os.path.splitext(self.file.name)[1]}"
+
+    def __str__(self):
+        return f"{self.code} ({self.title}, archived)"
+
+    class Meta:
+        ordering = ['-upload_date']
+        indexes = [
+            models.Index(fields=['department', 'session'], name='archived_dept_session'),
+            models.Index(fields=['department', 'code_key'], name='archived_dept_code_key',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ]
+
+class ArchiveImport(models.Model):
+    """A ZIP of materials being unpacked in the background, one Material per entry"""
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    archive = models.FileField(upload_to='archives/')
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='archive_imports')
+    uploaded_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archive_imports'
+    )
+    # Defaults for entries the archive's manifest does not describe
+    level = models.ForeignKey(Level, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    semester = models.ForeignKey(Semester, on_delete=models.SET_NULL, null=True, blank=True)
+    session = models.CharField(max_length=10)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{os.path.basename(self.archive.name)} ({self.status})"
+
+    class Meta:
+        ordering = ['-created']
+
+class Tombstone(models.Model):
+    """Marks a deleted catalog object so delta-syncing clients can drop it"""
+    MODELS = [
+        ('faculty', 'Faculty'),
+        ('department', 'Department'),
+        ('material', 'Material'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODELS)
+    object_id = models.PositiveIntegerField()
+    # Plain ids: the department may be gone too by the time a client syncs
+    department_id = models.PositiveIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'id'], name='tombstone_model_id'),
+            models.Index(fields=['model', 'department_id', 'id'], name='tombstone_model_dept_id'),
+        ]
+
+class DownloadEvent(models.Model):
+    """Append-only record of a single download, written in batches"""
+    # By id only: an archived material keeps its id and its history (see accounts.tiering).
+    # Deleting a material clears its history through accounts.downloads.forget_materials.
+    material = models.ForeignKey(Material, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 related_name='download_events')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='download_events'
+    )
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='download_events')
+    timestamp = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.material_id} @ {self.timestamp:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        ordering = ['-timestamp']
+
+
+class DownloadRollup(models.Model):
+    """Download totals per material for one hour or one day"""
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hourly'),
+        (DAY, 'Daily'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    # By id only, like DownloadEvent.material
+    material = models.ForeignKey(Material, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 related_name='download_rollups')
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='download_rollups')
+    level = models.ForeignKey(Level, on_delete=models.CASCADE, related_name='download_rollups')
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.material_id} {self.granularity} {self.bucket:%Y-%m-%d %H:%M}: {self.count}"
+
+    class Meta:
+        ordering = ['-bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket', 'material'], name='unique_download_rollup'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'department', 'bucket']),
+            models.Index(fields=['granularity', 'level', 'bucket']),
+        ]
+
+
+class DownloaderSketch(models.Model):
+    """HyperLogLog registers counting distinct downloaders of a material or department"""
+    # By id only, like DownloadEvent.material
+    material = models.OneToOneField(
+        Material,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name='downloader_sketch'
+    )
+    department = models.OneToOneField(
+        Department,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='downloader_sketch'
+    )
+    registers = models.BinaryField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sketch for {self.material_id or self.department_id}"
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(material__isnull=True) ^ Q(department__isnull=True),
+                name='downloader_sketch_single_owner',
+            ),
+        ]
+
+
+class MaterialPopularity(models.Model):
+    """
+    Time-decayed download score. ``log_score`` is log2 of the sum of
+    ``2 ** (hours since TRENDING_EPOCH / half-life)`` over all downloads, so
+    ordering by it ranks materials by their decayed score at any moment.
+    """
+    # By id only, like DownloadEvent.material
+    material = models.OneToOneField(
+        Material,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        primary_key=True,
+        related_name='popularity'
+    )
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='+')
+    level = models.ForeignKey(Level, on_delete=models.CASCADE, related_name='+')
+    log_score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.material_id}: {self.log_score:.2f}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['department', '-log_score']),
+            models.Index(fields=['department', 'level', '-log_score']),
+        ]
+
+
+class Digest(models.Model):
+    """One department's new-material email for a time window"""
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+    ]
+
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='digests')
+    # Materials uploaded in [window_start, window_end); the next window starts where this one ends
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    material_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    delivered = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # When the run now sending it last made progress; a claim this old belongs to a run that died
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.department} digest to {self.window_end:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        ordering = ['-window_end']
+        constraints = [
+            # Two runs that both read the same previous window cannot both start a new one from it
+            models.UniqueConstraint(fields=['department', 'window_start'], name='digest_department_window'),
+        ]
+
+class DigestDelivery(models.Model):
+    """A digest handed to the mail server for one student, so retries skip them"""
+    digest = models.ForeignKey(Digest, on_delete=models.CASCADE, related_name='deliveries')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    delivered_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['digest', 'user'], name='digest_delivery_once'),
+        ]
+
+class TokenBucket(models.Model):
+    """One admission client's download allowance, refilled with time"""
+    key = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    # Unix time of the last spend, so the refill is plain arithmetic in the UPDATE
+    updated = models.FloatField()
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f}"
+
+class StreamCounter(models.Model):
+    """Downloads in progress for one admission key (a client, or every client)"""
+    key = models.CharField(max_length=100, unique=True)
+    count = models.PositiveIntegerField(default=0)
+    # A worker killed mid-download never releases its slots; the count restarts after this
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key}: {self.count}"
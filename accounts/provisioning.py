@@ -0,0 +1,230 @@
+"""
+Bulk creation of student accounts from a department's class list.
+
+A class list is a CSV with an ``email`` column and optional ``username``,
+``first_name``, ``last_name`` and ``password`` columns. Every row is
+checked against existing accounts in a few set-based queries instead of
+two queries per student. Initial passwords are validated and hashed in a
+process pool, because the hasher is deliberately slow. The admin action
+hashes them inline instead, since forking from a web worker is unsafe, so
+it refuses lists with more than ``ADMIN_CLASS_LIST_MAX_PASSWORDS`` of
+them. Rows without a password get an unusable one, and their welcome
+email carries a link to choose a password instead. Accounts are inserted with ``bulk_create`` and
+welcome emails go out in batches over one connection, in the background.
+
+Rows whose email or username is already registered, in any letter case,
+are skipped, so running the same list again only adds the new students.
+"""
+import csv
+import io
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from . import tasks
+from .bulk_import import _setup_worker
+
+CLASS_LIST_FIELDS = ('email', 'username', 'first_name', 'last_name', 'password')
+USERNAME_PATTERN = re.compile(r'^[\w.@+-]+$')
+LOOKUP_CHUNK_SIZE = 450  # rows per lookup; two IN lists stay under SQLite's 999 parameters
+
+
+class ClassListError(Exception):
+    pass
+
+
+def read_class_list(stream, name='class list'):
+    """Rows of a CSV class list (binary stream) as dicts keyed by CLASS_LIST_FIELDS"""
+    try:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        rows = list(reader)
+    except (ValueError, csv.Error) as e:
+        raise ClassListError(f"Cannot read {name}: {e}")
+    if 'email' not in (reader.fieldnames or ()):
+        raise ClassListError(f"{name} needs an 'email' column.")
+    return [{field: (row.get(field) or '').strip() for field in CLASS_LIST_FIELDS} for row in rows]
+
+
+def prepare_password(password, attributes):
+    """``(hash, error)`` for one initial password; runs in a worker process"""
+    if not password:
+        return make_password(None), None
+    try:
+        validate_password(password, get_user_model()(**attributes))
+    except ValidationError as e:
+        return None, ' '.join(e.messages)
+    return make_password(password), None
+
+
+def _prepare_password(args):
+    return prepare_password(*args)
+
+
+class ProvisionReport:
+    def __init__(self):
+        self.created = []  # user ids
+        self.skipped = 0
+        self.errors = []  # (row number, message)
+        self.timings = {}
+
+
+class StudentProvisioner:
+    def __init__(self, department, workers=None, batch_size=1000, send_email=True, dry_run=False):
+        self.department = department
+        self.workers = workers
+        self.batch_size = batch_size
+        self.send_email = send_email
+        self.dry_run = dry_run
+
+    def run(self, rows):
+        report = ProvisionReport()
+        started = time.perf_counter()
+        candidates = self.validate(rows, report)
+        candidates = self.new_accounts(candidates, report)
+        report.timings['check'] = time.perf_counter() - started
+        if self.dry_run:
+            return report, candidates
+
+        started = time.perf_counter()
+        hashed = self.hash_passwords(candidates)
+        report.timings['hash'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        User = get_user_model()
+        users = []
+        for (number, row), (password, error) in zip(candidates, hashed):
+            if error:
+                report.errors.append((number, error))
+                continue
+            users.append(User(
+                email=row['email'], username=row['username'], first_name=row['first_name'],
+                last_name=row['last_name'], password=password,
+                department=self.department, faculty_id=self.department.faculty_id,
+            ))
+        with transaction.atomic():
+            for start in range(0, len(users), self.batch_size):
+                User.objects.bulk_create(users[start:start + self.batch_size])
+            report.created = [user.pk for user in users]
+            if None in report.created:
+                # Backends that cannot return ids from bulk inserts (MySQL) leave pk unset
+                report.created = self._ids_by_email([user.email for user in users])
+            if self.send_email and report.created:
+                queue_welcome_emails(report.created)
+        report.timings['insert'] = time.perf_counter() - started
+        return report, candidates
+
+    def _ids_by_email(self, emails):
+        User = get_user_model()
+        ids = []
+        for start in range(0, len(emails), LOOKUP_CHUNK_SIZE):
+            ids.extend(User.objects.filter(email__in=emails[start:start + LOOKUP_CHUNK_SIZE])
+                       .values_list('pk', flat=True))
+        return ids
+
+    def validate(self, rows, report):
+        """``[(row number, row)]`` with normalized emails and usernames, duplicates within the list removed"""
+        User = get_user_model()
+        username_length = User._meta.get_field('username').max_length
+        seen_emails, seen_usernames = set(), set()
+        candidates = []
+        for number, row in enumerate(rows, start=1):
+            row = dict(row, email=User.objects.normalize_email(row['email']))
+            # Without a username the email doubles as one; it is unique by construction
+            row['username'] = row['username'] or row['email']
+            try:
+                validate_email(row['email'])
+            except ValidationError:
+                report.errors.append((number, f"Invalid email '{row['email']}'."))
+                continue
+            if not USERNAME_PATTERN.match(row['username']) or len(row['username']) > username_length:
+                report.errors.append((number, f"Invalid username '{row['username']}'."))
+                continue
+            email_key, username_key = row['email'].casefold(), row['username'].casefold()
+            if email_key in seen_emails or username_key in seen_usernames:
+                report.errors.append((number, f"{row['email']} appears more than once in the list."))
+                continue
+            seen_emails.add(email_key)
+            seen_usernames.add(username_key)
+            candidates.append((number, row))
+        return candidates
+
+    def new_accounts(self, candidates, report):
+        """Drop rows whose email or username is already registered, ignoring case"""
+        User = get_user_model()
+        taken_emails, taken_usernames = set(), set()
+        # Compared lower-cased on both sides; the Lower('email') and Lower('username') indexes serve the lookup
+        accounts = User.objects.annotate(email_key=Lower('email'), username_key=Lower('username'))
+        for start in range(0, len(candidates), LOOKUP_CHUNK_SIZE):
+            chunk = [row for _, row in candidates[start:start + LOOKUP_CHUNK_SIZE]]
+            for email, username in accounts.filter(
+                Q(email_key__in=[row['email'].lower() for row in chunk])
+                | Q(username_key__in=[row['username'].lower() for row in chunk])
+            ).values_list('email_key', 'username_key'):
+                taken_emails.add(email)
+                taken_usernames.add(username)
+        new = []
+        for number, row in candidates:
+            if row['email'].lower() in taken_emails or row['username'].lower() in taken_usernames:
+                report.skipped += 1
+            else:
+                new.append((number, row))
+        return new
+
+    def hash_passwords(self, candidates):
+        jobs = [
+            (row['password'], {key: row[key] for key in ('email', 'username', 'first_name', 'last_name')})
+            for _, row in candidates
+        ]
+        if self.workers == 0 or not any(password for password, _ in jobs):
+            return [prepare_password(*job) for job in jobs]
+        with ProcessPoolExecutor(self.workers, initializer=_setup_worker) as executor:
+            return list(executor.map(_prepare_password, jobs, chunksize=8))
+
+
+def welcome_message(user, connection=None):
+    context = {
+        'user': user,
+        'login_url': settings.BASE_URL + reverse('login'),
+        'set_password_url': '' if user.has_usable_password() else settings.BASE_URL + reverse(
+            'password_reset_confirm',
+            args=[urlsafe_base64_encode(force_bytes(user.pk)), default_token_generator.make_token(user)],
+        ),
+    }
+    message = EmailMultiAlternatives(
+        'Welcome to study hub', render_to_string('emails/welcome.txt', context),
+        settings.DEFAULT_FROM_EMAIL, [user.email], connection=connection,
+    )
+    message.attach_alternative(render_to_string('emails/welcome.html', context), 'text/html')
+    return message
+
+
+def send_welcome_emails(user_ids):
+    """Send welcome emails in batches over one connection; returns the number sent"""
+    User = get_user_model()
+    sent = 0
+    batch_size = settings.EMAIL_BATCH_SIZE
+    with get_connection() as connection:
+        for start in range(0, len(user_ids), batch_size):
+            users = User.objects.filter(pk__in=user_ids[start:start + batch_size])
+            sent += connection.send_messages([welcome_message(user, connection) for user in users]) or 0
+    return sent
+
+
+def queue_welcome_emails(user_ids):
+    tasks.defer('mail', settings.MAIL_WORKERS, send_welcome_emails, list(user_ids))
@@ -0,0 +1,88 @@
+"""
+Progressive web app support: the web manifest and the service worker.
+
+The service worker's caches are named after ``static_version()``, a hash
+of the static files manifest. Deploying new static files therefore
+installs a new worker, which drops the old static and page caches.
+Materials a student saved for offline use are kept in a separate,
+unversioned cache that survives upgrades.
+"""
+import hashlib
+import json
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.templatetags.static import static
+from django.urls import reverse
+
+# Pages the service worker may keep for offline reading
+OFFLINE_PAGE_HEADER = 'X-Offline-Page'
+
+
+def _static_version():
+    manifest_hash = getattr(staticfiles_storage, 'manifest_hash', '')
+    if manifest_hash:
+        return manifest_hash[:12]
+    # No collected manifest (development): hash what the finders would serve
+    digest = hashlib.md5()
+    for finder in finders.get_finders():
+        for path, storage in sorted(finder.list([]), key=lambda item: item[0]):
+            digest.update(f'{path}:{storage.size(path)}:{storage.get_modified_time(path).timestamp()}'.encode())
+    return digest.hexdigest()[:12]
+
+
+_cached_static_version = lru_cache(maxsize=1)(_static_version)
+
+
+def static_version():
+    """Short hash that changes whenever the deployed static files do"""
+    return _static_version() if settings.DEBUG else _cached_static_version()
+
+
+def precache_urls():
+    return [static(path) for path in settings.PWA_PRECACHE] + [reverse('web_manifest')]
+
+
+def offline_page(response):
+    """Let the service worker cache this page for offline reading"""
+    response[OFFLINE_PAGE_HEADER] = '1'
+    return response
+
+
+def web_manifest(request):
+    response = JsonResponse({
+        'name': 'FUD study-hub',
+        'short_name': 'Study Hub',
+        'start_url': reverse('department_list'),
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': '#ffffff',
+        'theme_color': '#1a2a6c',
+        'icons': [
+            {'src': static('images/logo.png'), 'sizes': '1021x1021', 'type': 'image/png', 'purpose': 'any'},
+        ],
+    }, content_type='application/manifest+json')
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+def service_worker(request):
+    response = render(request, 'sw.js', {
+        'version': static_version(),
+        'config': json.dumps({
+            'precache': precache_urls(),
+            'staticUrl': static(''),
+            'catalogUrl': reverse('catalog', args=['materials']).rsplit('materials/', 1)[0],
+            'downloadUrl': reverse('track_download', args=[0]).rsplit('0/', 1)[0],
+            'logoutUrl': reverse('logout'),
+            'offlineHeader': OFFLINE_PAGE_HEADER,
+            'maxPages': settings.PWA_MAX_CACHED_PAGES,
+        }),
+    }, content_type='application/javascript')
+    # Browsers must see a new version promptly; the script itself is tiny
+    response['Cache-Control'] = 'no-cache'
+    return response
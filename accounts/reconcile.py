@@ -0,0 +1,160 @@
+"""
+Storage reconciliation: files nobody references, and references to files
+that are gone.
+
+Deleted materials and failed uploads leave files behind. To find them,
+the referenced names and the stored files are both produced as sorted
+streams and compared with a merge join, so memory stays constant however
+many files there are:
+
+- The referenced names come from a chunked, ordered database iterator.
+  It uses a binary collation, so the database sorts the way Python does.
+- The stored names come from a depth-first ``os.scandir`` walk. Only one
+  directory is sorted at a time, which the sharded layout keeps small.
+
+Files younger than ``RECONCILE_GRACE_HOURS`` are never orphans. An
+upload, import or layout migration may have stored such a file without
+committing its row yet. Age is measured from the inode's last change
+(``st_ctime``) as well as the content's (``st_mtime``): the layout
+migration's ``os.link`` and ``shutil.copy2`` keep the old mtime on a
+name that is minutes old.
+"""
+import heapq
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models.functions import Collate
+
+from .models import ArchivedMaterial, ArchiveImport, Material
+from .storage import cold_storage
+
+BINARY_COLLATIONS = {'sqlite': 'BINARY', 'postgresql': 'C', 'mysql': 'utf8mb4_bin'}
+
+
+def scopes():
+    """``(storage, directory, [(model, field)])``: what may live where"""
+    return [
+        (default_storage, 'materials', [(Material, 'file')]),
+        (default_storage, 'archives', [(ArchiveImport, 'archive')]),
+        (cold_storage, 'materials', [(ArchivedMaterial, 'file')]),
+    ]
+
+
+def _sorted_names(model, field, directory, chunk_size):
+    column = field
+    collation = BINARY_COLLATIONS.get(connection.vendor)
+    if collation:
+        column = Collate(field, collation)
+    return (model.objects.filter(**{f'{field}__startswith': f'{directory}/'})
+            .order_by(column).values_list(field, flat=True).iterator(chunk_size=chunk_size))
+
+
+def referenced_names(sources, directory, chunk_size=2000):
+    """Distinct stored names referenced by ``sources``, in code-point order"""
+    last = None
+    for name in heapq.merge(*[_sorted_names(model, field, directory, chunk_size) for model, field in sources]):
+        if name != last:
+            yield name
+            last = name
+
+
+def stored_files(storage, directory):
+    """``(name, DirEntry)`` for every file under ``directory``, in code-point order of ``name``"""
+    root = storage.path('')
+
+    def walk(path):
+        try:
+            with os.scandir(path) as listing:
+                # A directory sorts as "name/" so it lands where its files' full names do
+                entries = sorted(listing, key=lambda entry: entry.name + '/' if entry.is_dir() else entry.name)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield os.path.relpath(entry.path, root).replace(os.sep, '/'), entry
+
+    yield from walk(os.path.join(root, directory))
+
+
+def merge_join(referenced, stored):
+    """Yield ``('orphan', name, entry)`` and ``('missing', name, None)`` from two sorted streams"""
+    missing = object()
+    ref = next(referenced, missing)
+    for name, entry in stored:
+        while ref is not missing and ref < name:
+            yield 'missing', ref, None
+            ref = next(referenced, missing)
+        if ref is not missing and ref == name:
+            ref = next(referenced, missing)
+        else:
+            yield 'orphan', name, entry
+    while ref is not missing:
+        yield 'missing', ref, None
+        ref = next(referenced, missing)
+
+
+def last_changed(stat):
+    """When a file's content, or the names pointing at it, last changed"""
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+class ReconcileReport:
+    def __init__(self):
+        self.checked = 0
+        self.orphans = 0
+        self.orphan_bytes = 0
+        self.deleted = 0
+        self.recent = 0  # unreferenced but inside the grace period
+        self.missing = 0
+
+
+class Reconciler:
+    def __init__(self, delete=False, rate=None, grace=None, chunk_size=2000, sleep=time.sleep, now=None):
+        self.delete = delete
+        self.rate = rate  # deletions per second, None for no limit
+        grace = timedelta(hours=settings.RECONCILE_GRACE_HOURS) if grace is None else grace
+        self.cutoff = ((now or datetime.now(timezone.utc)) - grace).timestamp()
+        self.chunk_size = chunk_size
+        self.sleep = sleep
+        self._next_delete = 0
+
+    def run(self, on_result=None):
+        report = ReconcileReport()
+        for storage, directory, sources in scopes():
+            referenced = referenced_names(sources, directory, self.chunk_size)
+            for kind, name, entry in merge_join(referenced, self._counted(stored_files(storage, directory), report)):
+                if kind == 'missing':
+                    report.missing += 1
+                elif last_changed(entry.stat()) > self.cutoff:
+                    report.recent += 1
+                    continue
+                else:
+                    report.orphans += 1
+                    report.orphan_bytes += entry.stat().st_size
+                    if self.delete:
+                        self._throttle()
+                        storage.delete(name)
+                        report.deleted += 1
+                if on_result:
+                    on_result(kind, storage, name)
+        return report
+
+    def _counted(self, stored, report):
+        for item in stored:
+            report.checked += 1
+            yield item
+
+    def _throttle(self):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        if now < self._next_delete:
+            self.sleep(self._next_delete - now)
+            now = self._next_delete
+        self._next_delete = now + 1 / self.rate
@@ -0,0 +1,76 @@
+"""
+Synthetic catalog data for benchmarks and load tests.
+
+Rows are inserted with ``bulk_create`` and users get an unusable password,
+so seeding hundreds of thousands of rows takes seconds rather than hours.
+"""
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from .models import Faculty, Department, Category, Level, Semester, Material, normalize_code
+
+
+def seed_catalog(materials=1000, users=100, departments=10, batch_size=5000, seed=0):
+    """Create a reproducible catalog and return a dict of the created lookups"""
+    rng = random.Random(seed)
+    User = get_user_model()
+
+    faculty, _ = Faculty.objects.get_or_create(code='BENCH', defaults={'name': 'Benchmark Faculty'})
+    depts = [
+        Department.objects.get_or_create(
+            code=f'BD{i}', defaults={'name': f'Bench Department {i}', 'faculty': faculty}
+        )[0]
+        for i in range(departments)
+    ]
+    levels = [Level.objects.get_or_create(name=f'{n}L')[0] for n in (100, 200, 300, 400)]
+    semesters = [Semester.objects.get_or_create(name=name)[0]
+                 for name in ('First Semester', 'Second Semester')]
+    categories = [Category.objects.get_or_create(name=name)[0]
+                  for name in ('Lecture Notes', 'Past Questions', 'Handouts')]
+
+    password = make_password(None)
+    start = User.objects.count()
+    User.objects.bulk_create(
+        (User(
+            email=f'bench{start + i}@example.com',
+            username=f'bench{start + i}',
+            password=password,
+            is_uploader=(i % 20 == 0),
+            department=rng.choice(depts),
+            faculty=faculty,
+        ) for i in range(users)),
+        batch_size=batch_size,
+    )
+    uploaders = list(User.objects.filter(is_uploader=True).values_list('id', 'department_id'))
+
+    Material.objects.bulk_create(
+        (_bench_material(rng, i, depts, levels, semesters, categories, uploaders)
+         for i in range(materials)),
+        batch_size=batch_size,
+    )
+    return {
+        'faculty': faculty,
+        'departments': depts,
+        'levels': levels,
+        'semesters': semesters,
+        'categories': categories,
+    }
+
+
+def _bench_material(rng, i, depts, levels, semesters, categories, uploaders):
+    uploader_id, department_id = rng.choice(uploaders)
+    code = f'{rng.choice(("CSC", "CSE", "MTH", "PHY"))}{rng.randint(100, 499)}'
+    return Material(
+        title=f'{code} Lecture {i % 12 + 1}',
+        code=code,
+        code_key=normalize_code(code),
+        file=f'materials/bench_{i}.pdf',
+        session=f'{2020 + i % 5}/{2021 + i % 5}',
+        department_id=department_id or rng.choice(depts).id,
+        level=rng.choice(levels),
+        semester=rng.choice(semesters),
+        category=rng.choice(categories),
+        uploaded_by_id=uploader_id,
+    )
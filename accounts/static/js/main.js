@@ -73,3 +73,53 @@ function autoDismissAlerts() {
         }, 5000); // 5 seconds
     });
 }
+
+// Suggest course codes, titles and departments for search boxes with data-autocomplete
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-autocomplete]').forEach(input => {
+        const list = document.createElement('datalist');
+        list.id = input.name + 'Suggestions';
+        input.setAttribute('list', list.id);
+        input.setAttribute('autocomplete', 'off');
+        input.after(list);
+
+        let timer = null;
+        let controller = null;
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (!query) {
+                list.innerHTML = '';
+                return;
+            }
+            timer = setTimeout(() => {
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+                fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(query), {signal: controller.signal})
+                    .then(response => response.json())
+                    .then(data => {
+                        list.innerHTML = '';
+                        data.suggestions.forEach(suggestion => {
+                            const option = document.createElement('option');
+                            option.value = suggestion.value;
+                            if (suggestion.code) {
+                                option.label = suggestion.code;
+                            }
+                            list.appendChild(option);
+                        });
+                    })
+                    .catch(() => {});
+            }, 120);
+        });
+    });
+});
+
+// Install the offline service worker (see accounts/pwa.py)
+if ('serviceWorker' in navigator && document.currentScript && document.currentScript.dataset.serviceWorker) {
+    const workerUrl = document.currentScript.dataset.serviceWorker;
+    window.addEventListener('load', function() {
+        navigator.serviceWorker.register(workerUrl).catch(() => {});
+    });
+}
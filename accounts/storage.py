@@ -0,0 +1,100 @@
+"""
+Storage backends.
+
+``PrecompressedManifestStaticFilesStorage``: ``collectstatic`` writes every
+static file under a name that includes a hash of its content, so the files
+can be cached forever. A ``.gz`` copy of each compressible file is written
+next to it, so ``serve_static`` never has to compress on the fly.
+
+``MediaStorage``: uploads. When a sharded material name is taken, the
+alternative name is sharded on its own file name, so a stored name is
+always where ``sharded_name`` puts it.
+
+``ColdStorage``: files of archived materials, kept under
+``COLD_MEDIA_ROOT`` (which can sit on cheaper, slower disks) and only ever
+served through the download view.
+"""
+import gzip
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import cached_property
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.map', '.ico'}
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Files smaller than this gain little and cost a second stat per request
+    min_compress_size = 256
+
+    def stored_name(self, name):
+        # Before collectstatic has run (development, tests) there is nothing to map to
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = {*self.hashed_files, *self.hashed_files.values(), self.manifest_name}
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        """Write ``name + '.gz'`` when it is meaningfully smaller than the original"""
+        with self.open(name) as original:
+            content = original.read()
+        if len(content) < self.min_compress_size:
+            return
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) >= len(content) * 0.95:
+            return
+        gz_name = name + '.gz'
+        if self.exists(gz_name):
+            self.delete(gz_name)
+        self._save(gz_name, ContentFile(compressed))
+
+
+class MediaStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Imported here: models imports this module for cold_storage
+        from .models import sharded_name
+
+        if sharded_name(name) != name:
+            return super().get_available_name(name, max_length)
+        root, ext = os.path.splitext(os.path.basename(name))
+        while self.exists(name) or (max_length and len(name) > max_length):
+            # ``notes_x7Yq2Za.pdf`` lands in its own shard, not next to ``notes.pdf``
+            name = sharded_name(self.get_alternative_name(root, ext))
+            if max_length and len(name) > max_length:
+                root = root[:max_length - len(name)]
+                if not root:
+                    raise SuspiciousFileOperation(
+                        f'Storage can not find an available filename for "{name}". Please make sure that the '
+                        'corresponding file field allows sufficient "max_length".'
+                    )
+                name = sharded_name(self.get_alternative_name(root, ext))
+        return name
+
+
+class ColdStorage(MediaStorage):
+    """``MediaStorage`` rooted at ``COLD_MEDIA_ROOT`` instead of ``MEDIA_ROOT``"""
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'COLD_MEDIA_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.COLD_MEDIA_ROOT)
+
+
+cold_storage = ColdStorage()
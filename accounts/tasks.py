@@ -0,0 +1,43 @@
+"""
+Small in-process background pools for work that should not hold up a
+request: unpacking uploaded archives, sending batches of email.
+
+The project has no task queue, so work is handed to a named thread pool
+once the surrounding transaction commits. A pool configured with zero
+workers runs the work inline instead, which is what the tests use.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def defer(pool, workers, func, *args):
+    """Run ``func(*args)`` on the named pool after the current transaction commits"""
+    transaction.on_commit(lambda: run(pool, workers, func, *args))
+
+
+def run(pool, workers, func, *args):
+    if workers == 0:
+        return func(*args)
+    with _lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = _executors[pool] = ThreadPoolExecutor(workers, thread_name_prefix=pool)
+    executor.submit(_call, func, args)
+
+
+def _call(func, args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Background task %s failed", func.__qualname__)
+    finally:
+        close_old_connections()
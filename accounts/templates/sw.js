@@ -0,0 +1,96 @@
+// Study Hub service worker, static version {{ version }}
+const VERSION = '{{ version }}';
+const CONFIG = {{ config|safe }};
+const STATIC_CACHE = 'studyhub-static-' + VERSION;
+const PAGES_CACHE = 'studyhub-pages-' + VERSION;
+const OFFLINE_CACHE = 'studyhub-offline-materials';
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(STATIC_CACHE)
+            .then(cache => cache.addAll(CONFIG.precache))
+            .then(() => self.skipWaiting())
+    );
+});
+
+// Drop caches from older static versions; saved materials are kept
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names
+                .filter(name => name.startsWith('studyhub-'))
+                .filter(name => ![STATIC_CACHE, PAGES_CACHE, OFFLINE_CACHE].includes(name))
+                .map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Keep the page cache bounded; keys come back oldest first
+function trim(cache) {
+    return cache.keys().then(keys => Promise.all(
+        keys.slice(0, Math.max(keys.length - CONFIG.maxPages, 0)).map(key => cache.delete(key))
+    ));
+}
+
+// Answer from cache at once and refresh the copy in the background
+function staleWhileRevalidate(event, cacheName, cacheable) {
+    return caches.open(cacheName).then(cache => cache.match(event.request).then(cached => {
+        const network = fetch(event.request).then(response => {
+            if (response.ok && cacheable(response)) {
+                cache.put(event.request, response.clone()).then(() => cacheName === PAGES_CACHE && trim(cache));
+            }
+            return response;
+        });
+        if (cached) {
+            event.waitUntil(network.catch(() => null));
+            return cached;
+        }
+        return network.catch(() => offlineResponse(event.request));
+    }));
+}
+
+function offlineResponse(request) {
+    if (request.mode !== 'navigate') {
+        return Response.error();
+    }
+    return new Response(
+        '<!DOCTYPE html><meta name="viewport" content="width=device-width, initial-scale=1">' +
+        '<title>Offline | FUD study-hub</title><h1>You are offline</h1>' +
+        '<p>This page has not been saved yet. Materials you saved for offline use are still available.</p>',
+        {headers: {'Content-Type': 'text/html; charset=utf-8'}}
+    );
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (url.pathname === CONFIG.logoutUrl) {
+        // Cached pages belong to the signed-in student
+        event.waitUntil(caches.delete(PAGES_CACHE));
+        return;
+    }
+
+    if (url.pathname.startsWith(CONFIG.downloadUrl)) {
+        // Saved materials never touch the network again
+        event.respondWith(
+            caches.open(OFFLINE_CACHE)
+                .then(cache => cache.match(request))
+                .then(saved => saved || fetch(request))
+        );
+        return;
+    }
+
+    if (url.pathname.startsWith(CONFIG.staticUrl)) {
+        event.respondWith(staleWhileRevalidate(event, STATIC_CACHE, () => true));
+    } else if (url.pathname.startsWith(CONFIG.catalogUrl)) {
+        event.respondWith(staleWhileRevalidate(event, PAGES_CACHE, () => true));
+    } else if (request.mode === 'navigate') {
+        event.respondWith(staleWhileRevalidate(
+            event, PAGES_CACHE, response => response.headers.get(CONFIG.offlineHeader) === '1'
+        ));
+    }
+});
@@ -1,24 +1,70 @@
-from django.test import TestCase, Client, RequestFactory
+from django.test import TestCase, Client, RequestFactory, AsyncRequestFactory, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
-from .models import Faculty, Department, Category, Level, Semester, Material
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage import default_storage
+from django.core.cache import cache
+from django.http import FileResponse, Http404, QueryDict
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.templatetags.static import static
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.conf import settings
+from django.core import mail
+from .admin import EstimatedCountPaginator, estimated_row_count
+from .admission import AdmissionController, Rejected, release_after
+from .caching import TwoTierCache, layered
+from . import api, archives, async_views, autocomplete, bulk_edit, bulk_import, bulk_signals, downloads, exports, facets, digests, live, media_layout, provisioning, pwa, reconcile, tiering, trending, warmup
+from .facets import search_filter
+from .models import ArchiveImport, ArchivedMaterial, Digest, DigestDelivery, Faculty, Tombstone, Department, Category, Level, Semester, Material
+from .models import DownloadEvent, DownloadRollup, DownloaderSketch, MaterialPopularity, StreamCounter, TokenBucket, normalize_code, sharded_name
+from .hll import HyperLogLog
+from .hotfiles import HotFileCache, MappedFile, hot_files, hot_static_files
+from .views import accepts_gzip, serve_media
+from .seeding import seed_catalog
+import csv
+import gzip
+import hashlib
+import io
+import json
+import shutil
+import smtplib
 import tempfile
 import os
+import re
+import socketserver
+import threading
+import time
+import zipfile
+import asyncio
+import math
+from asgiref.sync import sync_to_async
+from unittest import mock
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from wsgiref.util import FileWrapper
 
 User = get_user_model()
 
+
+def stored_files(root, directory):
+    """Files under ``root/directory`` at any depth (uploads are sharded into subdirectories)"""
+    return [name for _, _, names in os.walk(os.path.join(root, directory)) for name in names]
+
 class BaseTestCase(TestCase):
     def setUp(self):
         # Create test data
         self.factory = RequestFactory()
         self.client = Client()
+        layered.clear_local()
         
         self.faculty = Faculty.objects.create(name="Science", code="SCI")
         self.department = Department.objects.create(
             name="Computer Science", code="CSC", faculty=self.faculty
         )
-        self.category = Category.objects.create(name="Lecture Notes", department=self.department)
+        self.category = Category.objects.create(name="Lecture Notes")
         self.level = Level.objects.create(name="100L")
         self.semester = Semester.objects.create(name="First Semester")
         
@@ -201,3 +247,2269 @@ def test_empty_file_upload(self):
     def test_nonexistent_download(self):
         response = self.client.get(reverse('track_download', args=[999]))
         self.assertEqual(response.status_code, 404)
+
+class MaterialAccessQuerySetTests(TestCase):
+    def setUp(self):
+        rng = random.Random(2024)
+        faculty = Faculty.objects.create(name="Engineering", code="ENG")
+        self.departments = [
+            Department.objects.create(name=f"Dept {i}", code=f"D{i}", faculty=faculty)
+            for i in range(3)
+        ]
+        level = Level.objects.create(name="200L")
+
+        # Users are created without passwords to keep the test fast
+        self.users = [AnonymousUser()]
+        for i in range(12):
+            self.users.append(User.objects.create(
+                email=f"user{i}@test.com",
+                username=f"user{i}",
+                is_superuser=(i == 0),
+                is_uploader=rng.random() < 0.5,
+                department=rng.choice(self.departments + [None]),
+            ))
+        uploaders = self.users[1:]
+
+        for i in range(60):
+            Material.objects.create(
+                title=f"Material {i}",
+                code=f"RND{i}",
+                file=f"materials/rnd{i}.pdf",
+                session="2023/2024",
+                department=rng.choice(self.departments),
+                level=level,
+                uploaded_by=rng.choice(uploaders),
+            )
+
+    def test_accessible_to_matches_is_accessible_to(self):
+        materials = list(Material.objects.all())
+        for user in self.users:
+            expected = {m.pk for m in materials if m.is_accessible_to(user)}
+            actual = set(Material.objects.accessible_to(user).values_list('pk', flat=True))
+            self.assertEqual(actual, expected, msg=str(user))
+
+    def test_editable_by_matches_is_editable_by(self):
+        materials = list(Material.objects.all())
+        for user in self.users:
+            expected = {m.pk for m in materials if m.is_editable_by(user)}
+            actual = set(Material.objects.editable_by(user).values_list('pk', flat=True))
+            self.assertEqual(actual, expected, msg=str(user))
+
+    def test_accessible_to_is_a_single_query(self):
+        user = User.objects.filter(is_uploader=True).first()
+        with self.assertNumQueries(1):
+            list(Material.objects.accessible_to(user))
+
+    def test_listing_shows_the_whole_department_to_students(self):
+        student = User.objects.filter(is_uploader=False, is_superuser=False).first()
+        department = self.departments[0]
+        self.client.force_login(student)
+        response = self.client.get(reverse('material_list', args=[department.slug]))
+        listed = {m.pk for m in response.context['materials']}
+        self.assertEqual(listed, set(Material.objects.filter(department=department).values_list('pk', flat=True)))
+        self.assertFalse(listed <= set(Material.objects.accessible_to(student).values_list('pk', flat=True)))
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        seed_catalog(materials=60, users=20, departments=3)
+        self.admin_user = User.objects.create(
+            email="admin@test.com", username="admin", is_staff=True, is_superuser=True
+        )
+        self.client.force_login(self.admin_user)
+
+    def test_material_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:accounts_material_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        seed_catalog(materials=60, users=0, departments=3, seed=1)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(small), len(large))
+
+    def test_search_matches_department_name(self):
+        department = Department.objects.get(code='BD1')
+        response = self.client.get(
+            reverse('admin:accounts_material_changelist'), {'q': department.name}
+        )
+        expected = Material.objects.filter(department=department).count()
+        self.assertEqual(response.context['cl'].result_count, expected)
+
+    def test_material_search_uses_code_prefix_only(self):
+        material = Material.objects.first()
+        url = reverse('admin:accounts_material_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'q': material.code_key[:4].lower()})
+        expected = Material.objects.filter(code_key__startswith=material.code_key[:4]).count()
+        self.assertEqual(response.context['cl'].result_count, expected)
+        searches = [q['sql'] for q in queries if '"code_key" LIKE' in q['sql']]
+        self.assertTrue(searches)
+        self.assertFalse(any('UPPER(' in sql or '"title"' in sql.split('WHERE', 1)[1] for sql in searches))
+
+        response = self.client.get(url, {'q': f'contains:{material.title[2:8]}'})
+        self.assertTrue(response.context['cl'].queryset.filter(pk=material.pk).exists())
+
+    def test_user_search_is_case_insensitive_prefix(self):
+        User.objects.create(email="Ada.Lovelace@Analytical.Engine", username="ALovelace")
+        url = reverse('admin:accounts_customuser_changelist')
+        for term in ('ada.love', 'ADA', 'alove'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'q': term})
+            emails = [u.email for u in response.context['cl'].result_list]
+            self.assertEqual(emails, ["Ada.Lovelace@Analytical.Engine"], msg=term)
+            self.assertTrue(any('LOWER("accounts_customuser"."email") LIKE' in q['sql'] for q in queries))
+        self.assertEqual(self.client.get(url, {'q': 'lovelace'}).context['cl'].result_count, 0)
+        response = self.client.get(url, {'q': 'contains:analytical.engine'})
+        self.assertEqual([u.email for u in response.context['cl'].result_list], ["Ada.Lovelace@Analytical.Engine"])
+
+    def test_paginator_uses_estimate_for_large_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        estimate = estimated_row_count(Material)
+        self.assertEqual(estimate, Material.objects.count())
+        with self.settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10):
+            Material.objects.filter(pk=Material.objects.first().pk).delete()
+            paginator = EstimatedCountPaginator(Material.objects.all(), 100)
+            self.assertEqual(paginator.count, estimate)
+            filtered = EstimatedCountPaginator(Material.objects.filter(code__startswith='CSC'), 100)
+            self.assertEqual(filtered.count, Material.objects.filter(code__startswith='CSC').count())
+
+class DownloadEventTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        downloads.discard_pending()
+        self.now = datetime(2025, 3, 10, 14, 30, tzinfo=dt_timezone.utc)
+
+    def test_flush_writes_events_and_rollups(self):
+        for minutes in (0, 5, 65):
+            downloads.record_download(self.material, self.student, self.now + timedelta(minutes=minutes))
+        self.assertEqual(DownloadEvent.objects.count(), 0)
+
+        self.assertEqual(downloads.flush(), 3)
+        self.assertEqual(DownloadEvent.objects.filter(department=self.department).count(), 3)
+        hourly = DownloadRollup.objects.filter(granularity=DownloadRollup.HOUR).order_by('bucket')
+        self.assertEqual([r.count for r in hourly], [2, 1])
+        daily = DownloadRollup.objects.get(granularity=DownloadRollup.DAY)
+        self.assertEqual((daily.count, daily.level, daily.department), (3, self.level, self.department))
+
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+        daily.refresh_from_db()
+        self.assertEqual(daily.count, 4)
+
+    def test_events_for_deleted_materials_are_skipped(self):
+        downloads.record_download(self.material, self.student, self.now)
+        Material.objects.filter(pk=self.material.pk).delete()
+        self.assertEqual(downloads.flush(), 0)
+        self.assertFalse(DownloadEvent.objects.exists())
+
+    def test_missing_file_is_logged_and_not_counted(self):
+        os.remove(self.material.file.path)
+        self.client.force_login(self.student)
+        with self.assertLogs('accounts.views', 'ERROR'):
+            response = self.client.get(reverse('track_download', args=[self.material.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.material.refresh_from_db()
+        self.assertEqual((self.material.download_count, downloads.pending_count()), (0, 0))
+
+    @override_settings(DOWNLOAD_EVENT_BATCH_SIZE=1)
+    def test_download_flushes_after_the_request(self):
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('track_download', args=[self.material.pk]))
+        response.close()
+        self.assertEqual(downloads.pending_count(), 0)
+        self.assertEqual(DownloadEvent.objects.get().user, self.student)
+
+    def test_rollup_queries_do_not_grow_with_buckets(self):
+        def rollup_queries(hours):
+            events = [(self.material.pk, self.department.id, self.level.id, None, self.now + timedelta(hours=h))
+                      for h in hours]
+            with CaptureQueriesContext(connection) as queries:
+                downloads.apply_rollups(events)
+            return len(queries)
+
+        self.assertEqual(rollup_queries([0]), rollup_queries(range(1, 80)))
+        rollup_queries([0, 0, 1])
+        hourly = DownloadRollup.objects.filter(granularity=DownloadRollup.HOUR)
+        self.assertEqual(hourly.get(bucket=self.now.replace(minute=0)).count, 3)
+        self.assertEqual(hourly.count(), 80)
+        self.assertEqual(sum(r.count for r in DownloadRollup.objects.filter(granularity=DownloadRollup.DAY)), 83)
+
+    def test_flush_errors_after_a_request_are_logged(self):
+        downloads.record_download(self.material, self.student)
+        with mock.patch.object(downloads, 'flush', side_effect=DatabaseError("gone")), \
+                override_settings(DOWNLOAD_EVENT_BATCH_SIZE=1), self.assertLogs('accounts.downloads', 'ERROR'):
+            self.client.force_login(self.student)
+            self.client.get(reverse('department_list')).close()
+
+    @override_settings(DOWNLOAD_EVENT_FLUSH_INTERVAL=0.01)
+    def test_timer_flushes_an_idle_buffer(self):
+        flushed = threading.Event()
+        with mock.patch.object(downloads, 'flush', side_effect=lambda: flushed.set()):
+            downloads.record_download(self.material, self.student)
+            self.assertTrue(flushed.wait(5))
+        downloads.discard_pending()
+
+    def test_trend_is_zero_filled_from_rollups(self):
+        downloads.record_download(self.material, self.student, self.now - timedelta(days=2))
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+        trend = downloads.download_trend(periods=4, now=self.now, department=self.department)
+        self.assertEqual([total for _, total in trend], [0, 1, 0, 1])
+        self.assertEqual(trend[-1][0], datetime(2025, 3, 10, tzinfo=dt_timezone.utc))
+
+    def test_compaction_keeps_daily_rollups(self):
+        downloads.record_download(self.material, self.student, self.now - timedelta(days=100))
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+        self.assertEqual(downloads.compact_events(self.now - timedelta(days=30), chunk_size=1), 1)
+        self.assertEqual(downloads.compact_hourly_rollups(self.now - timedelta(days=90)), 1)
+        self.assertEqual(DownloadEvent.objects.count(), 1)
+        self.assertEqual(DownloadRollup.objects.filter(granularity=DownloadRollup.DAY).count(), 2)
+
+    def test_dashboard_and_admin_render_trends(self):
+        downloads.record_download(self.material, self.student)
+        downloads.flush()
+        self.client.force_login(self.uploader)
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['trend'][-1]['total'], 1)
+
+        admin_user = User.objects.create(email="root@test.com", username="root",
+                                         is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:accounts_downloadrollup_changelist'))
+        self.assertEqual(len(response.context['trend']), 30)
+
+class HyperLogLogTests(TestCase):
+    def test_estimates_within_error_bound(self):
+        sketch = HyperLogLog()
+        stderr = 1.04 / math.sqrt(sketch.size)
+        seen = 0
+        for exact in (50, 1000, 10000, 50000):
+            sketch.update(range(seen, exact))
+            # Re-adding known users must not move the estimate
+            sketch.update(range(0, exact, 7))
+            seen = exact
+            self.assertLessEqual(abs(sketch.count() - exact) / exact, 4 * stderr, msg=exact)
+
+    def test_merge_equals_sketch_of_union(self):
+        a, b, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        a.update(range(0, 6000))
+        b.update(range(4000, 9000))
+        both.update(range(0, 9000))
+        merged = HyperLogLog.union([a, b])
+        self.assertEqual(merged.to_bytes(), both.to_bytes())
+        self.assertLessEqual(abs(merged.count() - 9000) / 9000, 0.1)
+
+    def test_round_trip_and_fixed_size(self):
+        sketch = HyperLogLog()
+        sketch.update(range(100000))
+        data = sketch.to_bytes()
+        self.assertEqual(len(data), 2048)
+        self.assertEqual(HyperLogLog.from_bytes(data).count(), sketch.count())
+        with self.assertRaises(ValueError):
+            HyperLogLog().merge(HyperLogLog(precision=10))
+
+
+class UniqueDownloaderTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        downloads.discard_pending()
+        other_faculty = Faculty.objects.create(name="Arts", code="ART")
+        self.other_department = Department.objects.create(name="History", code="HIS", faculty=other_faculty)
+        self.other_material = Material.objects.create(
+            title="Other", code="HIS101", file="materials/his.pdf", session="2023/2024",
+            department=self.other_department, level=self.level, uploaded_by=self.uploader,
+        )
+        self.students = [
+            User.objects.create(email=f"s{i}@test.com", username=f"s{i}", department=self.department)
+            for i in range(40)
+        ]
+
+    def test_repeat_downloads_count_once(self):
+        for _ in range(10):
+            downloads.record_download(self.material, self.student)
+        for student in self.students:
+            downloads.record_download(self.material, student)
+            downloads.record_download(self.other_material, student)
+        downloads.flush()
+
+        self.assertEqual(downloads.unique_downloaders(self.material), 41)
+        self.assertEqual(downloads.unique_downloaders_by_material([self.material, self.other_material]),
+                         {self.material.pk: 41, self.other_material.pk: 40})
+        self.assertEqual(downloads.department_unique_downloaders(self.department), 41)
+        self.assertEqual(downloads.faculty_unique_downloaders(self.faculty), 41)
+
+    def test_faculty_total_merges_department_sketches(self):
+        self.other_department.faculty = self.faculty
+        self.other_department.save()
+        for student in self.students[:30]:
+            downloads.record_download(self.material, student)
+        for student in self.students[10:]:
+            downloads.record_download(self.other_material, student)
+        downloads.flush()
+        self.assertEqual(downloads.faculty_unique_downloaders(self.faculty), 40)
+        self.assertEqual(DownloaderSketch.objects.filter(department__isnull=False).count(), 2)
+
+    def test_sketch_created_by_a_concurrent_flush_is_merged(self):
+        other_flush = HyperLogLog.from_bytes(None)
+        other_flush.update({self.students[0].pk})
+        bulk_create = DownloaderSketch.objects.bulk_create
+
+        def another_flush_inserts_first(objs, *args, **kwargs):
+            # The other flusher commits its new sketch between our read and our insert
+            if not DownloaderSketch.objects.filter(material=self.material).exists():
+                DownloaderSketch.objects.create(material=self.material, registers=other_flush.to_bytes())
+            return bulk_create(objs, *args, **kwargs)
+
+        for student in self.students[1:5]:
+            downloads.record_download(self.material, student)
+        with mock.patch.object(DownloaderSketch.objects, 'bulk_create', side_effect=another_flush_inserts_first):
+            self.assertEqual(downloads.flush(), 4)
+        self.assertEqual(downloads.unique_downloaders(self.material), 5)
+        self.assertEqual(DownloadEvent.objects.count(), 4)
+
+class TrendingTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        downloads.discard_pending()
+        cache.clear()
+        self.now = datetime(2025, 6, 1, 12, tzinfo=dt_timezone.utc)
+        self.old = Material.objects.create(
+            title="Old Favourite", code="CSC100", file="materials/old.pdf", session="2023/2024",
+            department=self.department, level=self.level, uploaded_by=self.uploader,
+        )
+
+    def test_recent_downloads_outrank_older_ones(self):
+        # Ten downloads three half-lives ago are worth 1.25 fresh ones
+        for _ in range(10):
+            downloads.record_download(self.old, self.student, self.now - timedelta(hours=216))
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+
+        entries = trending.top_materials(self.department.id, now=self.now)
+        self.assertEqual([e['id'] for e in entries], [self.material.pk, self.old.pk])
+        self.assertAlmostEqual(entries[0]['score'], 2.0, places=2)
+        self.assertAlmostEqual(entries[1]['score'], 1.25, places=2)
+
+    def test_scores_update_incrementally(self):
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+        first = MaterialPopularity.objects.get(pk=self.material.pk).log_score
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+        self.assertAlmostEqual(MaterialPopularity.objects.get(pk=self.material.pk).log_score, first + 1)
+
+    def test_scores_commit_with_the_events(self):
+        downloads.record_download(self.material, self.student, self.now)
+        with mock.patch.object(MaterialPopularity.objects, 'bulk_create', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            downloads.flush()
+        self.assertFalse(DownloadEvent.objects.exists())
+        self.assertFalse(DownloadRollup.objects.exists())
+
+    def test_lookup_is_served_from_cache(self):
+        downloads.record_download(self.material, self.student, self.now)
+        downloads.flush()
+        with self.assertNumQueries(0):
+            entries = trending.top_materials(self.department.id, self.level.id)
+        self.assertEqual(entries[0]['code'], self.material.code)
+
+    def test_json_endpoint_and_listing(self):
+        downloads.record_download(self.material, self.student)
+        downloads.flush()
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('trending_materials', args=[self.department.slug]))
+        payload = response.json()
+        self.assertEqual(payload['materials'][0]['id'], self.material.pk)
+        self.assertNotIn('log_score', payload['materials'][0])
+
+        response = self.client.get(reverse('material_list', args=[self.department.slug]))
+        self.assertContains(response, "Trending with your classmates")
+
+class AsyncViewTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        downloads.discard_pending()
+        self.async_factory = AsyncRequestFactory()
+
+    def _request(self, path, user, **params):
+        request = self.async_factory.get(path, params)
+        request.user = user
+
+        async def auser():
+            return user
+        request.auser = auser
+        request.session = {}
+        request._messages = default_storage(request)
+        return request
+
+    async def test_track_download_streams_file(self):
+        request = self._request('/download/', self.student)
+        response = await async_views.track_download(request, self.material.pk)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, b"file_content")
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        self.assertIn('attachment', response['Content-Disposition'])
+        material = await Material.objects.aget(pk=self.material.pk)
+        self.assertEqual(material.download_count, 1)
+        self.assertEqual(downloads.pending_count(), 1)
+
+    async def test_track_download_missing_material(self):
+        with self.assertRaises(Http404):
+            await async_views.track_download(self._request('/download/', self.student), 999)
+
+    async def test_track_download_missing_file_is_logged(self):
+        os.remove(self.material.file.path)
+        threads = []
+        real_open = hot_files.open
+
+        def open_off_loop(path):
+            threads.append(threading.get_ident())
+            return real_open(path)
+
+        with mock.patch.object(hot_files, 'open', side_effect=open_off_loop), \
+                self.assertLogs('accounts.async_views', 'ERROR'), self.assertRaises(Http404):
+            await async_views.track_download(self._request('/download/', self.student), self.material.pk)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+        await self.material.arefresh_from_db()
+        self.assertEqual((self.material.download_count, downloads.pending_count()), (0, 0))
+
+    async def test_material_list_view(self):
+        request = self._request('/materials/', self.student, search='Test')
+        response = await async_views.material_list_view(request, self.department.slug)
+        self.assertContains(response, "Test Material")
+        self.assertContains(response, "Found 1 materials")
+
+    async def test_load_departments(self):
+        request = self._request('/ajax/', self.student, faculty_id=self.faculty.id)
+        response = await async_views.load_departments(request)
+        self.assertJSONEqual(response.content, [{'id': self.department.id, 'name': 'Computer Science'}])
+
+class LiveUpdateTests(BaseTestCase):
+    def test_saves_and_deletes_publish_after_commit(self):
+        with mock.patch.object(live.broker, 'publish') as publish, \
+                mock.patch.object(live.broker, 'subscriber_count', return_value=1):
+            with self.captureOnCommitCallbacks() as callbacks:
+                material = Material.objects.create(
+                    title="Past Questions", code="CSC201", file="materials/pq.pdf",
+                    session="2024/2025", department=self.department, level=self.level,
+                    uploaded_by=self.uploader,
+                )
+            publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+            department_id, event = publish.call_args.args
+            self.assertEqual(department_id, self.department.id)
+            self.assertEqual((event['type'], event['id'], event['level']), ('created', material.pk, '100L'))
+
+            pk = material.pk
+            with self.captureOnCommitCallbacks(execute=True):
+                material.delete()
+            self.assertEqual(publish.call_args.args, (self.department.id, {'type': 'deleted', 'id': pk}))
+
+    def test_saves_without_subscribers_build_no_event(self):
+        with mock.patch.object(live, 'material_event') as material_event, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.material.title = "Renamed"
+            self.material.save()
+            self.material.delete()
+        material_event.assert_not_called()
+
+    def test_events_route_needs_async_views(self):
+        # The test settings run without ASYNC_VIEWS, as a WSGI deployment does
+        self.assertFalse(settings.ASYNC_VIEWS)
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(f'/materials/{self.department.slug}/events/').status_code, 404)
+
+    async def test_publish_reaches_only_department_subscribers(self):
+        subscription = live.broker.subscribe(self.department.id)
+        other = live.broker.subscribe(self.department.id + 1)
+        try:
+            await asyncio.to_thread(live.broker.publish, self.department.id, {'type': 'created', 'id': 1})
+            self.assertEqual(await subscription.get(1), 'event: created\ndata: {"type": "created", "id": 1}\n\n')
+            self.assertTrue(other.queue.empty())
+        finally:
+            live.broker.unsubscribe(subscription)
+            live.broker.unsubscribe(other)
+
+    async def test_slow_client_gets_resync_instead_of_backlog(self):
+        subscription = live.broker.subscribe(self.department.id, maxsize=2)
+        try:
+            for i in range(3):
+                live.broker.publish(self.department.id, {'type': 'created', 'id': i})
+            await asyncio.sleep(0)
+            self.assertEqual(await subscription.get(1), live.RESYNC)
+            self.assertTrue(subscription.queue.empty())
+        finally:
+            live.broker.unsubscribe(subscription)
+
+    async def test_stream_sends_heartbeats_and_unsubscribes(self):
+        stream = async_views._event_stream(self.department.id, heartbeat=0.01)
+        self.assertEqual(await anext(stream), 'retry: 5000\n\n')
+        self.assertEqual(await anext(stream), ': heartbeat\n\n')
+        live.broker.publish(self.department.id, {'type': 'deleted', 'id': 7})
+        self.assertEqual(await anext(stream), 'event: deleted\ndata: {"type": "deleted", "id": 7}\n\n')
+        await stream.aclose()
+        self.assertEqual(live.broker.subscriber_count(), 0)
+
+    async def test_events_endpoint(self):
+        request = AsyncRequestFactory().get('/events/')
+
+        async def auser():
+            return self.student
+        request.auser = auser
+        response = await async_views.material_events(request, self.department.slug)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        # The ASGI handler cancels the streaming task when the client disconnects
+        received = []
+
+        async def consume():
+            async for chunk in response.streaming_content:
+                received.append(chunk)
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        self.assertEqual(received, [b'retry: 5000\n\n'])
+        self.assertEqual(live.broker.subscriber_count(self.department.id), 1)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(live.broker.subscriber_count(self.department.id), 0)
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class AdmissionControlTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        downloads.discard_pending()
+        self.clock = FakeClock()
+
+    def controller(self, **limits):
+        options = {'rate': 1, 'burst': 3, 'user_streams': 10, 'global_streams': 10}
+        options.update(limits)
+        return AdmissionController(clock=self.clock, **options)
+
+    def streams(self, client=None):
+        key = f'admission:streams:{client}' if client else 'admission:streams'
+        return StreamCounter.objects.get(key=key).count
+
+    def test_token_bucket_refills_with_time(self):
+        controller = self.controller()
+        for _ in range(3):
+            controller.admit('user:1')()
+        with self.assertRaises(Rejected) as rejected:
+            controller.admit('user:1')
+        self.assertEqual((rejected.exception.status, rejected.exception.retry_after), (429, 1))
+        # Other users have their own bucket
+        controller.admit('user:2')()
+
+        self.clock.now += 1
+        controller.admit('user:1')()
+        self.clock.now += 100
+        for _ in range(3):
+            controller.admit('user:1')()
+        with self.assertRaises(Rejected):
+            controller.admit('user:1')
+
+    def test_concurrent_streams_per_user(self):
+        controller = self.controller(burst=100, user_streams=2)
+        first = controller.admit('user:1')
+        controller.admit('user:1')
+        with self.assertRaises(Rejected) as rejected:
+            controller.admit('user:1')
+        self.assertEqual(rejected.exception.status, 429)
+        first()
+        first()  # releasing twice frees one slot only
+        controller.admit('user:1')
+        with self.assertRaises(Rejected):
+            controller.admit('user:1')
+
+    def test_counts_never_drop_below_zero(self):
+        controller = self.controller(user_streams=1)
+        controller.admit('user:1')()
+        controller._release_slot('admission:streams:user:1')
+        self.assertEqual((self.streams('user:1'), self.streams()), (0, 0))
+        release = controller.admit('user:1')
+        self.assertEqual(self.streams('user:1'), 1)
+        with self.assertRaises(Rejected):
+            controller.admit('user:1')
+        release()
+
+    @override_settings(ADMISSION_STREAM_TTL=60)
+    def test_slots_of_dead_workers_expire(self):
+        controller = self.controller(burst=100, user_streams=1)
+        controller.admit('user:1')  # never released
+        with self.assertRaises(Rejected):
+            controller.admit('user:1')
+        self.clock.now += 61
+        controller.admit('user:1')
+        self.assertEqual(self.streams('user:1'), 1)
+
+    def test_tokens_are_spent_by_one_conditional_update(self):
+        controller = self.controller(burst=2, rate=0.001)
+        controller.admit('user:1')()
+        with CaptureQueriesContext(connection) as queries:
+            controller._take_token('user:1')
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('UPDATE'))
+        # A second worker sharing the table finds the bucket empty
+        other_worker = self.controller(burst=2, rate=0.001)
+        with self.assertRaises(Rejected):
+            other_worker.admit('user:1')
+        self.assertEqual(TokenBucket.objects.get(key='admission:bucket:user:1').tokens, 0)
+
+    def test_global_ceiling_returns_503(self):
+        controller = self.controller(global_streams=2)
+        release = controller.admit('user:1')
+        controller.admit('user:2')
+        with self.assertRaises(Rejected) as rejected:
+            controller.admit('user:3')
+        self.assertEqual(rejected.exception.status, 503)
+        # The rejected user's own slot was handed back
+        self.assertEqual(self.streams('user:3'), 0)
+        release()
+        controller.admit('user:3')
+
+    @override_settings(ADMISSION_USER_STREAMS=1)
+    def test_middleware_limits_open_downloads(self):
+        self.client.force_login(self.student)
+        url = reverse('track_download', args=[self.material.pk])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+
+        second = self.client.get(url)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second['Retry-After'], '5')
+
+        first.close()
+        third = self.client.get(url)
+        self.assertEqual(third.status_code, 200)
+        # Sending the body frees the slot, before the response is even closed
+        self.assertEqual(b''.join(third.streaming_content), b"file_content")
+        self.assertEqual(self.streams(f'user:{self.student.pk}'), 0)
+        third.close()
+
+    def test_file_responses_stay_file_like(self):
+        released = []
+        handle = open(self.material.file.path, 'rb')
+        response = release_after(FileResponse(handle), lambda: released.append(True))
+        # Servers still see a file they can hand to sendfile
+        self.assertEqual(response.file_to_stream.fileno(), handle.fileno())
+        self.assertEqual(b''.join(response.streaming_content), b"file_content")
+        response.close()
+        self.assertTrue(handle.closed)
+        self.assertTrue(released)
+
+    def test_middleware_ignores_other_pages(self):
+        self.client.force_login(self.student)
+        with override_settings(ADMISSION_BURST=1, ADMISSION_RATE=0.001):
+            for _ in range(3):
+                self.assertEqual(self.client.get(reverse('department_list')).status_code, 200)
+
+    async def test_async_middleware_releases_after_stream(self):
+        await self.async_client.aforce_login(self.student)
+        url = reverse('track_download', args=[self.material.pk])
+        with override_settings(ADMISSION_USER_STREAMS=1):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            client = f'user:{self.student.pk}'
+            self.assertEqual(await sync_to_async(self.streams)(client), 1)
+            await sync_to_async(response.close)()
+            self.assertEqual(await sync_to_async(self.streams)(client), 0)
+
+class HotFileCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = HotFileCache(max_bytes=250, max_file_bytes=200, admit_after=2, min_age=0)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_file_is_mapped_on_second_request(self):
+        path = self.write('a.pdf', b'a' * 100)
+        self.assertIsNone(self.cache.open(path))
+        mapped = self.cache.open(path)
+        self.assertEqual(mapped.read(), b'a' * 100)
+        self.assertEqual(self.cache.open(path).read(10), b'a' * 10)
+        self.assertEqual(self.cache.stats(), {'files': 1, 'bytes': 100, 'hits': 1, 'misses': 2})
+
+    def test_changed_file_is_remapped(self):
+        path = self.write('a.pdf', b'old content')
+        self.cache.open(path)
+        self.assertEqual(self.cache.open(path).read(), b'old content')
+        self.write('a.pdf', b'new content, longer')
+        self.assertEqual(self.cache.open(path).read(), b'new content, longer')
+        os.remove(path)
+        self.assertIsNone(self.cache.open(path))
+        self.assertEqual(self.cache.stats()['files'], 0)
+
+    def test_least_recently_used_file_is_evicted(self):
+        paths = [self.write(f'{name}.pdf', name.encode() * 100) for name in 'abc']
+        for path in paths[:2]:
+            self.cache.open(path)
+            self.cache.open(path)
+        self.cache.open(paths[0])  # a is now more recent than b
+        self.cache.open(paths[2])
+        self.cache.open(paths[2])
+        self.assertEqual(self.cache.stats()['bytes'], 200)
+        self.assertEqual(self.cache.open(paths[0]).read(1), b'a')
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+    def test_large_files_are_not_cached(self):
+        path = self.write('big.pdf', b'x' * 201)
+        self.assertIsNone(self.cache.open(path))
+        self.assertIsNone(self.cache.open(path))
+
+    def test_files_still_being_written_are_not_mapped(self):
+        cache = HotFileCache(max_bytes=250, max_file_bytes=200, admit_after=1, min_age=60)
+        path = self.write('a.pdf', b'a' * 100)
+        self.assertIsNone(cache.open(path))
+        os.utime(path, (time.time() - 61,) * 2)
+        self.assertIsInstance(cache.open(path), MappedFile)
+
+    def test_reads_copy_and_chunks_do_not(self):
+        path = self.write('a.pdf', b'0123456789' * 10)
+        self.cache.open(path)
+        mapped = self.cache.open(path)
+        chunk = mapped.read(10)
+        # wsgiref and gunicorn's FileWrapper write() each chunk, which takes bytes only
+        self.assertIs(type(chunk), bytes)
+        self.assertEqual(chunk, b'0123456789')
+        self.assertIsInstance(next(mapped.chunks(10)), memoryview)
+
+    def test_changed_files_are_remapped_at_the_next_response(self):
+        path = self.write('a.pdf', b'0123456789' * 10)
+        self.cache.open(path)
+        self.cache.open(path)
+        with open(path, 'r+b') as f:
+            f.truncate(20)
+        mapped = self.cache.open(path)
+        self.assertEqual(mapped.read(), b'0123456789' * 2)
+
+    def test_readers_keep_evicted_mapping_alive(self):
+        path = self.write('a.pdf', b'0123456789' * 10)
+        self.cache.open(path)
+        mapped = self.cache.open(path)
+        self.cache.clear()
+        self.assertEqual(b''.join(mapped.chunks(30)), b'0123456789' * 10)
+
+
+@override_settings(HOT_FILE_MIN_AGE=0)
+class HotFileDownloadTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        downloads.discard_pending()
+        hot_files.clear()
+        hot_static_files.clear()
+
+    def test_repeated_downloads_are_served_from_mapping(self):
+        self.client.force_login(self.student)
+        url = reverse('track_download', args=[self.material.pk])
+        for _ in range(3):
+            response = self.client.get(url)
+            self.assertEqual(b''.join(response.streaming_content), b'file_content')
+            self.assertEqual(response['Content-Length'], '12')
+            response.close()
+        self.assertEqual(hot_files.stats()['hits'], 1)
+
+    def test_serve_media(self):
+        request = self.factory.get('/media/')
+        for _ in range(2):
+            response = serve_media(request, self.material.file.name)
+            self.assertEqual(b''.join(response.streaming_content), b'file_content')
+            response.close()
+        self.assertIsInstance(response.file_to_stream, MappedFile)
+
+        # What the WSGI handler does with a file response: the server's write() takes bytes only
+        response = serve_media(request, self.material.file.name)
+        chunks = list(FileWrapper(response.file_to_stream, response.block_size))
+        self.assertEqual(chunks, [b'file_content'])
+        self.assertIs(type(chunks[0]), bytes)
+        response.close()
+
+    def test_static_files_have_their_own_budget(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with open(os.path.join(static_root, 'site.css'), 'wb') as f:
+            f.write(b'body {}')
+        with override_settings(STATIC_ROOT=static_root):
+            for _ in range(2):
+                self.client.get(f'{settings.STATIC_URL}site.css').close()
+        self.assertEqual(hot_static_files.stats()['files'], 1)
+        self.assertEqual(hot_files.stats()['files'], 0)
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        layered.clear_local()
+        self.catalog = seed_catalog(materials=300, users=40, departments=2)
+        self.department = self.catalog['departments'][0]
+
+    def expected_count(self, filters, search=''):
+        materials = Material.objects.filter(department=self.department)
+        if search:
+            materials = materials.filter(search_filter(search))
+        return facets.filter_materials(materials, filters).count()
+
+    def test_counts_match_database_for_combined_filters(self):
+        level = self.catalog['levels'][1]
+        semester = self.catalog['semesters'][0]
+        for filters, search in (({}, ''), ({'level': level.id}, ''),
+                                ({'level': level.id, 'semester': semester.id}, 'csc'),
+                                ({'session': '2022/2023'}, 'Lecture 3')):
+            result, total = facets.department_facets(self.department.id, search, filters)
+            self.assertEqual(total, self.expected_count(filters, search))
+            for facet in result:
+                for option in facet['options']:
+                    # Each option counts with its own facet swapped, the others kept
+                    other = {k: v for k, v in filters.items() if k != facet['name']}
+                    other[facet['name']] = option['value']
+                    self.assertEqual(option['count'], self.expected_count(other, search),
+                                     msg=(filters, facet['name'], option))
+
+    def test_bump_department_starts_a_new_generation(self):
+        before = facets.generation(self.department.id)
+        with bulk_signals.bulk_change():
+            facets.bump_department(self.department.id)
+        self.assertEqual(facets.generation(self.department.id), before + 1)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        self.assertEqual([e.id for e in facets.check_shared_generations(None)], ['accounts.E001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(facets.check_shared_generations(None), [])
+
+    def test_one_grouped_query_then_cached(self):
+        with self.assertNumQueries(1):
+            facets.department_facets(self.department.id, 'CSC', {'level': 1})
+        with self.assertNumQueries(0):
+            facets.department_facets(self.department.id, 'csc', {'semester': 2})
+
+    def test_new_material_bumps_generation(self):
+        _, before = facets.department_facets(self.department.id)
+        Material.objects.create(
+            title="Fresh", code="NEW101", file="materials/new.pdf", session="2030/2031",
+            department=self.department, level=self.catalog['levels'][0],
+            uploaded_by=User.objects.filter(is_uploader=True).first(),
+        )
+        result, after = facets.department_facets(self.department.id)
+        self.assertEqual(after, before + 1)
+        sessions = {option['value'] for option in result[3]['options']}
+        self.assertIn('2030/2031', sessions)
+
+    def test_moving_a_material_refreshes_both_departments(self):
+        material = Material.objects.first()
+        source = material.department
+        target = next(d for d in self.catalog['departments'] if d != source)
+        _, before = facets.department_facets(source.id)
+        _, target_before = facets.department_facets(target.id)
+        material.department = target
+        material.save()
+        self.assertEqual(facets.department_facets(source.id)[1], before - 1)
+        self.assertEqual(facets.department_facets(target.id)[1], target_before + 1)
+
+    def test_selected_filters_ignores_bad_values(self):
+        params = QueryDict('level=abc&category=2&session=2024/2025&semester=')
+        self.assertEqual(facets.selected_filters(params), {'category': 2, 'session': '2024/2025'})
+
+    def test_listing_combines_filters(self):
+        student = User.objects.create(email="f@test.com", username="f", department=self.department)
+        self.client.force_login(student)
+        category = self.catalog['categories'][0]
+        level = self.catalog['levels'][2]
+        response = self.client.get(reverse('material_list', args=[self.department.slug]),
+                                   {'category': category.id, 'level': level.id})
+        expected = self.expected_count({'category': category.id, 'level': level.id})
+        self.assertEqual(len(response.context['materials']), expected)
+        self.assertEqual(response.context['total'], expected)
+        self.assertContains(response, f'Found {expected} materials')
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete.clear()
+        self.faculty = Faculty.objects.create(name="Engineering", code="ENG")
+        self.department = Department.objects.create(name="Computer Engineering", code="CPE", faculty=self.faculty)
+        self.level = Level.objects.create(name="400L")
+        self.user = User.objects.create(email="ac@test.com", username="ac", department=self.department)
+        for title, code in (("Data Structures", "CSE403"), ("Operating Systems", "cse 404"),
+                            ("Digital Logic", "EEE-201")):
+            Material.objects.create(title=title, code=code, file="materials/x.pdf", session="2024/2025",
+                                    department=self.department, level=self.level, uploaded_by=self.user)
+
+    def test_code_key_normalized_on_save(self):
+        self.assertEqual(normalize_code(" cse-403 "), "CSE403")
+        material = Material.objects.get(title="Operating Systems")
+        self.assertEqual(material.code_key, "CSE404")
+        material.code = "csc.101"
+        material.save(update_fields=['code'])
+        self.assertEqual(Material.objects.get(pk=material.pk).code_key, "CSC101")
+
+    def test_search_matches_inconsistent_spellings(self):
+        for query in ("CSE403", "cse 403", "cse-403"):
+            materials = Material.objects.filter(search_filter(query))
+            self.assertEqual([m.title for m in materials], ["Data Structures"], msg=query)
+        # A prefix, so the (department, code_key) index can serve it
+        self.assertIn("LIKE CSE4%", str(Material.objects.filter(search_filter("cse 4")).query))
+
+    def test_search_by_course_number_alone(self):
+        for query, title in (("403", "Data Structures"), ("20", "Digital Logic")):
+            materials = Material.objects.filter(search_filter(query))
+            self.assertEqual([m.title for m in materials], [title], msg=query)
+
+    def test_index_suggests_codes_and_title_words(self):
+        index = autocomplete.material_index(self.department.id)
+        self.assertEqual(index.search("cse 4", 10), [
+            {'kind': 'code', 'value': 'CSE403'},
+            {'kind': 'code', 'value': 'CSE404'},
+        ])
+        self.assertEqual(index.search("sys", 10), [{'kind': 'title', 'value': 'Operating Systems'}])
+        self.assertEqual(len(index.search("cse", 1)), 1)
+        self.assertEqual(index.search("   ", 10), [])
+
+    def test_lookups_stay_in_memory_until_materials_change(self):
+        autocomplete.material_index(self.department.id)
+        with self.assertNumQueries(0):
+            autocomplete.material_index(self.department.id).search("d", 10)
+        Material.objects.create(title="Databases", code="CSE405", file="materials/y.pdf", session="2024/2025",
+                                department=self.department, level=self.level, uploaded_by=self.user)
+        values = [s['value'] for s in autocomplete.material_index(self.department.id).search("da", 10)]
+        self.assertEqual(values, ["Data Structures", "Databases"])
+
+    def test_material_endpoint(self):
+        self.client.force_login(self.user)
+        url = reverse('material_autocomplete', args=[self.department.slug])
+        response = self.client.get(url, {'q': 'eee2', 'limit': 5})
+        self.assertEqual(response.json(), {'query': 'eee2', 'suggestions': [{'kind': 'code', 'value': 'EEE201'}]})
+        self.assertEqual(self.client.get(reverse('material_autocomplete', args=['nowhere'])).status_code, 404)
+
+    def test_department_endpoint_follows_renames(self):
+        self.client.force_login(self.user)
+        url = reverse('department_autocomplete')
+        response = self.client.get(url, {'q': 'eng'})
+        self.assertEqual(response.json()['suggestions'], [{
+            'kind': 'department', 'value': 'Computer Engineering', 'code': 'CPE',
+            'url': reverse('material_list', args=[self.department.slug]),
+        }])
+        self.department.name = "Software Engineering"
+        self.department.save()
+        self.assertEqual(self.client.get(url, {'q': 'soft'}).json()['suggestions'][0]['value'],
+                         "Software Engineering")
+
+    def test_requires_login(self):
+        response = self.client.get(reverse('department_autocomplete'), {'q': 'c'})
+        self.assertEqual(response.status_code, 302)
+
+class CatalogApiTests(TestCase):
+    def setUp(self):
+        self.faculty = Faculty.objects.create(name="Science", code="SCI")
+        self.department = Department.objects.create(name="Physics", code="PHY", faculty=self.faculty)
+        self.other = Department.objects.create(name="Chemistry", code="CHM", faculty=self.faculty)
+        self.level = Level.objects.create(name="100L")
+        self.user = User.objects.create(email="api@test.com", username="api", department=self.department)
+        self.materials = [self.material(f"Note {i}", self.department) for i in range(5)]
+        self.client.force_login(self.user)
+        self.url = reverse('catalog', args=['materials'])
+
+    def material(self, title, department):
+        return Material.objects.create(title=title, code="PHY101", file="materials/x.pdf", session="2024/2025",
+                                       department=department, level=self.level, uploaded_by=self.user)
+
+    def sync(self, cursor=None, **params):
+        """Follow pages until has_more is false; returns (results, deleted, cursor)"""
+        results, deleted = [], []
+        while True:
+            query = {'department': self.department.slug, 'limit': 2, **params}
+            if cursor:
+                query['cursor'] = cursor
+            page = self.client.get(self.url, query).json()
+            results += page['results']
+            deleted += page['deleted']
+            cursor = page['cursor']
+            if not page['has_more']:
+                return results, deleted, cursor
+
+    def test_cursor_pagination_lists_everything_once(self):
+        self.material("Elsewhere", self.other)
+        results, deleted, _ = self.sync()
+        self.assertEqual([row['id'] for row in results], [m.pk for m in self.materials])
+        self.assertEqual(deleted, [])
+        self.assertEqual(results[0]['department'], self.department.slug)
+        self.assertEqual(results[0]['download_url'], reverse('track_download', args=[self.materials[0].pk]))
+
+    def test_delta_returns_changes_and_tombstones(self):
+        _, _, cursor = self.sync()
+        changed = self.materials[1]
+        changed.title = "Renamed"
+        changed.save(update_fields=['title'])
+        added = self.material("New", self.department)
+        removed = self.materials[3].pk
+        self.materials[3].delete()
+        self.material("Elsewhere", self.other).delete()
+
+        results, deleted, cursor = self.sync(cursor)
+        self.assertEqual([(row['id'], row['title']) for row in results],
+                         [(changed.pk, "Renamed"), (added.pk, "New")])
+        self.assertEqual(deleted, [removed])
+        self.assertEqual(self.sync(cursor)[:2], ([], []))
+
+    def test_moves_and_renames_reach_delta_syncs(self):
+        _, _, cursor = self.sync()
+        moved = Material.objects.get(pk=self.materials[0].pk)
+        moved.department = self.other
+        moved.save()
+        self.level.name = "100 Level"
+        self.level.save()
+
+        results, deleted, _ = self.sync(cursor)
+        self.assertEqual(deleted, [moved.pk])
+        self.assertEqual({row['level'] for row in results}, {"100 Level"})
+        self.assertEqual(len(results), 4)
+        # Saving without a change, or without writing the department, moves nothing
+        moved.save()
+        moved.department = self.department
+        moved.save(update_fields=['title'])
+        self.assertEqual(Tombstone.objects.count(), 1)
+
+    def test_sparse_fieldsets(self):
+        page = self.client.get(self.url, {'fields': 'id,code'}).json()
+        self.assertEqual(page['results'][0], {'id': self.materials[0].pk, 'code': 'PHY101'})
+        response = self.client.get(self.url, {'fields': 'id,uploaded_by'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('uploaded_by', response.json()['error'])
+
+    def test_page_query_count_is_constant(self):
+        # session, user, department, two ETag aggregates, tombstones and rows
+        for limit in (1, 5):
+            with self.assertNumQueries(7):
+                self.client.get(self.url, {'limit': limit, 'department': self.department.slug,
+                                           'cursor': api.encode_cursor(None, 0, 0)})
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(4):
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.materials[0].save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # Deletions leave a tombstone, which changes the tag as well
+        etag = response['ETag']
+        self.materials[1].delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_bad_cursor_and_department(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'department': 'nowhere'}).status_code, 404)
+
+    def test_departments_and_faculties(self):
+        departments = self.client.get(reverse('catalog', args=['departments']), {'fields': 'slug,faculty'}).json()
+        self.assertEqual(departments['results'], [
+            {'slug': 'physics', 'faculty': 'science'}, {'slug': 'chemistry', 'faculty': 'science'},
+        ])
+        cursor = self.client.get(reverse('catalog', args=['faculties'])).json()['cursor']
+        other_pk = self.other.pk
+        self.other.delete()
+        page = self.client.get(reverse('catalog', args=['departments']), {'cursor': departments['cursor']}).json()
+        self.assertEqual(page['deleted'], [other_pk])
+        self.assertEqual(self.client.get(reverse('catalog', args=['faculties']), {'cursor': cursor}).json()['deleted'], [])
+
+class ProgressiveWebAppTests(BaseTestCase):
+    def test_manifest(self):
+        response = self.client.get(reverse('web_manifest'))
+        self.assertEqual(response['Content-Type'], 'application/manifest+json')
+        self.assertEqual(response.json()['start_url'], reverse('department_list'))
+
+    def test_service_worker_is_versioned_and_revalidated(self):
+        response = self.client.get(reverse('service_worker'))
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        body = response.content.decode()
+        self.assertIn(f"const VERSION = '{pwa.static_version()}';", body)
+        self.assertIn(static('css/main.css'), body)
+
+    def test_version_follows_static_manifest(self):
+        self.assertRegex(pwa._static_version(), r'^[0-9a-f]{12}$')
+        with mock.patch('accounts.pwa.staticfiles_storage', mock.Mock(manifest_hash='0123456789abcdef')):
+            self.assertEqual(pwa._static_version(), '0123456789ab')
+
+    def test_listing_pages_are_offline_cacheable(self):
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('material_list', args=[self.department.slug]))
+        self.assertEqual(response[pwa.OFFLINE_PAGE_HEADER], '1')
+        self.assertContains(response, f'data-offline-url="{reverse("track_download", args=[self.material.pk])}"')
+        self.assertEqual(self.client.get(reverse('department_list'))[pwa.OFFLINE_PAGE_HEADER], '1')
+        self.assertNotIn(pwa.OFFLINE_PAGE_HEADER, self.client.get(reverse('home')))
+
+class StaticPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(STATIC_ROOT=cls.static_root)
+        cls.settings_override.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.static_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_collectstatic_hashes_and_precompresses(self):
+        hashed = staticfiles_storage.stored_name('css/pages/material-list.css')
+        self.assertRegex(hashed, r'^css/pages/material-list\.[0-9a-f]{12}\.css$')
+        path = os.path.join(self.static_root, hashed)
+        with open(path, 'rb') as original, gzip.open(path + '.gz') as compressed:
+            self.assertEqual(compressed.read(), original.read())
+        # Image references inside stylesheets are rewritten to hashed names too
+        with open(os.path.join(self.static_root, staticfiles_storage.stored_name('css/pages/index.css'))) as css:
+            self.assertRegex(css.read(), r'about-us section\.[0-9a-f]{12}\.webp')
+
+    def test_hashed_files_are_immutable_and_gzipped(self):
+        url = static('css/main.css')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        with staticfiles_storage.open('css/main.css') as original:
+            self.assertEqual(body, original.read())
+
+        revalidated = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_gzip_follows_accept_encoding_qualities(self):
+        for header, accepted in (('gzip, br', True), ('br;q=1.0, gzip;q=0.5', True), ('gzip;q=0', False),
+                                 ('gzip; q=0.000', False), ('*', True), ('*, gzip;q=0', False),
+                                 ('identity', False), ('', False), ('GZIP', True)):
+            self.assertEqual(accepts_gzip(header), accepted, msg=header)
+        response = self.client.get(static('css/main.css'), HTTP_ACCEPT_ENCODING='br, gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_unhashed_names_get_short_lifetime(self):
+        response = self.client.get('/static/css/main.css')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.STATIC_MAX_AGE}')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(self.client.get('/static/css/missing.css').status_code, 404)
+        self.assertEqual(self.client.get('/static/../settings.py').status_code, 400)
+
+    def test_pages_link_styles_instead_of_inlining(self):
+        user = User.objects.create(email="css@test.com", username="css")
+        self.client.force_login(user)
+        response = self.client.get(reverse('department_list'))
+        self.assertNotContains(response, '<style>')
+        self.assertContains(response, static('css/pages/department-list.css'))
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.source, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.faculty = Faculty.objects.create(name="Science", code="SCI")
+        self.department = Department.objects.create(name="Physics", code="PHY", faculty=self.faculty)
+        self.level = Level.objects.create(name="100L")
+        Category.objects.create(name="Lecture Notes")
+        self.uploader = User.objects.create(email="rep@test.com", username="rep", is_uploader=True)
+
+    def write(self, name, content):
+        with open(os.path.join(self.source, name), 'wb') as f:
+            f.write(content)
+
+    def manifest(self, rows, name='manifest.csv'):
+        path = os.path.join(self.source, name)
+        if name.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(rows, f)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=bulk_import.MANIFEST_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        return path
+
+    def row(self, file, code='PHY 101', **extra):
+        return {'file': file, 'code': code, 'title': f'{file} notes', 'level': '100l',
+                'semester': '', 'category': 'lecture notes', 'session': '2024/2025', **extra}
+
+    def run_import(self, manifest, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_materials', self.source, manifest, department='phy', uploader='rep@test.com',
+                     workers=options.pop('workers', 0), stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_valid_rows_and_reports_invalid_ones(self):
+        self.write('a.pdf', b'first file')
+        self.write('b.pptx', b'second file')
+        self.write('c.exe', b'not allowed')
+        manifest = self.manifest([
+            self.row('a.pdf'), self.row('b.pptx', code='PHY-102'), self.row('c.exe'),
+            self.row('missing.pdf'), self.row('a.pdf', level='900L'),
+            self.row('a.pdf', session='2024'), self.row('../../etc/passwd.pdf'),
+        ])
+        out, err = self.run_import(manifest)
+
+        materials = Material.objects.filter(department=self.department).order_by('code')
+        self.assertEqual([(m.code_key, m.category.name) for m in materials],
+                         [('PHY101', 'Lecture Notes'), ('PHY102', 'Lecture Notes')])
+        with materials[0].file.open('rb') as f:
+            self.assertEqual(f.read(), b'first file')
+        self.assertEqual(materials[0].checksum, hashlib.sha256(b'first file').hexdigest())
+        for number in (3, 4, 5, 6, 7):
+            self.assertIn(f'row {number}:', err)
+        self.assertIn('Imported 2 materials', out)
+        self.assertIn('files/s', out)
+
+    def test_rerun_resumes_without_duplicates(self):
+        for name in ('a.pdf', 'b.pdf', 'copy.pdf'):
+            self.write(name, b'same' if name != 'b.pdf' else b'other')
+        manifest = self.manifest([self.row('a.pdf'), self.row('copy.pdf')], name='manifest.json')
+        self.run_import(manifest)
+        self.assertEqual(Material.objects.count(), 1)
+
+        manifest = self.manifest([self.row('a.pdf'), self.row('b.pdf')], name='manifest.json')
+        out, _ = self.run_import(manifest, workers=2)
+        self.assertIn('Imported 1 materials', out)
+        self.assertIn('skipped 1 already imported', out)
+        self.assertEqual(Material.objects.count(), 2)
+
+    def test_failed_batch_removes_copied_files(self):
+        self.write('a.pdf', b'one')
+        self.write('b.pdf', b'two')
+        manifest = self.manifest([self.row('a.pdf'), self.row('b.pdf')])
+        with mock.patch.object(Material.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self.run_import(manifest, batch_size=1)
+        self.assertFalse(Material.objects.exists())
+        self.assertEqual(stored_files(self.media_root, 'materials'), [])
+
+    def test_dry_run_writes_nothing(self):
+        self.write('a.pdf', b'one')
+        out, _ = self.run_import(self.manifest([self.row('a.pdf')]), dry_run=True)
+        self.assertIn('Dry run: 1 new', out)
+        self.assertFalse(Material.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'materials')))
+
+
+@override_settings(ARCHIVE_IMPORT_WORKERS=0)
+class ArchiveImportTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.level = Level.objects.create(name="200L")
+        self.client.login(email='uploader@test.com', password='testpass123')
+
+    def archive(self, entries, compression=zipfile.ZIP_DEFLATED):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression) as archive:
+            for name, content in entries.items():
+                archive.writestr(name, content)
+        return SimpleUploadedFile('course.zip', buffer.getvalue(), content_type='application/zip')
+
+    def upload(self, entries, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('archive_upload'), {
+                'archive': self.archive(entries), 'level': self.level.pk, 'session': '2024/2025', **data,
+            })
+        job = ArchiveImport.objects.get()
+        self.assertRedirects(response, reverse('archive_status', args=[job.pk]))
+        return job
+
+    def test_uploader_without_department_gets_a_form_error(self):
+        User.objects.filter(email='uploader@test.com').update(department=None)
+        response = self.client.post(reverse('archive_upload'), {
+            'archive': self.archive({'CSC201 - Data Structures.pdf': b'x'}), 'level': self.level.pk,
+            'session': '2024/2025',
+        })
+        self.assertContains(response, 'Your account has no department')
+        self.assertFalse(ArchiveImport.objects.exists())
+
+    def test_stranded_jobs_are_resumed_or_failed(self):
+        # Queued, but the worker that would have run it went away
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.post(reverse('archive_upload'), {
+                'archive': self.archive({'CSC201 - Data Structures.pdf': b'structures'}),
+                'level': self.level.pk, 'session': '2024/2025',
+            })
+        stranded = ArchiveImport.objects.get()
+        lost = ArchiveImport.objects.create(archive='archives/gone.zip', department=self.department,
+                                            uploaded_by=stranded.uploaded_by, level=self.level, session='2024/2025')
+        self.assertEqual(archives.resume_stale_jobs(), (0, 0))
+
+        later = datetime.now(dt_timezone.utc) + timedelta(minutes=settings.ARCHIVE_IMPORT_STALE_MINUTES + 1)
+        self.assertEqual(archives.resume_stale_jobs(later), (1, 1))
+        stranded.refresh_from_db()
+        lost.refresh_from_db()
+        self.assertEqual((stranded.status, stranded.imported), ('done', 1))
+        self.assertEqual(lost.status, 'failed')
+        self.assertTrue(Material.objects.filter(code='CSC201', department=self.department).exists())
+
+    def test_a_job_runs_once_when_the_pool_reaches_a_resumed_job(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse('archive_upload'), {
+                'archive': self.archive({'CSC201 - Data Structures.pdf': b'structures'}),
+                'level': self.level.pk, 'session': '2024/2025',
+            })
+        later = datetime.now(dt_timezone.utc) + timedelta(minutes=settings.ARCHIVE_IMPORT_STALE_MINUTES + 1)
+        self.assertEqual(archives.resume_stale_jobs(later), (1, 0))
+        # The busy pool finally gets to the job it was handed at upload
+        with mock.patch('accounts.archives.import_entries') as import_entries:
+            for callback in callbacks:
+                callback()
+        import_entries.assert_not_called()
+        job = ArchiveImport.objects.get()
+        self.assertEqual((job.status, job.imported), ('done', 1))
+        self.assertEqual(Material.objects.filter(code='CSC201', department=self.department).count(), 1)
+
+    def test_entries_become_materials_from_filenames_and_manifest(self):
+        manifest = 'file,code,title,level,semester,category,session\nnotes.pdf,CSC 205,Compilers,,,,2023/2024\n'
+        job = self.upload({
+            'CSC201 - Data Structures.pdf': b'structures',
+            'week 2/csc_202_Algorithms.docx': b'algorithms',
+            'notes.pdf': b'compilers',
+            'manifest.csv': manifest,
+            'readme.txt': b'not a material',
+            'summary.pdf': b'no course code',
+        })
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.processed, job.imported), ('done', 5, 5, 3))
+        self.assertEqual(sorted(error['file'] for error in job.errors), ['readme.txt', 'summary.pdf'])
+
+        materials = Material.objects.filter(department=self.department).exclude(pk=self.material.pk)
+        self.assertEqual(sorted(materials.values_list('code', 'title', 'session', 'level__name')), [
+            ('CSC 205', 'Compilers', '2023/2024', '200L'),
+            ('CSC201', 'Data Structures', '2024/2025', '200L'),
+            ('CSC202', 'Algorithms', '2024/2025', '200L'),
+        ])
+        material = materials.get(code='CSC201')
+        self.assertEqual(material.uploaded_by.email, 'uploader@test.com')
+        self.assertEqual(material.checksum, hashlib.sha256(b'structures').hexdigest())
+        with material.file.open('rb') as f:
+            self.assertEqual(f.read(), b'structures')
+        self.assertFalse(job.archive.storage.exists(job.archive.name))
+
+    def test_reupload_skips_files_already_imported(self):
+        self.upload({'CSC201 notes.pdf': b'same'})
+        ArchiveImport.objects.all().delete()
+        job = self.upload({'CSC201 notes.pdf': b'same', 'CSC202 notes.pdf': b'new'})
+        job.refresh_from_db()
+        self.assertEqual((job.imported, job.skipped), (1, 1))
+
+    def test_zip_bomb_fails_the_job_and_removes_stored_files(self):
+        with override_settings(ARCHIVE_MAX_RATIO=20):
+            job = self.upload({'CSC201 a.pdf': b'fine', 'CSC202 bomb.pdf': b'\0' * (2 * 1024 * 1024)})
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('zip bomb', job.message)
+        self.assertEqual(Material.objects.filter(code__startswith='CSC20').count(), 0)
+        self.assertEqual(stored_files(self.media_root, 'materials'), [])
+
+    def test_total_size_and_entry_limits(self):
+        with override_settings(ARCHIVE_MAX_TOTAL_SIZE=10):
+            job = self.upload({'CSC201 a.pdf': b'0123456789', 'CSC202 b.pdf': b'more'})
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.imported), ('failed', 0))
+
+        ArchiveImport.objects.all().delete()
+        with override_settings(ARCHIVE_MAX_ENTRIES=1):
+            job = self.upload({'CSC201 a.pdf': b'a', 'CSC202 b.pdf': b'b'})
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('limit is 1', job.message)
+
+    def test_rejects_files_that_are_not_zip_archives(self):
+        response = self.client.post(reverse('archive_upload'), {
+            'archive': SimpleUploadedFile('course.zip', b'plain text'), 'level': self.level.pk, 'session': '2024/2025',
+        })
+        self.assertContains(response, 'not a valid ZIP archive')
+        self.assertFalse(ArchiveImport.objects.exists())
+
+    def test_status_endpoint_reports_progress_to_the_uploader_only(self):
+        job = self.upload({'CSC201 a.pdf': b'a', 'bad.exe': b'b'})
+        data = self.client.get(reverse('archive_status_json', args=[job.pk])).json()
+        self.assertEqual({key: data[key] for key in ('status', 'finished', 'total', 'processed', 'imported')},
+                         {'status': 'done', 'finished': True, 'total': 2, 'processed': 2, 'imported': 1})
+        self.assertEqual(data['errors'][0]['file'], 'bad.exe')
+        self.assertContains(self.client.get(reverse('archive_status', args=[job.pk])), 'job-progress')
+
+        self.client.login(email='student@test.com', password='testpass123')
+        self.assertEqual(self.client.get(reverse('archive_status_json', args=[job.pk])).status_code, 404)
+
+
+@override_settings(MAIL_WORKERS=0, EMAIL_BATCH_SIZE=2)
+class ProvisioningTests(BaseTestCase):
+    def class_list(self, rows, header='email,username,first_name,last_name,password'):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'class.csv')
+        with open(path, 'w') as f:
+            f.write('\n'.join([header, *rows]) + '\n')
+        return path
+
+    def provision(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('provision_students', path, department='csc', workers=0, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_creates_accounts_and_reports_invalid_rows(self):
+        path = self.class_list([
+            'ada@Example.COM,ada,Ada,Lovelace,',
+            'alan@example.com,,Alan,Turing,correct-horse-battery',
+            'not-an-email,x,,,',
+            'ADA@example.com,ada2,,,',
+            'student@test.com,someone,,,',
+            'weak@example.com,weak,,,123',
+        ])
+        out, err = self.provision(path)
+        self.assertIn('Created 2 accounts in Computer Science', out)
+        self.assertIn('skipped 1 already registered', out)
+        for number in (3, 4, 6):
+            self.assertIn(f'row {number}:', err)
+
+        ada = User.objects.get(email='ada@example.com')
+        self.assertEqual((ada.username, ada.department, ada.faculty), ('ada', self.department, self.faculty))
+        self.assertFalse(ada.has_usable_password())
+        alan = User.objects.get(username='alan@example.com')
+        self.assertTrue(alan.check_password('correct-horse-battery'))
+
+    def test_uniqueness_is_checked_in_one_query_per_chunk(self):
+        rows = [f'student{i}@example.com,,,,' for i in range(30)]
+        provisioner = provisioning.StudentProvisioner(self.department, workers=0, send_email=False)
+        candidates = provisioner.validate(provisioning.read_class_list(io.BytesIO(
+            ('email\n' + '\n'.join(rows)).encode())), provisioning.ProvisionReport())
+        with self.assertNumQueries(1):
+            provisioner.new_accounts(candidates, provisioning.ProvisionReport())
+
+    def test_welcome_emails_are_sent_in_batches_with_password_links(self):
+        path = self.class_list(['a@example.com,,,,', 'b@example.com,,,,', 'c@example.com,,,,password-for-c1'])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        autospec=True, side_effect=lambda backend, messages: len(messages)) as send:
+            self.provision(path)
+        self.assertEqual([len(call.args[1]) for call in send.call_args_list], [2, 1])
+        # One connection for every batch
+        self.assertEqual(len({id(call.args[0]) for call in send.call_args_list}), 1)
+
+        self.provision(self.class_list(['d@example.com,,,,']))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['d@example.com'])
+        self.assertIn('/password-reset-confirm/', mail.outbox[0].body)
+
+    def test_registered_emails_and_usernames_match_in_any_case(self):
+        User.objects.create(email='Grace.Hopper@Example.com', username='GHopper')
+        out, _ = self.provision(self.class_list(['grace.hopper@example.com,,,,', 'other@example.com,ghopper,,,']),
+                                no_email=True)
+        self.assertIn('Created 0 accounts', out)
+        self.assertIn('skipped 2 already registered', out)
+
+    def test_rerun_and_dry_run_create_nothing_new(self):
+        path = self.class_list(['a@example.com,,,,'])
+        self.provision(path, no_email=True)
+        out, _ = self.provision(path, no_email=True)
+        self.assertIn('Created 0 accounts', out)
+        out, _ = self.provision(self.class_list(['b@example.com,,,,']), dry_run=True)
+        self.assertIn('Dry run: 1 new', out)
+        self.assertFalse(User.objects.filter(email='b@example.com').exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_admin_action_provisions_one_department(self):
+        admin_user = User.objects.create(email='root@test.com', username='root', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        url = reverse('admin:accounts_department_changelist')
+        data = {'action': 'provision_students', '_selected_action': [self.department.pk]}
+        response = self.client.post(url, data)
+        self.assertContains(response, 'Create student accounts in Computer Science')
+
+        class_list = SimpleUploadedFile('class.csv', b'email,first_name,password\nnew@example.com,New,new-pass-123\n')
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(provisioning, 'ProcessPoolExecutor') as pool:
+            response = self.client.post(url, {**data, 'apply': '1', 'send_email': 'on', 'class_list': class_list})
+        # Passwords are hashed in the request's own process
+        pool.assert_not_called()
+        self.assertRedirects(response, url)
+        new = User.objects.get(email='new@example.com')
+        self.assertEqual(new.department, self.department)
+        self.assertTrue(new.check_password('new-pass-123'))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(ADMIN_CLASS_LIST_MAX_PASSWORDS=1)
+    def test_admin_action_sends_long_password_lists_to_the_command(self):
+        admin_user = User.objects.create(email='root@test.com', username='root', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        url = reverse('admin:accounts_department_changelist')
+        data = {'action': 'provision_students', '_selected_action': [self.department.pk], 'apply': '1'}
+        rows = b'email,password\na@example.com,first-pass-123\nb@example.com,second-pass-123\n'
+        with mock.patch.object(provisioning, 'make_password') as make_password:
+            response = self.client.post(url, {**data, 'class_list': SimpleUploadedFile('class.csv', rows)})
+        make_password.assert_not_called()
+        self.assertContains(response, 'manage.py provision_students')
+        self.assertFalse(User.objects.filter(email__endswith='@example.com').exists())
+
+        # Without passwords nothing is hashed, so the same students fit
+        rows = b'email\na@example.com\nb@example.com\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {**data, 'class_list': SimpleUploadedFile('class.csv', rows)})
+        self.assertRedirects(response, url)
+        self.assertEqual(User.objects.filter(email__endswith='@example.com').count(), 2)
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """Just enough SMTP for smtplib, recording each accepted message's envelope"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, fail_after=None):
+        self.connections = 0
+        self.messages = []  # (sender, recipients, data)
+        self.fail_after = fail_after
+        super().__init__(('127.0.0.1', 0), LocalSMTPHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost ESMTP')
+        sender, recipients = None, []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO', 'RSET', 'NOOP'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = re.search('<(.*?)>', command)[1], []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(re.search('<(.*?)>', command)[1])
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                if server.fail_after is not None and len(server.messages) >= server.fail_after:
+                    self.reply('451 Try again later')
+                else:
+                    server.messages.append((sender, recipients, data))
+                    self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Not implemented')
+
+
+class DigestTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            User.objects.create(email=f"s{i}@test.com", username=f"s{i}", department=self.department)
+        User.objects.create(email="away@test.com", username="away", department=self.department, is_active=False)
+        other = Department.objects.create(name="Physics", code="PHY", faculty=self.faculty)
+        User.objects.create(email="physics@test.com", username="physics", department=other)
+
+    def smtp(self, **options):
+        server = LocalSMTPServer(**options)
+        self.addCleanup(server.stop)
+        override = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=server.server_address[1], EMAIL_USE_TLS=False, EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='', DIGEST_RECIPIENTS_PER_MESSAGE=2, EMAIL_BATCH_SIZE=2,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        return server
+
+    def test_windows_cover_each_material_once(self):
+        now = datetime.now(dt_timezone.utc)
+        [digest] = digests.schedule_digests(now)
+        self.assertEqual((digest.department, digest.material_count), (self.department, 1))
+        self.assertEqual(digest.window_start, now - timedelta(hours=settings.DIGEST_WINDOW_HOURS))
+        self.assertEqual(digests.schedule_digests(now + timedelta(minutes=1)), [])
+
+        later = Material.objects.create(title="Later", code="CSC102", file=self.test_file, session="2023/2024",
+                                        department=self.department, level=self.level, uploaded_by=self.uploader)
+        [second] = digests.schedule_digests(datetime.now(dt_timezone.utc) + timedelta(seconds=1))
+        self.assertEqual(second.window_start, now)
+        self.assertEqual(list(digests.digest_materials(second)), [later])
+
+    def test_counts_are_grouped_in_the_database(self):
+        other = Department.objects.get(code="PHY")
+        for i in range(5):
+            Material.objects.create(title=f"Extra {i}", code=f"PHY10{i}", file=self.test_file, session="2023/2024",
+                                    department=other, level=self.level, uploaded_by=self.uploader)
+        # Windows read, departments locked, windows read again, counts, insert (plus the savepoint pair)
+        with self.assertNumQueries(7):
+            created = digests.schedule_digests()
+        self.assertEqual({(digest.department_id, digest.material_count) for digest in created},
+                         {(self.department.pk, 1), (other.pk, 5)})
+
+    def test_a_window_can_only_be_started_once(self):
+        [digest] = digests.schedule_digests()
+        # What a concurrent run that read the same previous window would insert
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Digest.objects.create(department=self.department, window_start=digest.window_start,
+                                  window_end=digest.window_end + timedelta(seconds=1))
+
+    def test_sends_one_rendering_over_one_connection_in_chunks(self):
+        server = self.smtp()
+        digests.schedule_digests()
+        with mock.patch('accounts.digests.render_to_string', wraps=digests.render_to_string) as render:
+            self.assertEqual(digests.send_pending_digests(), (1, 5))
+        self.assertEqual(render.call_count, 2)  # text and HTML, once for the whole department
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([len(recipients) for _, recipients, _ in server.messages], [3, 3, 2])
+        delivered = {email for _, recipients, _ in server.messages for email in recipients[1:]}
+        self.assertEqual(delivered, {'student@test.com', 'uploader@test.com', 's0@test.com', 's1@test.com',
+                                     's2@test.com'})
+        self.assertIn(b'TEST101', server.messages[0][2])
+        self.assertNotIn(b'Bcc', server.messages[0][2])
+
+        digest = Digest.objects.get()
+        self.assertEqual((digest.status, digest.delivered), ('sent', 5))
+        self.assertEqual(digests.send_pending_digests(), (0, 0))
+
+    def test_failed_send_resumes_without_duplicates(self):
+        server = self.smtp(fail_after=2)
+        digests.schedule_digests()
+        with self.assertRaises(smtplib.SMTPDataError):
+            digests.send_pending_digests()
+        # The first batch (two messages, four students) was recorded; the failed one was not
+        self.assertEqual(DigestDelivery.objects.count(), 4)
+        self.assertEqual(Digest.objects.get().status, 'pending')
+
+        server.fail_after = None
+        out = io.StringIO()
+        call_command('send_material_digests', stdout=out)
+        self.assertIn('Sent 1 digests to 1 students', out.getvalue())
+        recipients = [email for _, envelope, _ in server.messages for email in envelope[1:]]
+        self.assertEqual(len(recipients), len(set(recipients)))
+        self.assertEqual(Digest.objects.get().delivered, 5)
+
+    def test_overlapping_runs_send_each_digest_once(self):
+        server = self.smtp()
+        digests.schedule_digests()
+        digest = Digest.objects.get()
+        # An earlier run read the same pending digest and is still mailing it
+        self.assertTrue(digests.claim(digest))
+        self.assertEqual(digests.send_pending_digests(), (0, 0))
+        self.assertEqual(digests.send_digest(digest, mock.Mock()), None)
+        self.assertEqual(server.messages, [])
+
+        # That run died; once its claim lapses the next run takes the digest over
+        lapsed = datetime.now(dt_timezone.utc) - timedelta(minutes=settings.DIGEST_CLAIM_MINUTES + 1)
+        Digest.objects.update(claimed_at=lapsed)
+        self.assertEqual(digests.send_pending_digests(), (1, 5))
+        self.assertEqual(Digest.objects.get().status, 'sent')
+
+
+class TieringTests(BaseTestCase):
+    def setUp(self):
+        self.media_root, self.cold_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for path in (self.media_root, self.cold_root):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, COLD_MEDIA_ROOT=self.cold_root,
+                                                   MATERIAL_HOT_SESSIONS=1)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        super().setUp()
+        downloads.discard_pending()
+        self.old = self.material  # session 2023/2024
+        self.old.upload_date = datetime(2024, 1, 5, tzinfo=dt_timezone.utc)
+        self.old.save()
+        Material.objects.filter(pk=self.old.pk).update(upload_date=datetime(2024, 1, 5, tzinfo=dt_timezone.utc))
+        self.current = Material.objects.create(
+            title="Current Notes", code="CSC201", file=SimpleUploadedFile("current.pdf", b"current"),
+            session="2024/2025", department=self.department, level=self.level, uploaded_by=self.uploader,
+        )
+        self.client.login(email='student@test.com', password='testpass123')
+
+    def tier(self, *args):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('tier_materials', *args, stdout=out)
+        return out.getvalue()
+
+    def test_archive_moves_rows_and_files_keeping_ids(self):
+        hot_name = self.old.file.name
+        self.assertIn('Would move 1 materials from sessions before 2024/2025', self.tier('archive', '--dry-run'))
+        self.assertIn('Moved 1 materials', self.tier('archive'))
+
+        self.assertEqual(list(Material.objects.values_list('pk', flat=True)), [self.current.pk])
+        archived = ArchivedMaterial.objects.get()
+        self.assertEqual((archived.pk, archived.code_key, archived.upload_date),
+                         (self.old.pk, 'TEST101', datetime(2024, 1, 5, tzinfo=dt_timezone.utc)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, hot_name)))
+        with archived.file.open('rb') as f:
+            self.assertEqual(f.read(), b'file_content')
+
+    def test_archived_materials_stay_searchable_and_downloadable(self):
+        self.tier('archive', '--before', '2024/2025')
+        url = reverse('material_list', args=[self.department.slug])
+        listing = self.client.get(url).content.decode()
+        self.assertNotIn('TEST101', listing)
+        self.assertNotIn('From past sessions', listing)
+        response = self.client.get(url, {'search': 'test'})
+        self.assertContains(response, 'From past sessions')
+        self.assertEqual([m.pk for m in response.context['archived']], [self.old.pk])
+
+        response = self.client.get(reverse('track_download', args=[self.old.pk]))
+        self.assertEqual(b''.join(response.streaming_content), b'file_content')
+        self.assertEqual(ArchivedMaterial.objects.get().download_count, 1)
+        self.assertEqual(self.client.get(reverse('track_download', args=[999999])).status_code, 404)
+
+    def test_restore_reverses_the_archive(self):
+        self.tier('archive')
+        self.assertIn('Moved 1 materials back', self.tier('restore', '--session', '2023/2024'))
+        self.assertFalse(ArchivedMaterial.objects.exists())
+        restored = Material.objects.get(pk=self.old.pk)
+        self.assertEqual((restored.code_key, restored.upload_date),
+                         ('TEST101', datetime(2024, 1, 5, tzinfo=dt_timezone.utc)))
+        with restored.file.open('rb') as f:
+            self.assertEqual(f.read(), b'file_content')
+        self.assertEqual(stored_files(self.cold_root, 'materials'), [])
+        self.assertEqual(facets.department_facets(self.department.id)[1], 2)
+
+    def history(self, material):
+        return [model.objects.filter(material_id=material.pk).count()
+                for model in (DownloadEvent, DownloadRollup, DownloaderSketch, MaterialPopularity)]
+
+    def test_download_history_survives_archiving(self):
+        downloads.record_download(self.old, self.student)
+        downloads.flush()
+        before = self.history(self.old)
+        self.assertEqual(before, [1, 2, 1, 1])
+        self.tier('archive')
+        self.assertEqual(self.history(self.old), before)
+        self.tier('restore')
+        self.assertEqual(Material.objects.get(pk=self.old.pk).download_rollups.count(), 2)
+
+        # Deleting a material for good still clears it, one at a time or in bulk
+        Material.objects.get(pk=self.old.pk).delete()
+        self.assertEqual(self.history(self.old), [0, 0, 0, 0])
+        downloads.record_download(self.current, self.student)
+        downloads.flush()
+        with self.captureOnCommitCallbacks(execute=True), override_settings(FILE_CLEANUP_WORKERS=0):
+            bulk_edit.delete_materials(Material.objects.filter(pk=self.current.pk))
+        self.assertEqual(self.history(self.current), [0, 0, 0, 0])
+
+    def test_archived_downloads_are_recorded_and_listed(self):
+        self.tier('archive')
+        response = self.client.get(reverse('track_download', args=[self.old.pk]))
+        b''.join(response.streaming_content)
+        self.assertEqual(downloads.flush(), 1)
+        self.assertEqual(self.history(self.old), [1, 2, 1, 1])
+
+        admin_user = User.objects.create(email="root@test.com", username="root",
+                                         is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:accounts_downloadrollup_changelist'))
+        self.assertEqual([row.material_title for row in response.context['cl'].result_list],
+                         [self.old.title] * 2)
+
+    def test_missing_files_are_skipped_and_reported(self):
+        missing = self.old.file.name
+        self.old.file.storage.delete(missing)
+        also_old = Material.objects.create(
+            title="Old Slides", code="CSC105", file=SimpleUploadedFile("slides.pdf", b"slides"),
+            session="2022/2023", department=self.department, level=self.level, uploaded_by=self.uploader,
+        )
+        err = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs('accounts.tiering', 'WARNING'):
+            call_command('tier_materials', 'archive', '--batch-size', '1', stdout=io.StringIO(), stderr=err)
+        self.assertIn(f'missing file, not moved: {missing}', err.getvalue())
+        self.assertEqual(list(ArchivedMaterial.objects.values_list('pk', flat=True)), [also_old.pk])
+        self.assertTrue(Material.objects.filter(pk=self.old.pk).exists())
+
+    def test_unreadable_archived_files_are_logged(self):
+        self.tier('archive')
+        with mock.patch.object(tiering.cold_storage, 'open', side_effect=OSError('disk gone')), \
+                self.assertLogs('accounts.tiering', 'ERROR') as logs:
+            response = self.client.get(reverse('track_download', args=[self.old.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('disk gone', logs.output[0])
+
+    def test_failed_batch_leaves_the_hot_tier_untouched(self):
+        with mock.patch.object(ArchivedMaterial.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                tiering.archive_materials('2024/2025')
+        self.assertTrue(Material.objects.filter(pk=self.old.pk).exists())
+        self.assertTrue(self.old.file.storage.exists(self.old.file.name))
+        self.assertEqual(stored_files(self.cold_root, 'materials'), [])
+
+
+class MediaLayoutTests(BaseTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, DEBUG=True)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        super().setUp()
+
+    def flat(self, name, content):
+        os.makedirs(os.path.join(self.media_root, 'materials'), exist_ok=True)
+        with open(os.path.join(self.media_root, 'materials', name), 'wb') as f:
+            f.write(content)
+        return Material.objects.create(title=name, code="CSC301", file=f'materials/{name}', session="2024/2025",
+                                       department=self.department, level=self.level, uploaded_by=self.uploader)
+
+    def test_new_uploads_are_sharded(self):
+        name = self.material.file.name
+        self.assertRegex(name, r'^materials/[0-9a-f]{2}/[0-9a-f]{2}/test[^/]*\.pdf$')
+        self.assertEqual(os.path.dirname(name), os.path.dirname(sharded_name('test.pdf')))
+
+    def test_migration_moves_files_and_resumes(self):
+        first = self.flat('a.pdf', b'first')
+        self.flat('b.pdf', b'second')
+        missing = Material.objects.create(title="gone", code="CSC302", file='materials/gone.pdf', session="2024/2025",
+                                          department=self.department, level=self.level, uploaded_by=self.uploader)
+        sleeps = []
+        report = media_layout.LayoutMigration(batch_size=1, rate=10, sleep=sleeps.append).run()
+        self.assertEqual((report.moved, report.missing, report.conflicts), (2, ['materials/gone.pdf'], 0))
+        self.assertEqual(len(sleeps), 3)  # one throttle pause per batch
+        self.assertTrue(all(0 < delay <= 0.1 for delay in sleeps))
+
+        first.refresh_from_db()
+        self.assertEqual(first.file.name, sharded_name('a.pdf'))
+        with first.file.open('rb') as f:
+            self.assertEqual(f.read(), b'first')
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'materials')).count('a.pdf'), 0)
+        missing.refresh_from_db()
+        self.assertEqual(missing.file.name, 'materials/gone.pdf')
+
+        out = io.StringIO()
+        call_command('migrate_media_layout', rate=0, stdout=out, stderr=io.StringIO())
+        self.assertIn('Moved 0 files, 1 missing', out.getvalue())
+
+    def test_rows_changed_mid_batch_keep_their_new_file(self):
+        material = self.flat('a.pdf', b'first')
+        migration = media_layout.LayoutMigration()
+        real_place = media_layout._place
+
+        def replace_during_move(storage, old, new):
+            placed = real_place(storage, old, new)
+            Material.objects.filter(pk=material.pk).update(file='materials/replacement.pdf')
+            return placed
+
+        with mock.patch.object(media_layout, '_place', replace_during_move):
+            report = migration.run()
+        self.assertEqual((report.moved, report.conflicts), (0, 1))
+        material.refresh_from_db()
+        self.assertEqual(material.file.name, 'materials/replacement.pdf')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, sharded_name('a.pdf'))))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'materials', 'a.pdf')))
+
+    def test_old_urls_redirect_to_the_sharded_file(self):
+        self.flat('a.pdf', b'first')
+        media_layout.LayoutMigration().run()
+        response = serve_media(RequestFactory().get('/media/materials/a.pdf'), 'materials/a.pdf')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], settings.MEDIA_URL + sharded_name('a.pdf'))
+        # Outside DEBUG only flat names the web server could not find reach the application
+        response = self.client.get('/media/materials/a.pdf')
+        self.assertRedirects(response, settings.MEDIA_URL + sharded_name('a.pdf'), status_code=301,
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.get('/media/materials/unknown.pdf').status_code, 404)
+
+    def test_colliding_names_stay_in_their_own_shard(self):
+        again = Material.objects.create(title="Again", code="CSC303", file=SimpleUploadedFile("test.pdf", b"again"),
+                                        session="2024/2025", department=self.department, level=self.level,
+                                        uploaded_by=self.uploader)
+        self.assertNotEqual(again.file.name, self.material.file.name)
+        self.assertEqual(again.file.name, sharded_name(again.file.name))
+
+    def test_rerun_after_a_crash_reuses_the_link(self):
+        material = self.flat('a.pdf', b'first')
+        target = os.path.join(self.media_root, sharded_name('a.pdf'))
+        os.makedirs(os.path.dirname(target))
+        os.link(os.path.join(self.media_root, 'materials', 'a.pdf'), target)  # linked, then the worker died
+        report = media_layout.LayoutMigration().run()
+        self.assertEqual((report.moved, report.taken), (1, []))
+        material.refresh_from_db()
+        self.assertEqual(material.file.name, sharded_name('a.pdf'))
+        self.assertEqual(os.listdir(os.path.dirname(target)), ['a.pdf'])
+
+    def test_names_taken_by_newer_uploads_stay_flat(self):
+        material = self.flat('a.pdf', b'first')
+        newer = os.path.join(self.media_root, sharded_name('a.pdf'))
+        os.makedirs(os.path.dirname(newer))
+        with open(newer, 'wb') as f:
+            f.write(b'newer upload')
+        report = media_layout.LayoutMigration().run()
+        self.assertEqual((report.moved, report.taken), (0, ['materials/a.pdf']))
+        material.refresh_from_db()
+        self.assertEqual(material.file.name, 'materials/a.pdf')
+        with open(newer, 'rb') as f:
+            self.assertEqual(f.read(), b'newer upload')
+
+
+class ReconcileTests(BaseTestCase):
+    def setUp(self):
+        self.media_root, self.cold_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for path in (self.media_root, self.cold_root):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, COLD_MEDIA_ROOT=self.cold_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        super().setUp()
+
+    def write(self, root, name, age_hours=48):
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        stamp = (datetime.now(dt_timezone.utc) - timedelta(hours=age_hours)).timestamp()
+        os.utime(path, (stamp, stamp))
+
+    def test_merge_join_of_sorted_streams(self):
+        stored = iter([('a', 1), ('b', 2), ('d', 4)])
+        self.assertEqual(list(reconcile.merge_join(iter(['b', 'c', 'd', 'e']), stored)),
+                         [('orphan', 'a', 1), ('missing', 'c', None), ('missing', 'e', None)])
+
+    def test_stored_files_are_in_the_same_order_as_the_database(self):
+        for name in ('materials/a.pdf', 'materials/a/b.pdf', 'materials/a-b.pdf', 'materials/B.pdf',
+                     'materials/ab/c.pdf'):
+            self.write(self.media_root, name)
+            Material.objects.create(title="t", code="CSC1", file=name, session="2024/2025",
+                                    department=self.department, level=self.level, uploaded_by=self.uploader)
+        names = [name for name, _ in reconcile.stored_files(self.material.file.storage, 'materials')]
+        self.assertEqual(names, sorted(names))
+        referenced = list(reconcile.referenced_names([(Material, 'file')], 'materials'))
+        self.assertEqual(referenced, sorted(referenced))
+        self.assertEqual(set(referenced) - set(names), {self.material.file.name} - set(names))
+
+    def test_reports_then_deletes_orphans_at_a_limited_rate(self):
+        self.write(self.media_root, self.material.file.name)
+        self.write(self.media_root, 'materials/aa/bb/deleted.pdf')
+        self.write(self.media_root, 'materials/orphan.pdf')
+        self.write(self.media_root, 'materials/cc/dd/uploading.pdf', age_hours=0)
+        self.write(self.media_root, 'archives/failed.zip')
+        self.write(self.cold_root, 'materials/old.pdf')
+        Material.objects.create(title="gone", code="CSC2", file='materials/ee/ff/gone.pdf', session="2024/2025",
+                                department=self.department, level=self.level, uploaded_by=self.uploader)
+
+        # A ctime cannot be set back, so these files are aged by their mtime alone
+        aged = mock.patch.object(reconcile, 'last_changed', lambda stat: stat.st_mtime)
+        aged.start()
+        self.addCleanup(aged.stop)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('reconcile_storage', stdout=out, stderr=err)
+        self.assertIn('Checked 6 files: 4 orphaned', out.getvalue())
+        self.assertIn('1 too recent to judge, 1 referenced but missing', out.getvalue())
+        self.assertIn('missing: materials/ee/ff/gone.pdf', err.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'materials/orphan.pdf')))
+
+        sleeps = []
+        with self.assertNumQueries(3):  # one ordered iterator per scope
+            report = reconcile.Reconciler(delete=True, rate=1000, sleep=sleeps.append).run()
+        self.assertEqual((report.orphans, report.deleted), (4, 4))
+        self.assertEqual(len(sleeps), 3)  # every deletion after the first waits its turn
+        self.assertEqual(sorted(stored_files(self.media_root, 'materials')),
+                         sorted([os.path.basename(self.material.file.name), 'uploading.pdf']))
+        self.assertEqual(stored_files(self.media_root, 'archives'), [])
+        self.assertEqual(stored_files(self.cold_root, 'materials'), [])
+
+
+    def test_freshly_linked_files_are_too_recent_to_judge(self):
+        # What the layout migration does: a new name for an old file, which keeps its mtime
+        self.write(self.media_root, 'materials/flat.pdf')
+        os.makedirs(os.path.join(self.media_root, 'materials/aa/bb'))
+        os.link(os.path.join(self.media_root, 'materials/flat.pdf'),
+                os.path.join(self.media_root, 'materials/aa/bb/flat.pdf'))
+        report = reconcile.Reconciler(delete=True).run()
+        self.assertEqual((report.recent, report.deleted), (2, 0))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'materials/aa/bb/flat.pdf')))
+
+
+class ExportTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Department.objects.create(name="Mathematics", code="MTH", faculty=self.faculty)
+        Material.objects.create(title="=HYPERLINK(1)", code="MTH101", file='materials/m.pdf', session="2023/2024",
+                                department=self.other, level=self.level, uploaded_by=self.uploader,
+                                download_count=3)
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_is_scoped_to_editable_materials(self):
+        other_uploader = User.objects.create_user(email='m@test.com', username='m', password='testpass123',
+                                                  is_uploader=True, department=self.other)
+        self.client.force_login(other_uploader)
+        response = self.client.get(reverse('export', args=['materials', 'csv']))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="materials-', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual([row['code'] for row in rows], ['MTH101'])
+        self.assertEqual(rows[0]['department'], 'Mathematics')
+        self.assertEqual(rows[0]['uploaded_by'], 'uploader@test.com')
+        self.assertEqual(rows[0]['title'], "'=HYPERLINK(1)")  # not run as a formula
+
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(reverse('export', args=['materials', 'csv'])).status_code, 302)
+
+    def test_jsonl_export_reads_rows_in_one_query(self):
+        response = exports.export_response('materials', Material.objects.all(), 'jsonl')
+        with self.assertNumQueries(1):
+            lines = self.content(response).splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['code'] for row in rows], ['TEST101', 'MTH101'])
+        self.assertEqual(rows[0]['level'], '100L')
+        self.assertIsNone(rows[1]['category'])
+
+        self.client.force_login(self.uploader)
+        response = self.client.get(reverse('export', args=['downloads', 'jsonl']), {'department': self.other.slug})
+        self.assertEqual([json.loads(line) for line in self.content(response).splitlines()], [
+            {'department': 'Mathematics', 'uploaded_by': 'uploader@test.com', 'materials': 1, 'downloads': 3},
+        ])
+
+    def test_output_is_chunked(self):
+        rows = [(i, 'title', 'CSC101') for i in range(1000)]
+        export = exports.Export('t', {'id': 'id', 'title': 'title', 'code': 'code'})
+        chunks = list(exports.encode_rows(export, iter(rows), 'csv', chunk_size=1024))
+        self.assertGreater(len(chunks), 10)
+        self.assertTrue(all(len(chunk) < 1100 for chunk in chunks))
+        self.assertEqual(len(b''.join(chunks).splitlines()), 1001)
+
+    @override_settings(ASYNC_VIEWS=True)
+    async def test_streams_asynchronously_under_asgi(self):
+        response = exports.export_response('materials', Material.objects.all(), 'csv')
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.splitlines()), 3)
+
+    def test_admin_action_exports_selection(self):
+        admin_user = User.objects.create(email='root@test.com', username='root', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:accounts_material_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.material.pk],
+        })
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual([row['id'] for row in rows], [str(self.material.pk)])
+
+
+class WarmUpTests(BaseTestCase):
+    def test_warm_up_builds_what_first_requests_need(self):
+        autocomplete.clear()
+        with mock.patch('accounts.warmup.connections') as warm_connections:
+            timings = warmup.warm_up()
+        self.assertEqual(set(timings), {'urls', 'templates', 'caches'})
+        # Closed so a preloading server does not hand one connection to every worker
+        warm_connections.close_all.assert_called_once_with()
+        self.assertIn('departments', autocomplete._indexes)
+        self.assertIn('base.html', warmup.template_names())
+        self.assertIn('emails/welcome.txt', warmup.template_names())
+
+    def test_unreachable_database_does_not_stop_a_worker(self):
+        with mock.patch('accounts.autocomplete.department_index', side_effect=DatabaseError('down')), \
+                mock.patch('accounts.warmup.connections'), self.assertLogs('accounts.warmup', 'WARNING'):
+            warmup.fill_caches()
+
+
+@override_settings(LAYERED_CACHE_REFRESH_WORKERS=0, LAYERED_CACHE_POLL_INTERVAL=0.01)
+class TwoTierCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        self.rng = 0.0  # no jitter, no early refresh
+        self.cache = TwoTierCache(alias='default', local_size=2, local_ttl=5, stale_ttl=60,
+                                  clock=lambda: self.now, rng=lambda: self.rng)
+        self.calls = []
+
+    def compute(self, value):
+        def compute():
+            self.calls.append(value)
+            return value
+        return compute
+
+    def test_local_tier_sits_in_front_of_the_shared_one(self):
+        self.assertEqual(self.cache.get_or_set('a', self.compute(1), 300), 1)
+        self.assertEqual(self.cache.get_or_set('a', self.compute(2), 300), 1)
+        self.now += 10  # past the local TTL: the shared tier is asked again
+        self.assertEqual(self.cache.get_or_set('a', self.compute(2), 300), 1)
+        for key in ('b', 'c'):
+            self.cache.get_or_set(key, self.compute(key), 300)
+        stats = self.cache.stats()
+        self.assertEqual(self.calls, [1, 'b', 'c'])
+        self.assertEqual((stats['misses'], stats['local_hits'], stats['shared_hits']), (3, 1, 1))
+        self.assertEqual(stats['local_entries'], 2)  # 'a' was evicted
+        self.assertEqual(stats['hit_rate'], 0.4)
+
+    def test_expired_value_is_served_while_it_is_recomputed(self):
+        self.cache.get_or_set('a', self.compute('old'), 300)
+        self.now += 301
+        self.assertEqual(self.cache.get_or_set('a', self.compute('new'), 300), 'old')
+        self.assertEqual(self.cache.get_or_set('a', self.compute('newer'), 300), 'new')
+        self.assertEqual(self.calls, ['old', 'new'])
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+    def test_early_refresh_and_jitter(self):
+        self.rng = 0.5
+        self.cache.set('a', 'old', 300, compute_time=30)
+        self.assertEqual(cache.get('a')[1], self.now + 285)  # lifetime shortened by the jitter
+        self.now += 200  # 85 s left: refreshed only when the draw is unlucky enough
+        self.cache.get_or_set('a', self.compute('new'), 300)
+        self.assertEqual(self.calls, [])
+        self.rng = 0.99  # -30 * ln(0.01) = 138 s
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get_or_set('a', self.compute('new'), 300), 'old')
+        self.assertEqual(self.calls, ['new'])
+        self.assertEqual(self.cache.stats()['early_refreshes'], 1)
+
+    def test_concurrent_misses_compute_once(self):
+        release = threading.Event()
+
+        def slow():
+            release.wait(5)
+            self.calls.append('computed')
+            return 'value'
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_set('hot', slow, 300)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while self.cache.stats().get('coalesced', 0) < 7:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(self.calls, ['computed'])
+
+    def test_waits_for_another_worker_computing_the_same_key(self):
+        cache.add('hot:computing', 12345, 10)  # held by another process
+        timer = threading.Timer(0.05, lambda: cache.set('hot', ('theirs', self.now + 300, 0.1)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(self.cache.get_or_set('hot', self.compute('ours'), 300), 'theirs')
+        self.assertEqual(self.calls, [])
+
+    def test_stats_view_is_for_superusers(self):
+        admin_user = User.objects.create(email='root@test.com', username='root', is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.json()['pid'], os.getpid())
+
+
+@override_settings(FILE_CLEANUP_WORKERS=0, BULK_EDIT_BATCH_SIZE=2)
+class BulkAdminActionTests(BaseTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        super().setUp()
+        cache.clear()
+        self.url = reverse('admin:accounts_material_changelist')
+        self.materials = [self.material] + [
+            Material.objects.create(title=f"Week {i}", code="CSC201", file=SimpleUploadedFile(f"w{i}.pdf", b"x"),
+                                    session="2023/2024", department=self.department, level=self.level,
+                                    uploaded_by=self.uploader)
+            for i in range(4)
+        ]
+        self.other_department = Department.objects.create(name="Mathematics", code="MTH", faculty=self.faculty)
+        other_uploader = User.objects.create_user(email='m@test.com', username='m', password='testpass123',
+                                                  is_uploader=True, department=self.other_department)
+        self.out_of_reach = Material.objects.create(
+            title="Algebra", code="MTH101", file='materials/algebra.pdf', session="2023/2024",
+            department=self.other_department, level=self.level, uploaded_by=other_uploader,
+        )
+        # Uploaders reach the admin as staff; get_queryset limits them to their department
+        self.uploader.is_staff = True
+        self.uploader.save(update_fields=['is_staff'])
+        self.client.force_login(self.uploader)
+
+    def test_bulk_edit_updates_each_batch_in_one_statement(self):
+        semester = Semester.objects.create(name="Second Semester")
+        level = Level.objects.create(name="200L")
+        MaterialPopularity.objects.create(material=self.material, department=self.department, level=self.level,
+                                          log_score=1.0)
+        generation = facets.generation(self.department.id)
+        data = {'action': 'bulk_edit', 'select_across': '1', '_selected_action': [self.material.pk]}
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'Change 5 materials')  # only this uploader's department
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {**data, 'apply': '1', 'semester': semester.pk,
+                                                   'level': level.pk, 'session': '2024/2025'})
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "accounts_material" ')]
+        self.assertEqual(len(updates), 3)  # 5 rows in batches of 2
+        self.assertRedirects(response, self.url)
+        self.assertEqual(set(Material.objects.filter(department=self.department)
+                             .values_list('semester', 'level', 'session')), {(semester.pk, level.pk, '2024/2025')})
+        self.assertGreater(Material.objects.get(pk=self.material.pk).modified, self.material.modified)
+        self.assertEqual(MaterialPopularity.objects.get(material=self.material).level, level)
+        self.assertEqual(Material.objects.get(pk=self.out_of_reach.pk).session, '2023/2024')
+        self.assertEqual(facets.generation(self.department.id), generation + 1)  # once, not once per row
+
+    def test_bulk_edit_needs_a_change(self):
+        response = self.client.post(self.url, {'action': 'bulk_edit', 'apply': '1',
+                                               '_selected_action': [self.material.pk]})
+        self.assertContains(response, 'Choose at least one value to change.')
+
+    def test_bulk_delete_removes_rows_then_files(self):
+        pks = [material.pk for material in self.materials]
+        names = [material.file.name for material in self.materials]
+        data = {'action': 'bulk_delete', '_selected_action': pks + [self.out_of_reach.pk]}
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'Delete 5 materials')
+        self.assertNotContains(response, 'value="delete_selected"')
+
+        with mock.patch('accounts.bulk_edit.broker') as live_broker, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {**data, 'apply': '1'})
+        self.assertRedirects(response, self.url)
+        self.assertFalse(Material.objects.filter(pk__in=pks).exists())
+        self.assertTrue(Material.objects.filter(pk=self.out_of_reach.pk).exists())
+        self.assertEqual(sorted(Tombstone.objects.filter(model='material').values_list('object_id', flat=True)),
+                         sorted(pks))
+        live_broker.publish.assert_called_once_with(self.department.id, {'type': 'resync'})
+        self.assertEqual([name for name in names if self.material.file.storage.exists(name)], [])
+
+    def test_file_still_referenced_is_kept(self):
+        twin = Material.objects.create(title="Twin", code="TEST101", file=self.material.file.name,
+                                       session="2023/2024", department=self.other_department,
+                                       level=self.level, uploaded_by=self.uploader)
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_edit.delete_materials(Material.objects.filter(pk=self.material.pk))
+        self.assertTrue(twin.file.storage.exists(twin.file.name))
+
+    def test_uploader_can_open_the_add_form(self):
+        response = self.client.get(reverse('admin:accounts_material_add'))
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,182 @@
+"""
+Hot/cold tiering of materials from past sessions.
+
+Listings, facets, indexes and backups only need the recent sessions, so
+materials from older sessions are moved to ``ArchivedMaterial`` and
+their files to ``cold_storage``. An archived material keeps its id.
+``track_download`` falls back to the archive for ids it cannot find, and
+listing searches show archived matches below the current ones, so old
+material stays reachable by a slower path.
+
+Moves run in batches. Each batch copies the files first. It then inserts
+the rows into the target table and deletes them from the source in one
+transaction, and only removes the source files after commit. A batch
+that fails leaves the source untouched. A row whose file is missing is
+left where it is and listed in the report; the rest of the run goes on.
+
+Per-material download history (raw events, rollups, unique-downloader
+sketches, trending scores) refers to materials by id without a database
+constraint. It stays in place while a material is archived and belongs
+to the row again once it is restored.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.http import FileResponse, Http404
+
+from . import downloads
+from .bulk_signals import moving_tiers
+from .facets import bump_department, filter_materials, search_filter
+from .models import ArchivedMaterial, Material
+from .storage import cold_storage
+
+logger = logging.getLogger(__name__)
+
+# Copied between the tiers as they are
+FIELDS = ('id', 'title', 'code', 'code_key', 'checksum', 'session', 'department_id', 'semester_id',
+          'category_id', 'level_id', 'uploaded_by_id', 'upload_date', 'modified', 'download_count')
+
+
+def hot_sessions(count=None):
+    """The ``count`` most recent sessions (``MATERIAL_HOT_SESSIONS``)"""
+    count = settings.MATERIAL_HOT_SESSIONS if count is None else count
+    sessions = Material.objects.order_by('-session').values_list('session', flat=True).distinct()
+    return list(sessions[:count])
+
+
+def archive_cutoff(count=None):
+    """Sessions sorting before this one are archived; None when there is nothing to archive"""
+    sessions = hot_sessions(count)
+    return sessions[-1] if sessions else None
+
+
+class TierReport:
+    def __init__(self):
+        self.moved = 0  # or, for a dry run, would move
+        self.missing = []  # names of source files that were not there; their rows stay put
+
+
+def _copy_file(name, source, target):
+    with source.open(name, 'rb') as f:
+        return target.save(name, f)
+
+
+def _move(rows, source, target, make_row, report, after_insert=None):
+    """Move one batch of rows and their files between the tiers; returns the rows moved"""
+    copied = []
+    moving = []
+
+    def delete_sources():
+        for row in moving:
+            source.delete(row.file.name)
+
+    try:
+        for row in rows:
+            try:
+                copied.append(_copy_file(row.file.name, source, target))
+            except FileNotFoundError:
+                logger.warning("Not moving %s %s: %s is missing", type(row).__name__, row.pk, row.file.name)
+                report.missing.append(row.file.name)
+            else:
+                moving.append(row)
+        if not moving:
+            return moving
+        moved = [make_row(row, name) for row, name in zip(moving, copied)]
+        with transaction.atomic(), moving_tiers():
+            type(moved[0]).objects.bulk_create(moved)
+            if after_insert:
+                after_insert(moving)
+            type(moving[0]).objects.filter(pk__in=[row.pk for row in moving]).delete()
+            transaction.on_commit(delete_sources)
+    except BaseException:
+        for name in copied:
+            target.delete(name)
+        raise
+    report.moved += len(moving)
+    return moving
+
+
+def _archived(material, name):
+    return ArchivedMaterial(file=name, **{field: getattr(material, field) for field in FIELDS})
+
+
+def _restored(archived, name):
+    return Material(file=name, **{field: getattr(archived, field) for field in FIELDS})
+
+
+def _restore_upload_dates(archived):
+    # bulk_create stamps auto_now_add fields; put the original upload dates back in one UPDATE.
+    # ``modified`` keeps its new value so delta-syncing clients see the row again.
+    Material.objects.filter(pk__in=[row.pk for row in archived]).update(upload_date=Case(
+        *[When(pk=row.pk, then=Value(row.upload_date)) for row in archived]
+    ))
+
+
+def _batches(queryset, batch_size):
+    """``queryset`` in primary-key batches; rows left behind by a batch are not read again"""
+    last = 0
+    while batch := list(queryset.filter(pk__gt=last)[:batch_size]):
+        last = batch[-1].pk
+        yield batch
+
+
+def archive_materials(before, batch_size=200, dry_run=False):
+    """Move materials from sessions sorting before ``before``; returns a TierReport"""
+    materials = Material.objects.filter(session__lt=before).order_by('pk')
+    report = TierReport()
+    if dry_run:
+        report.moved = materials.count()
+        return report
+    # Buffered download events still point at the rows about to go
+    downloads.flush()
+    for batch in _batches(materials, batch_size):
+        # Deleting the hot rows sends post_delete, which tombstones them and refreshes facets
+        _move(batch, default_storage, cold_storage, _archived, report)
+    return report
+
+
+def restore_materials(sessions=None, batch_size=200, dry_run=False):
+    """Move archived materials (of ``sessions``, or all) back; returns a TierReport"""
+    archived = ArchivedMaterial.objects.order_by('pk')
+    if sessions:
+        archived = archived.filter(session__in=sessions)
+    report = TierReport()
+    if dry_run:
+        report.moved = archived.count()
+        return report
+    departments = set()
+    for batch in _batches(archived, batch_size):
+        moved = _move(batch, cold_storage, default_storage, _restored, report, after_insert=_restore_upload_dates)
+        departments.update(material.department_id for material in moved)
+    # bulk_create sends no post_save; refresh facet counts and autocomplete once per department
+    for department_id in departments:
+        bump_department(department_id)
+    return report
+
+
+def archived_matches(department, filters, search_query):
+    """Archived materials for a listing search; only searched for when there is a query"""
+    if not search_query:
+        return []
+    archived = filter_materials(ArchivedMaterial.objects.filter(department=department), filters)
+    archived = archived.filter(search_filter(search_query)).select_related('level', 'category', 'semester')
+    return list(archived.order_by('title')[:settings.ARCHIVE_SEARCH_LIMIT])
+
+
+def archived_download(pk, user=None):
+    """Download response for an archived material, served from cold storage"""
+    archived = ArchivedMaterial.objects.only('file', 'department', 'level').filter(pk=pk).first()
+    if archived is None:
+        raise Http404("Material not found.")
+    try:
+        handle = cold_storage.open(archived.file.name, 'rb')
+    except OSError:
+        logger.exception("Cannot open archived material %s", pk)
+        raise Http404("File unavailable.")
+    ArchivedMaterial.objects.filter(pk=pk).update(download_count=F('download_count') + 1)
+    downloads.record_download(archived, user)
+    return FileResponse(handle, as_attachment=True, filename=os.path.basename(archived.file.name))
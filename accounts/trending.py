@@ -0,0 +1,115 @@
+"""
+Trending materials per department and level.
+
+Each download adds ``2 ** (hours since TRENDING_EPOCH / half-life)`` to a
+material's score, which is stored as its log2 in ``MaterialPopularity``.
+Older downloads are therefore worth exponentially less than new ones, yet
+stored scores never need to be decayed in place: the ranking they give is
+the same at any moment. Top-K lists are kept in the cache and rebuilt for
+the affected departments whenever downloads are flushed, through the
+two-tier cache.
+"""
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .caching import layered
+from .models import MaterialPopularity
+
+
+def _hours_weight(timestamp):
+    hours = (timestamp - settings.TRENDING_EPOCH).total_seconds() / 3600
+    return hours / settings.TRENDING_HALF_LIFE_HOURS
+
+
+def _log_add(a, b):
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def current_score(log_score, now=None):
+    """Decayed score as of ``now``: one fresh download is worth 1.0"""
+    return 2 ** (log_score - _hours_weight(now or timezone.now()))
+
+
+def _cache_key(department_id, level_id=None):
+    return f'trending:{department_id}:{level_id or "all"}'
+
+
+def apply_downloads(events):
+    """
+    Fold (material, department, level, user, timestamp) events into the
+    scores; returns the (department, level) pairs whose lists to refresh
+    """
+    weights = {}
+    owners = {}
+    for material_id, department_id, level_id, _, timestamp in events:
+        weights[material_id] = _log_add(weights.get(material_id), _hours_weight(timestamp))
+        owners[material_id] = (department_id, level_id)
+    if not weights:
+        return set()
+
+    with transaction.atomic():
+        existing = MaterialPopularity.objects.select_for_update().in_bulk(list(weights))
+        created = []
+        for material_id, weight in weights.items():
+            popularity = existing.get(material_id)
+            if popularity is None:
+                department_id, level_id = owners[material_id]
+                created.append(MaterialPopularity(
+                    material_id=material_id, department_id=department_id,
+                    level_id=level_id, log_score=weight))
+            else:
+                popularity.log_score = _log_add(popularity.log_score, weight)
+        MaterialPopularity.objects.bulk_update(
+            [existing[pk] for pk in weights if pk in existing], ['log_score'])
+        MaterialPopularity.objects.bulk_create(created)
+    return set(owners.values())
+
+
+def refresh_lists(touched):
+    """Rebuild the cached lists of the (department, level) pairs ``apply_downloads`` returned"""
+    for department_id in {department_id for department_id, _ in touched}:
+        refresh(department_id)
+    for department_id, level_id in touched:
+        refresh(department_id, level_id)
+
+
+def _compute(department_id, level_id=None):
+    rows = MaterialPopularity.objects.filter(department_id=department_id)
+    if level_id:
+        rows = rows.filter(level_id=level_id)
+    rows = rows.order_by('-log_score').select_related('material', 'level')[:settings.TRENDING_TOP_K]
+    return [
+        {
+            'id': row.material_id,
+            'title': row.material.title,
+            'code': row.material.code,
+            'level': row.level.name,
+            'download_url': reverse('track_download', args=[row.material_id]),
+            'log_score': row.log_score,
+        }
+        for row in rows
+    ]
+
+
+def refresh(department_id, level_id=None):
+    entries = _compute(department_id, level_id)
+    layered.set(_cache_key(department_id, level_id), entries, settings.TRENDING_CACHE_TIMEOUT)
+    return entries
+
+
+def top_materials(department_id, level_id=None, limit=None, now=None):
+    """Cached top materials with their current decayed score, best first"""
+    entries = layered.get_or_set(_cache_key(department_id, level_id),
+                                 lambda: _compute(department_id, level_id), settings.TRENDING_CACHE_TIMEOUT)
+    now = now or timezone.now()
+    return [
+        {**entry, 'score': round(current_score(entry['log_score'], now), 3)}
+        for entry in entries[:limit]
+    ]
@@ -1,11 +1,19 @@
-from django.urls import path
+from django.conf import settings
+from django.urls import path, re_path
 from .forms import EmailAuthenticationForm
-from . import views
+from . import api, caching, exports, pwa, views, async_views
+
+# Under ASGI the download, listing and AJAX routes use the async views
+served = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
     #basic pages
     path('', views.index, name='home'),
+
+    # progressive web app (served from the root so the worker's scope covers the site)
+    path('manifest.webmanifest', pwa.web_manifest, name='web_manifest'),
+    path('sw.js', pwa.service_worker, name='service_worker'),
     
     #authentication urls
     path('login/', views.login_view, name='login'),
@@ -14,19 +22,37 @@ urlpatterns = [
 
     #app functionality
     path('departments/', views.department_view, name='department_list'),
-    path('materials/<slug:slug>/', views.material_list_view, name='material_list'),
+    path('departments/autocomplete/', views.department_autocomplete, name='department_autocomplete'),
+    path('materials/<slug:slug>/', served.material_list_view, name='material_list'),
+    path('materials/<slug:slug>/trending/', views.trending_materials, name='trending_materials'),
+    path('materials/<slug:slug>/autocomplete/', views.material_autocomplete, name='material_autocomplete'),
 
     #protected upload route    
     path('materials-upload/', views.material_upload_view, name='materials_upload'),
+    path('materials-upload/archive/', views.archive_upload_view, name='archive_upload'),
+    path('materials-upload/archive/<int:pk>/', views.archive_status, name='archive_status'),
+    path('materials-upload/archive/<int:pk>/status/', views.archive_status_json, name='archive_status_json'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    re_path(r'^admin-dashboard/export/(?P<resource>materials|downloads)\.(?P<fmt>csv|jsonl)$',
+            exports.export, name='export'),
+    path('admin-dashboard/cache-stats/', caching.cache_stats, name='cache_stats'),
 
     #download tracking
-    path('download/<int:pk>/', views.track_download, name='track_download'),
+    path('download/<int:pk>/', served.track_download, name='track_download'),
 
     path('feedback/', views.feedback_view, name='feedback'),
 
+    # read-only catalog API (cursor pagination and delta sync)
+    re_path(r'^api/catalog/(?P<resource>faculties|departments|materials)/$', api.catalog, name='catalog'),
+
     # AJAX endpoints
-    path('ajax/load-departments/', views.load_departments, name='ajax_load_departments'),
+    path('ajax/load-departments/', served.load_departments, name='ajax_load_departments'),
   
-    path('load-semesters/', views.load_semesters, name='load_semesters'),
+    path('load-semesters/', served.load_semesters, name='load_semesters'),
 ]
+
+# Live updates hold a stream open indefinitely; a WSGI worker would buffer it forever
+if settings.ASYNC_VIEWS:
+    urlpatterns += [
+        path('materials/<slug:slug>/events/', async_views.material_events, name='material_events'),
+    ]
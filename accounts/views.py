@@ -1,5 +1,8 @@
-from django.http import FileResponse, Http404
+from django.http import FileResponse, Http404, HttpResponseNotModified
+import logging
+import mimetypes
 import os
+from functools import lru_cache
 from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
@@ -8,10 +11,26 @@ from .forms import EmailAuthenticationForm
 from django.contrib.auth.decorators import user_passes_test 
 from django.contrib.auth import login, authenticate, logout
 from django.http import JsonResponse
-from .forms import MaterialUploadForm, SignUpForm
-from .models import Material, Category, Semester, Department, Faculty
+from . import archives
+from .forms import MAX_UPLOAD_SIZE, ArchiveUploadForm, MaterialUploadForm, SignUpForm
+from .models import ArchiveImport, Material, Category, Semester, Department, Faculty
+from .trending import top_materials
+from .autocomplete import department_index, material_index
+from .facets import department_facets, filter_materials, search_filter, selected_filters
+from .hotfiles import hot_files, hot_static_files
+from .media_layout import legacy_name
+from .pwa import offline_page
+from .tiering import archived_download, archived_matches
+from .downloads import download_trend, record_download, trend_bars, unique_downloaders_by_material
 from django.db.models import Q # for search
+from django.db.models import F
 from django.core.mail import send_mail
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import serve, was_modified_since
+
+logger = logging.getLogger(__name__)
 
 
 def login_view(request):
@@ -153,46 +172,96 @@ def department_view(request):
             Q(faculty__name__icontains=search_query)
         )
     
-    return render(request, 'department-list.html', {
+    return offline_page(render(request, 'department-list.html', {
         'departments': departments.order_by('name'),
         'search_query': search_query
-    })
+    }))
 
 @login_required
 def material_list_view(request, slug):
     # Get the department
     department = get_object_or_404(Department, slug=slug)
     
-    # Get all materials for this department initially
-    materials = Material.objects.filter(department=department)
-    
     # Get filter parameters from request
-    selected_level = request.GET.get('level')
+    filters = selected_filters(request.GET)
     search_query = request.GET.get('search', '')
     
-    # Apply level filter if selected
-    if selected_level:
-        materials = materials.filter(level=selected_level)
+    facets, total = department_facets(department.id, search_query, filters)
+    
+    return offline_page(render(request, 'material-list.html', {
+        'live_updates': settings.ASYNC_VIEWS,
+        'department': department,
+        'materials': material_listing(department, filters, search_query),
+        'archived': archived_matches(department, filters, search_query),
+        'facets': facets,
+        'total': total,
+        'search_query': search_query,
+        'trending': top_materials(department.id, filters.get('level'), limit=5),
+    }))
+
+def material_listing(department, filters, search_query):
+    """Materials shown on a department's listing for the selected facets and search
+
+    Not filtered through ``Material.objects.accessible_to``: that rule governs
+    managing materials (it admits uploaders and owners only), while every
+    logged-in student browses and downloads the department catalog, as in
+    ``track_download``.
+    """
+    # Get all materials for this department initially
+    materials = Material.objects.filter(department=department)
+    
+    # Apply facet filters (level, category, semester, session)
+    materials = filter_materials(materials, filters)
     
     # Apply search filter if query exists
     if search_query:
-        materials = materials.filter(
-            Q(title__icontains=search_query) | 
-            Q(code__icontains=search_query)
-        )
-    
-    # Get all available levels for dropdown
-    levels = Material.objects.filter(department=department)\
-                           .values_list('level', flat=True)\
-                           .distinct()\
-                           .order_by('level')
+        materials = materials.filter(search_filter(search_query))
     
-    return render(request, 'material-list.html', {
-        'department': department,
-        'materials': materials.order_by('title'),  # Sort by title by default
-        'levels': levels,
-        'selected_level': selected_level,
-        'search_query': search_query,
+    materials = materials.select_related('level', 'category', 'semester', 'uploaded_by')
+    return materials.order_by('title')  # Sort by title by default
+
+def _limit(request, maximum):
+    try:
+        return max(min(int(request.GET.get('limit', maximum)), maximum), 1)
+    except ValueError:
+        return maximum
+
+@login_required
+def department_autocomplete(request):
+    query = request.GET.get('q', '')
+    return JsonResponse({
+        'query': query,
+        'suggestions': department_index().search(query, _limit(request, settings.AUTOCOMPLETE_LIMIT)),
+    })
+
+@login_required
+def material_autocomplete(request, slug):
+    department_id = department_index().slugs.get(slug)
+    if department_id is None:
+        raise Http404("Department not found.")
+    query = request.GET.get('q', '')
+    return JsonResponse({
+        'query': query,
+        'suggestions': material_index(department_id).search(query, _limit(request, settings.AUTOCOMPLETE_LIMIT)),
+    })
+
+def _level_id(value):
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+@login_required
+def trending_materials(request, slug):
+    department = get_object_or_404(Department.objects.only('id'), slug=slug)
+    entries = top_materials(department.id, _level_id(request.GET.get('level')),
+                            limit=_limit(request, settings.TRENDING_TOP_K))
+    return JsonResponse({
+        'department': slug,
+        'materials': [
+            {key: value for key, value in entry.items() if key != 'log_score'}
+            for entry in entries
+        ],
     })
 
 @login_required
@@ -210,9 +279,15 @@ def admin_dashboard(request):
         'last_upload': materials.first()
     }
     
+    recent = list(materials[:5])
+    unique_counts = unique_downloaders_by_material(recent)
+    for material in recent:
+        material.unique_downloaders = unique_counts[material.pk]
+
     return render(request, 'admin_dashboard.html', {
-        'materials': materials[:5],
-        'stats': stats
+        'materials': recent,
+        'stats': stats,
+        'trend': trend_bars(download_trend(material__uploaded_by=request.user)),
     })
 
 @login_required
@@ -236,17 +311,147 @@ def material_upload_view(request):
     
     return render(request, 'materials_upload.html', {'form': form})
 
+@login_required
+@user_passes_test(lambda u: u.is_uploader, login_url='/')
+def archive_upload_view(request):
+    if request.method == 'POST':
+        form = ArchiveUploadForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            job = form.save(commit=False)
+            job.uploaded_by = request.user
+            job.department_id = request.user.department_id
+            job.save()
+            archives.submit(job)
+            messages.success(request, 'Archive uploaded; its materials are being imported.')
+            return redirect('archive_status', pk=job.pk)
+    else:
+        form = ArchiveUploadForm(user=request.user)
+
+    return render(request, 'materials_upload_archive.html', {
+        'form': form,
+        'max_entries': settings.ARCHIVE_MAX_ENTRIES,
+        'max_size_mb': settings.ARCHIVE_MAX_UPLOAD_SIZE // (1024 * 1024),
+        'max_file_mb': MAX_UPLOAD_SIZE // (1024 * 1024),
+    })
+
+@login_required
+def archive_status(request, pk):
+    job = get_object_or_404(ArchiveImport, pk=pk, uploaded_by=request.user)
+    return render(request, 'materials_upload_status.html', {'job': job})
+
+@login_required
+def archive_status_json(request, pk):
+    job = get_object_or_404(ArchiveImport, pk=pk, uploaded_by=request.user)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'finished': job.status in ('done', 'failed'),
+        'total': job.total,
+        'processed': job.processed,
+        'imported': job.imported,
+        'skipped': job.skipped,
+        'errors': job.errors,
+        'message': job.message,
+    })
+
 @login_required
 def track_download(request, pk):
+    material = Material.objects.only('file', 'department', 'level').filter(pk=pk).first()
+    if material is None:
+        # Past sessions live in the archive tier
+        return archived_download(pk, request.user)
     try:
-        material = get_object_or_404(Material, pk=pk)
-        material.download_count += 1
-        material.save()
-
         file_path = material.file.path
-        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=os.path.basename(file_path))
-    except Material.DoesNotExist:
-        raise Http404("Material not found.")
-    except Exception as e:
-        print(f'Download error: {e}')
-        raise Http404("File unavailable.")
\ No newline at end of file
+        mapped = hot_files.open(file_path)
+        handle = mapped or open(file_path, 'rb')
+    except (OSError, ValueError):
+        logger.exception("Download of material %s failed", pk)
+        raise Http404("File unavailable.")
+
+    # Only downloads that actually start are counted
+    Material.objects.filter(pk=pk).update(download_count=F('download_count') + 1)
+    record_download(material, request.user)
+    response = FileResponse(handle, as_attachment=True, filename=os.path.basename(file_path))
+    if mapped:
+        response.block_size = settings.DOWNLOAD_CHUNK_SIZE
+    return response
+
+def legacy_media(request, name):
+    """
+    Redirect a flat ``materials/`` URL from before the sharded layout. The
+    web server in front serves MEDIA_ROOT and passes on only the names it
+    cannot find (see the README).
+    """
+    moved_to = legacy_name(f'materials/{name}')
+    if moved_to is None:
+        raise Http404("File not found.")
+    return redirect(settings.MEDIA_URL + moved_to, permanent=True)
+
+
+def serve_media(request, path):
+    """Development media server that answers hot files from the mmap cache"""
+    moved_to = legacy_name(path)
+    if moved_to:
+        # A flat materials/ URL from before the sharded layout
+        return redirect(settings.MEDIA_URL + moved_to, permanent=True)
+    mapped = hot_files.open(safe_join(settings.MEDIA_ROOT, path))
+    if mapped is None:
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
+    response = FileResponse(mapped)
+    response.block_size = settings.DOWNLOAD_CHUNK_SIZE
+    return response
+
+
+@lru_cache(maxsize=4)
+def _hashed_static_names(manifest_hash):
+    return frozenset(staticfiles_storage.hashed_files.values())
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip; ``gzip;q=0`` refuses it"""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+
+def serve_static(request, path):
+    """
+    Collected static files. Content-hashed names never change, so they are
+    cached for a year; gzip copies written by collectstatic are sent to
+    clients that accept them.
+    """
+    file_path = safe_join(settings.STATIC_ROOT, path)
+    if not os.path.isfile(file_path):
+        raise Http404("Static file not found.")
+
+    served_path, encoding = file_path, None
+    if accepts_gzip(request.headers.get('Accept-Encoding', '')) and os.path.isfile(file_path + '.gz'):
+        served_path, encoding = file_path + '.gz', 'gzip'
+    stat = os.stat(served_path)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(file_path)
+    mapped = hot_static_files.open(served_path)
+    response = FileResponse(mapped or open(served_path, 'rb'),
+                            content_type=content_type or 'application/octet-stream',
+                            filename=os.path.basename(file_path))
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(stat.st_size)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Vary'] = 'Accept-Encoding'
+    hashed = path in _hashed_static_names(getattr(staticfiles_storage, 'manifest_hash', ''))
+    response['Cache-Control'] = ('public, max-age=31536000, immutable' if hashed
+                                 else f'public, max-age={settings.STATIC_MAX_AGE}')
+    return response
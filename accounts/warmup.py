@@ -0,0 +1,96 @@
+"""
+Worker warm-up: do the work of a worker's first requests before it takes
+traffic.
+
+A fresh worker would otherwise make its first visitors wait while it
+compiles the URL resolver, loads and compiles templates, reads the static
+files manifest and builds the in-process lookup indexes.
+``studyhub/wsgi.py`` and ``studyhub/asgi.py`` call ``warm_up`` once the
+application is built. That happens in each worker after the fork unless
+the server preloads the application. It cannot run from
+``AppConfig.ready``, which is too early for database queries and also runs
+for every management command.
+
+The database connection used here is closed again, so a preloading server
+never shares one socket between forked workers.
+"""
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import DatabaseError, connections
+from django.template.loader import get_template
+from django.urls import get_resolver, reverse
+
+from . import autocomplete, pwa
+from .views import _hashed_static_names
+
+logger = logging.getLogger(__name__)
+
+# Named routes reversed on nearly every page (navigation, forms, the service worker)
+COMMON_ROUTES = ('home', 'login', 'logout', 'signup', 'department_list', 'materials_upload',
+                 'admin_dashboard', 'feedback', 'web_manifest', 'service_worker')
+
+
+def resolve_urls():
+    """Import every view module and compile the URL patterns"""
+    resolver = get_resolver()
+    resolver.reverse_dict  # populates the resolver, importing the URLconf and every view module
+    for name in COMMON_ROUTES:
+        reverse(name)
+    return len(resolver.reverse_dict)
+
+
+def template_names():
+    """Names of the project's own templates (not those of contrib apps)"""
+    roots = [str(path) for engine in settings.TEMPLATES for path in engine.get('DIRS', [])]
+    roots.append(os.path.join(apps.get_app_config('accounts').path, 'templates'))
+    names = []
+    for root in roots:
+        for directory, _, files in os.walk(root):
+            names += [os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/')
+                      for name in files]
+    return sorted(set(names))
+
+
+def compile_templates():
+    """Load every project template into the cached template loader"""
+    names = template_names()
+    for name in names:
+        get_template(name)
+    return len(names)
+
+
+def fill_caches():
+    """Read the static files manifest and build the in-process lookup indexes"""
+    pwa.static_version()
+    _hashed_static_names(getattr(staticfiles_storage, 'manifest_hash', ''))
+    try:
+        autocomplete.department_index()
+    except DatabaseError as e:
+        # A worker that cannot reach the database still starts; the index is built on first use
+        logger.warning("Warm-up skipped the lookup indexes: %s", e)
+    finally:
+        connections.close_all()
+
+
+STEPS = (
+    ('urls', resolve_urls),
+    ('templates', compile_templates),
+    ('caches', fill_caches),
+)
+
+
+def warm_up():
+    """Run every warm-up step; returns ``{step: seconds}``"""
+    timings = {}
+    for name, step in STEPS:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+    logger.info("Warmed up in %.0f ms (%s)", sum(timings.values()) * 1000,
+                ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items()))
+    return timings
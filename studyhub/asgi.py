@@ -2,6 +2,10 @@
 ASGI config for studyhub project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serving through this module also switches the download, listing and AJAX
+routes to their async versions in ``accounts.async_views``, e.g.::
+
+    uvicorn studyhub.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -12,5 +16,14 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'studyhub.settings')
+os.environ.setdefault('STUDYHUB_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Pay for URL compilation, templates and lookup indexes before the first request does
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_UP_WORKERS:
+    from accounts.warmup import warm_up  # noqa: E402
+
+    warm_up()
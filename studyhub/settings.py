@@ -1,3 +1,5 @@
+import os
+from datetime import datetime, timezone
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +41,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.admission.AdmissionControlMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -62,6 +65,38 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'studyhub.wsgi.application'
 
+# studyhub/asgi.py turns this on so downloads and listings use accounts.async_views
+ASYNC_VIEWS = os.environ.get('STUDYHUB_ASYNC_VIEWS') == '1'
+
+# studyhub/wsgi.py and studyhub/asgi.py warm each worker up before it serves (accounts.warmup)
+WARM_UP_WORKERS = os.environ.get('STUDYHUB_WARM_UP', '1') == '1'
+
+
+# Caches
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+# Share the default cache between workers and hosts in production (generations, facets, trending).
+# Required as soon as more than one worker process serves the site: facet generations kept in
+# per-process local memory go stale in every other worker. `manage.py check --deploy` fails without it.
+if os.environ.get('STUDYHUB_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['STUDYHUB_REDIS_URL'],
+    }
+
+# Two-tier cache (accounts.caching): an in-process LRU in front of this alias
+LAYERED_CACHE = 'default'
+LAYERED_CACHE_LOCAL_SIZE = 1024  # entries per process
+LAYERED_CACHE_LOCAL_TTL = 5  # seconds a local copy is trusted without asking the shared tier
+LAYERED_CACHE_STALE_TTL = 120  # seconds an expired value may still be served while it is recomputed
+LAYERED_CACHE_LOCK_TIMEOUT = 10  # seconds other workers wait for one computation
+LAYERED_CACHE_POLL_INTERVAL = 0.05
+LAYERED_CACHE_REFRESH_WORKERS = 2  # background threads; 0 refreshes inline
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -125,7 +160,17 @@ BASE_URL = 'http://127.0.0.1:8000'
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
-STATIC_URL = 'accounts/static/'
+STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed names plus gzip copies; see accounts/storage.py
+STORAGES = {
+    'default': {'BACKEND': 'accounts.storage.MediaStorage'},
+    'staticfiles': {'BACKEND': 'accounts.storage.PrecompressedManifestStaticFilesStorage'},
+}
+STATIC_MAX_AGE = 300  # seconds, for static files requested by their unhashed names
+# Set STUDYHUB_SERVE_STATIC=0 when the web server in front serves STATIC_ROOT itself
+SERVE_STATIC = os.environ.get('STUDYHUB_SERVE_STATIC', '1') == '1'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -138,3 +183,97 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/department_list/'
 LOGOUT_REDIRECT_URL = '/login/'
+
+# Admin changelists switch from COUNT(*) to the planner's estimate above this many rows
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 50000
+
+# Download events are buffered per process and written in batches
+DOWNLOAD_EVENT_BATCH_SIZE = 100
+DOWNLOAD_EVENT_FLUSH_INTERVAL = 10  # seconds
+DOWNLOAD_EVENT_FLUSH_TIMER = True  # also flush on a timer, not only after requests
+DOWNLOAD_EVENT_RETENTION_DAYS = 30
+DOWNLOAD_HOURLY_ROLLUP_RETENTION_DAYS = 90
+
+# Trending materials: a download loses half its weight every TRENDING_HALF_LIFE_HOURS
+TRENDING_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TRENDING_HALF_LIFE_HOURS = 72
+TRENDING_TOP_K = 10
+TRENDING_CACHE_TIMEOUT = 300  # seconds
+
+# Downloads are streamed in chunks of this many bytes
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Live material-list updates (Server-Sent Events, ASGI only)
+LIVE_UPDATES_QUEUE_SIZE = 50
+LIVE_UPDATES_HEARTBEAT = 15  # seconds
+
+# Download admission control (accounts.admission)
+ADMISSION_RATE = 0.5  # downloads per second per user, sustained
+ADMISSION_BURST = 10
+ADMISSION_USER_STREAMS = 3
+ADMISSION_GLOBAL_STREAMS = 200
+ADMISSION_RETRY_AFTER = 5  # seconds, for stream-limit rejections
+ADMISSION_STREAM_TTL = 3600  # stream counters expire if a worker dies mid-download
+
+# Memory-mapped cache for frequently downloaded files (accounts.hotfiles)
+HOT_FILE_CACHE_BYTES = 256 * 1024 * 1024
+HOT_FILE_MAX_BYTES = 32 * 1024 * 1024
+HOT_FILE_ADMIT_AFTER = 2  # requests before a file is mapped
+HOT_FILE_MIN_AGE = 60  # seconds since the last write before a file may be mapped
+HOT_STATIC_FILE_CACHE_BYTES = 32 * 1024 * 1024  # collected static files, kept apart from media
+
+# Facet counts on material listings are cached per department generation
+FACET_CACHE_TIMEOUT = 300  # seconds
+
+# Search-box autocomplete (in-process prefix indexes)
+AUTOCOMPLETE_LIMIT = 10  # suggestions per request, also the maximum ?limit=
+
+# Read-only catalog API
+CATALOG_API_PAGE_SIZE = 100
+CATALOG_API_MAX_PAGE_SIZE = 500
+
+# Progressive web app: files the service worker stores on install
+PWA_PRECACHE = [
+    'css/main.css', 'css/pages/department-list.css', 'css/pages/material-list.css',
+    'js/main.js', 'images/logo.png',
+]
+PWA_MAX_CACHED_PAGES = 50
+
+# ZIP archive uploads, unpacked in the background (accounts.archives)
+ARCHIVE_MAX_UPLOAD_SIZE = 200 * 1024 * 1024
+ARCHIVE_MAX_ENTRIES = 500
+ARCHIVE_MAX_TOTAL_SIZE = 1024 * 1024 * 1024  # uncompressed, counted while extracting
+ARCHIVE_MAX_RATIO = 100  # per entry; anything higher is treated as a zip bomb
+ARCHIVE_IMPORT_WORKERS = 2  # background threads; 0 runs imports inline after commit
+ARCHIVE_IMPORT_STALE_MINUTES = 30  # queued or running jobs untouched this long are resumed
+
+# Student accounts from class lists (accounts.provisioning, the provision_students command)
+ADMIN_CLASS_LIST_MAX_PASSWORDS = 50  # hashed inline by the admin action; longer lists go through the command
+
+# Outgoing mail in bulk (welcome emails for provisioned students)
+EMAIL_BATCH_SIZE = 100  # messages per send_messages() call on the shared connection
+MAIL_WORKERS = 1  # background threads sending mail; 0 sends inline after commit
+
+# New-material digests (accounts.digests, sent by the send_material_digests command)
+DIGEST_WINDOW_HOURS = 24  # first window for a department; later windows start where the last ended
+DIGEST_RECIPIENTS_PER_MESSAGE = 50  # students blind-copied on each message
+DIGEST_CLAIM_MINUTES = 30  # a digest left 'sending' this long by a run that died is sent again
+
+# Hot/cold tiering of past sessions (accounts.tiering, the tier_materials command)
+COLD_MEDIA_ROOT = BASE_DIR / 'cold_media'  # files of archived materials; may live on slower disks
+MATERIAL_HOT_SESSIONS = 3  # most recent sessions kept in the Material table
+ARCHIVE_SEARCH_LIMIT = 20  # archived matches shown under a listing search
+
+# Sharded media layout migration (the migrate_media_layout command)
+MEDIA_MIGRATION_RATE = 100  # files per second, so backups and downloads keep their disk bandwidth
+
+# Storage reconciliation (the reconcile_storage command)
+RECONCILE_GRACE_HOURS = 24  # unreferenced files younger than this may belong to an upload in progress
+RECONCILE_DELETE_RATE = 50  # orphan deletions per second
+
+# Streaming exports (accounts.exports)
+EXPORT_CHUNK_SIZE = 2000  # rows fetched per database round trip
+
+# Bulk admin actions on materials (accounts.bulk_edit)
+BULK_EDIT_BATCH_SIZE = 500  # rows per UPDATE/DELETE
+FILE_CLEANUP_WORKERS = 1  # background threads removing deleted materials' files; 0 removes inline after commit
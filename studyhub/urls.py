@@ -1,7 +1,8 @@
+import re
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from accounts.views import legacy_media, serve_media, serve_static
 from django.views.generic import RedirectView
 from django.contrib.auth import views as auth_views
 
@@ -19,4 +20,22 @@ urlpatterns = [
          ), name='password_reset_confirm'),
     path('password-reset-complete/', auth_views.PasswordResetCompleteView.as_view(
              template_name='password_reset_complete.html'),name='password_reset_complete'),    
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Development media serving, with hot files answered from the mmap cache
+if settings.DEBUG:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media),
+    ]
+else:
+    # Flat materials/ URLs from before the sharded layout, passed on by the web server when it has no such file
+    urlpatterns += [
+        re_path(r'^%smaterials/(?P<name>[^/]+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), legacy_media),
+    ]
+
+# Collected static files with far-future caching, unless the web server in front serves STATIC_ROOT
+# (runserver serves them itself when DEBUG)
+if settings.SERVE_STATIC:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static),
+    ]
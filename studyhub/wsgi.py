@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'studyhub.settings')
 
 application = get_wsgi_application()
+
+# Pay for URL compilation, templates and lookup indexes before the first request does
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_UP_WORKERS:
+    from accounts.warmup import warm_up  # noqa: E402
+
+    warm_up()